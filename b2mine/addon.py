@@ -0,0 +1,1024 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import pickle
+import time
+
+from . import morton
+from . import trace
+from . import progress
+from . import block_map
+from . import block_def
+from . import mesh_data
+from . import incremental
+from . import block_io
+from . import cache
+from . import delta
+from . import merge
+from . import occlusion
+from . import sampler
+from . import voxelizer
+from . import pyramid
+from . import preview
+from . import pipeline
+from . import transfer
+from . import schematic
+from . import voxel
+from . import convert2block
+from .mcpi import minecraft
+from .mcpi import block
+
+if "bpy" in locals():
+    import importlib
+    # Every module after the ones it imports from
+    for module in (morton, trace, progress, block_map, block_def, mesh_data,
+                   incremental, block_io, cache, delta, merge, occlusion,
+                   sampler, voxelizer, pyramid, preview, pipeline, transfer,
+                   schematic, voxel, convert2block, minecraft, block):
+        importlib.reload(module)
+    print("Reloaded multifiles")
+else:
+    print("Imported multifiles")
+
+from .block_map import BlockMap  # noqa
+
+import bpy  # noqa
+from bpy.props import *  # noqa
+import numpy as np  # noqa
+from mathutils import Vector  # noqa
+
+
+class Global(object):
+    ID_BLOCK_MAP = "block_map"
+    ID_BLOCK_MAP_FILE = "block_map_file"
+    ID_INCREMENTAL_STATE = "incremental_state"
+    ID_PREVIEW_OBJECT = "preview_object"
+    ID_PYRAMID = "pyramid"
+
+
+def store_block_map(obj, block_map):
+    """Serialize block_map into obj, or into its sidecar file if one is set
+    :param bpy.types.Object obj:
+    :param BlockMap block_map:
+    """
+    for key in (Global.ID_BLOCK_MAP, Global.ID_BLOCK_MAP_FILE):
+        if key in obj:
+            del obj[key]
+
+    if obj.BlockMapFile:
+        block_io.dump(block_map, bpy.path.abspath(obj.BlockMapFile))
+        obj[Global.ID_BLOCK_MAP_FILE] = obj.BlockMapFile
+    else:
+        obj[Global.ID_BLOCK_MAP] = block_io.dumps(block_map)
+
+
+def load_pyramid(obj):
+    """
+    :param bpy.types.Object obj:
+    :return: pyramid.Pyramid of the last conversion of obj, or None
+    """
+    if Global.ID_PYRAMID not in obj:
+        return None
+    return pyramid.Pyramid.loads(obj[Global.ID_PYRAMID])
+
+
+def switch_lod(obj, context):
+    """Update of LodLevel: store and preview a coarser level of the last
+    conversion without converting again
+    """
+    pyr = load_pyramid(obj)
+    if pyr is None:
+        return
+    depth = max(pyr.max_depth - obj.LodLevel, 1)
+    store_block_map(obj, pyr.block_map(depth))
+
+    cells, rgb = pyr.cells(depth)
+    target = bpy.data.objects.get(obj.get(Global.ID_PREVIEW_OBJECT, ""))
+    target = convert2block.draw_preview(
+        cells, rgb, tuple(pyr.origin.tolist()), pyr.cell_unit(depth), target
+    )
+    obj[Global.ID_PREVIEW_OBJECT] = target.name
+
+
+_caches = {}
+
+
+def cache_directory(scene):
+    if scene.B2CacheDir:
+        return bpy.path.abspath(scene.B2CacheDir)
+    return cache.DEFAULT_DIRECTORY
+
+
+def conversion_cache(scene):
+    """Cache set on the scene, kept between conversions for its statistics
+    :param bpy.types.Scene scene:
+    :rtype: cache.ConversionCache
+    """
+    directory = cache_directory(scene)
+    if directory not in _caches:
+        _caches[directory] = cache.ConversionCache(directory)
+    found = _caches[directory]
+    found.max_bytes = scene.B2CacheSize * (1 << 20)
+    return found
+
+
+def flush_trace():
+    """Print the trace of the last operation and export it to the file
+    named by B2MINE_TRACE, when tracing is enabled
+    """
+    if not trace.enabled():
+        return
+    print(trace.report())
+    path = os.environ.get(trace.ENV_VAR)
+    if path:
+        trace.export_chrome(bpy.path.abspath(path))
+    trace.reset()
+
+
+def show_progress(context, text):
+    """Show text in the panels, an empty text hides it
+    :param bpy.types.Context context:
+    :param str text:
+    """
+    context.scene.B2Progress = text
+    for area in context.screen.areas:
+        if area.type == "PROPERTIES":
+            area.tag_redraw()
+
+
+def open_block_map_chunks(obj):
+    """Read where obj stores its block map, on the main thread
+    :param bpy.types.Object obj:
+    :return: number of blocks and an iterator of the chunks, which may be
+        consumed in another thread
+    """
+    if Global.ID_BLOCK_MAP_FILE in obj:
+        path = bpy.path.abspath(obj[Global.ID_BLOCK_MAP_FILE])
+        reader = block_io.BlockMapReader.open(path)
+        return len(reader), _iter_closing(reader)
+
+    if Global.ID_BLOCK_MAP not in obj:
+        raise Exception("No block data")
+
+    data = bytes(obj[Global.ID_BLOCK_MAP])
+    if block_io.is_block_map(data):
+        reader = block_io.BlockMapReader(data)
+        return len(reader), reader.iter_chunks()
+
+    # Pickled by a version predating the binary format
+    block_map = pickle.loads(data)
+    if not isinstance(block_map, BlockMap):
+        block_map = BlockMap.from_blocks(block_map)
+    return len(block_map), iter([block_map])
+
+
+def _iter_closing(reader):
+    with reader:
+        for chunk in reader.iter_chunks():
+            yield chunk
+
+
+def iter_block_map_chunks(obj):
+    """Yield the stored block map of obj chunk by chunk
+    :param bpy.types.Object obj:
+    """
+    return open_block_map_chunks(obj)[1]
+
+
+class MineManager(object):
+
+    def __init__(self):
+        self.mc = None
+        self.connected = False
+        self.address = "localhost"
+        self.port = 4711
+        # Blocks last sent at every anchor, in world offsets
+        self.sent = {}
+
+    def connect(self, address="localhost", port=4711):
+        self.address = address
+        self.port = port
+        self.mc = minecraft.Minecraft.create(address, port)
+        self.sent = {}
+
+    def get_pos(self):
+        return self.mc.player.getPos()
+
+    def set_block(self):
+        pos = self.mc.player.getPos()
+        self.mc.setBlock(pos.x, pos.y + 1, pos.z + 1, block.STONE)
+
+    @staticmethod
+    def to_world(block_map):
+        """Grid positions to block offsets from the player
+        :param BlockMap block_map:
+        :rtype: BlockMap
+        """
+        return transfer.to_world(block_map)
+
+    def set_bunch_of_blocks(self, merge_blocks=True,
+                            connections=transfer.DEFAULT_CONNECTIONS,
+                            delta_sync=True, verify=False, chunks=None,
+                            progress=None, coarse=None, cull=0,
+                            cull_fill=None):
+        """Send the block map of the active object around the player
+        :param bool merge_blocks: merge blocks into cuboids sent by setBlocks
+        :param int connections: number of connections writing in parallel
+        :param bool delta_sync: only send what changed since the last send
+            at the same player position
+        :param bool verify: read the ids and data of the build back and
+            repair the blocks that differ
+        :param tuple chunks: (number of blocks, iterator of chunks) as
+            returned by open_block_map_chunks, read from the active object
+            by default. Pass them to call this from another thread.
+        :param progress.Progress progress: follows and may cancel the send
+        :param tuple coarse: chunks of a coarser build sent first, as
+            large as the block map, which then replaces it
+        :param int cull: blocks of shell kept when leaving out the blocks
+            no player can see, 0 to send every block
+        :param int cull_fill: block id of hidden blocks, None to drop them
+        :rtype: transfer.TransferStats
+        """
+        if chunks is None:
+            chunks = open_block_map_chunks(bpy.context.active_object)
+        if coarse is not None:
+            self.set_bunch_of_blocks(
+                merge_blocks, connections, delta_sync, chunks=coarse,
+                progress=progress, cull=cull, cull_fill=cull_fill
+            )
+            # Only the differences to the coarse build are left to send
+            delta_sync = True
+        num_blocks, chunks = chunks
+        if progress is not None:
+            progress.total_blocks = num_blocks
+            progress.start_stage("send")
+        pos = self.mc.player.getPos()
+        anchor = tuple(int(math.floor(v)) for v in (pos.x, pos.y, pos.z))
+
+        tracker = delta.DeltaTracker(
+            self.sent.get(anchor) if delta_sync else None
+        )
+        stats = transfer.TransferStats(0, 0, 0.0)
+        world = transfer.WorldTransform().apply_chunks(
+            chunks, num_blocks, progress
+        )
+        if cull:
+            # Counted first, the map being culled in place: it was built
+            # here and is the only copy of the blocks
+            stats.commands_saved = self._count_commands(world, merge_blocks)
+            world, stats.hidden_blocks = occlusion.cull(
+                world, cull, cull_fill, in_place=True
+            )
+            stats.commands_saved -= self._count_commands(world, merge_blocks)
+        num_blocks = len(world)
+        if progress is not None:
+            progress.total_blocks = num_blocks
+
+        def changes():
+            done = 0
+            for block_map in transfer.column_slices(world, anchor):
+                done += len(block_map)
+                if progress is not None:
+                    progress.fraction = done / float(num_blocks)
+                yield tracker.changes(block_map)
+            # Known once every slice went through the tracker
+            for block_map in transfer.column_slices(
+                    tracker.removals(), anchor):
+                yield block_map
+
+        # One set of connections for the whole transfer, slices being
+        # merged as the connections ask for them
+        sender = transfer.AsyncSender(self.address, self.port, connections)
+        self._send(sender, changes(), anchor, merge_blocks, stats, progress)
+
+        # Only recorded once complete, a cancelled send is compared with
+        # what was there before and sent again
+        self.sent[anchor] = world
+        if verify:
+            if progress is not None:
+                progress.start_stage("verify")
+            repair = delta.find_mismatches(
+                self.sent[anchor],
+                lambda lower, upper: self.read_region(anchor, lower, upper),
+                lambda positions: delta.parse_block_data(sender.query(
+                    delta.block_data_queries(positions, anchor)))
+            )
+            stats.repaired_blocks = len(repair)
+            trace.count("blocks repaired", len(repair))
+            if len(repair):
+                self._send(sender, transfer.column_slices(repair, anchor),
+                           anchor, merge_blocks, stats, progress)
+
+        stats.unchanged_blocks = tracker.num_unchanged
+        trace.count("unchanged blocks skipped", tracker.num_unchanged)
+        return stats
+
+    def read_region(self, anchor, lower, upper):
+        """world.getBlocks of a box given in offsets from anchor
+        :return: raw reply
+        """
+        corners = [a + v for a, v in zip(anchor * 2, lower + upper)]
+        return self.mc.conn.sendReceive("world.getBlocks", *corners)
+
+    @staticmethod
+    def _count_commands(block_map, merge_blocks):
+        if merge_blocks:
+            return len(merge.merge_cuboids(block_map))
+        return len(block_map)
+
+    @staticmethod
+    def _send(sender, slices, anchor, merge_blocks, stats, progress=None):
+        """
+        :param transfer.AsyncSender sender:
+        :param slices: iterable of BlockMap, see transfer.column_slices
+        """
+        if progress is not None:
+            progress.check()
+
+        def commands():
+            for block_map in slices:
+                if not len(block_map):
+                    continue
+                if merge_blocks:
+                    cuboids = merge.merge_cuboids(block_map)
+                else:
+                    cuboids = merge.CuboidList(
+                        block_map.positions, block_map.positions,
+                        block_map.block_ids, block_map.block_data
+                    )
+                lines, _ = transfer.chunk_commands(cuboids, anchor)
+                yield lines, len(block_map)
+
+        result = sender.send_slices(commands(), progress)
+        stats.num_blocks += result.num_blocks
+        stats.num_commands += result.num_commands
+        stats.seconds += result.seconds
+
+
+mm = MineManager()
+
+
+class MineConnectOperator(bpy.types.Operator):
+    bl_idname = "ws_takuro.mine_connect"
+    bl_label = "Connect"
+
+    def __init__(self, *args, **kwargs):
+        super(MineConnectOperator, self).__init__(*args, **kwargs)
+        bpy.context.scene.McStatus = "DISCONNECTED"
+
+    def execute(self, context):
+        mm.connect(context.scene.McIpAddr, context.scene.McPort)
+        context.scene.McStatus = "CONNECTED"
+        return {"FINISHED"}
+
+
+class BackgroundOperator(object):
+    """Mixin running the work of an operator in a thread
+
+    Invoked from the UI, the operator stays modal, showing the progress in
+    the panels until the thread ends. Esc cancels. Blender data is only
+    touched by the operator, on the main thread.
+    """
+    TIMER_INTERVAL = 0.25
+
+    # One run at a time for every operator
+    running = False
+
+    @classmethod
+    def poll(cls, context):
+        return not cls.running
+
+    def start(self, context, target):
+        """Run target in a thread, self._progress following it
+        :param bpy.types.Context context:
+        :param target: callable
+        """
+        self._task = progress.BackgroundTask(target).start()
+        type(self).running = True
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(
+            BackgroundOperator.TIMER_INTERVAL, context.window
+        )
+        wm.modal_handler_add(self)
+        show_progress(context, str(self._progress))
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            self._progress.cancel()
+            return {"RUNNING_MODAL"}
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+
+        if not self._task.done:
+            text = str(self._progress)
+            if self._progress.cancelled:
+                text = "Cancelling... " + text
+            show_progress(context, text)
+            self.update(context)
+            return {"RUNNING_MODAL"}
+
+        context.window_manager.event_timer_remove(self._timer)
+        type(self).running = False
+        show_progress(context, "")
+        try:
+            if isinstance(self._task.error, progress.Cancelled):
+                self.cancelled(context)
+                return {"CANCELLED"}
+            if self._task.error is not None:
+                self.report({"ERROR"}, str(self._task.error))
+                return {"CANCELLED"}
+            self.finish(context, self._task.result)
+            return {"FINISHED"}
+        finally:
+            flush_trace()
+
+    def update(self, context):
+        """Called on the main thread while the thread runs"""
+        pass
+
+    def finish(self, context, result):
+        """Called on the main thread with what the thread returned"""
+        pass
+
+    def cancelled(self, context):
+        """Called on the main thread when the thread was cancelled"""
+        pass
+
+
+class MCSendBlocksOperator(BackgroundOperator, bpy.types.Operator):
+    bl_idname = "ws_takuro.mc_send_blocks"
+    bl_label = "Send blocks"
+
+    def options(self, context):
+        scene = context.scene
+        options = {
+            "merge_blocks": scene.McMergeBlocks,
+            "connections": scene.McConnections,
+            "delta_sync": scene.McDeltaSync,
+            "verify": scene.McVerify,
+            "cull": scene.McShell if scene.McCull else 0,
+            "cull_fill": occlusion.STONE if scene.McCullFill else None,
+        }
+
+        obj = context.active_object
+        pyr = load_pyramid(obj) if scene.McCoarseLevels else None
+        if pyr is not None:
+            depth = max(pyr.max_depth - obj.LodLevel, 1)
+            coarse_depth = max(depth - scene.McCoarseLevels, 1)
+            if coarse_depth < depth:
+                block_map = pyr.block_map(coarse_depth, expand_to=depth)
+                options["coarse"] = (len(block_map), iter([block_map]))
+        return options
+
+    def execute(self, context):
+        stats = mm.set_bunch_of_blocks(**self.options(context))
+        self.finish(context, stats)
+        flush_trace()
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        chunks = open_block_map_chunks(context.active_object)
+        options = self.options(context)
+        self._progress = progress.Progress()
+        return self.start(context, lambda: mm.set_bunch_of_blocks(
+            chunks=chunks, progress=self._progress, **options
+        ))
+
+    def finish(self, context, stats):
+        self.report({"INFO"}, "Sent {}".format(stats))
+
+    def cancelled(self, context):
+        self.report({"WARNING"}, "Cancelled after sending {} blocks".format(
+            self._progress.blocks_sent))
+
+
+class ExportSchematicOperator(BackgroundOperator, bpy.types.Operator):
+    bl_idname = "ws_takuro.export_schematic"
+    bl_label = "Export schematic"
+
+    def options(self, context):
+        scene = context.scene
+        return {
+            "path": bpy.path.abspath(scene.B2ExportPath),
+            "cull": scene.McShell if scene.McCull else 0,
+            "cull_fill": occlusion.STONE if scene.McCullFill else None,
+        }
+
+    @staticmethod
+    def export(chunks, path, cull=0, cull_fill=None, progress=None):
+        """Write the blocks Send blocks would place, relative to the player
+        :param chunks: number of blocks and an iterator of BlockMap chunks
+        :param str path: ending in .schem or .nbt
+        :return: number of blocks and (width, height, length)
+        """
+        world = transfer.WorldTransform().apply_chunks(
+            chunks[1], chunks[0], progress
+        )
+        if cull:
+            world, _ = occlusion.cull(world, cull, cull_fill, in_place=True)
+        return len(world), schematic.export(world, path, progress=progress)
+
+    def execute(self, context):
+        result = self.export(
+            open_block_map_chunks(context.active_object),
+            **self.options(context)
+        )
+        self.finish(context, result)
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        chunks = open_block_map_chunks(context.active_object)
+        options = self.options(context)
+        self._progress = progress.Progress()
+        return self.start(context, lambda: self.export(
+            chunks, progress=self._progress, **options
+        ))
+
+    def finish(self, context, result):
+        num_blocks, size = result
+        self.report({"INFO"}, "Exported {} blocks, {}x{}x{}, to {}".format(
+            num_blocks, size[0], size[1], size[2],
+            context.scene.B2ExportPath))
+
+    def cancelled(self, context):
+        self.report({"WARNING"}, "Export cancelled")
+
+
+class Convert2BlockOperator(BackgroundOperator, bpy.types.Operator):
+    bl_idname = "ws_takuro.convert2block"
+    bl_label = 'Convert to Block'
+
+    # Seconds between two previews of the voxels found so far
+    PREVIEW_INTERVAL = 1.0
+
+    def prepare(self, context):
+        """Read the active object and its settings
+        :return: arguments of Converter.compute
+        """
+        context.scene['NumOctree'] = 3
+
+        obj = context.active_object
+        self._obj = obj
+        self._cvt = convert2block.Converter(
+            obj, use_lab=obj.UseLab, decimate=obj.Decimate
+        )
+        octree = obj["Octree"] if "Octree" in obj else convert2block.Converter.DEFAULT_OCTREE
+        dims = None
+
+        if obj.GridMode == "OCTREE":
+            u = max(obj.dimensions)/2.0
+            total = Vector()
+            for vec in [Vector(x) for x in obj.bound_box]:
+                total += vec
+
+            average = total / 8.0
+        else:
+            # Raises ValueError when the grid is too fine
+            origin, size, octree, dims = pipeline.fit_grid(
+                self._cvt.mesh,
+                blocks=obj.Blocks if obj.GridMode == "BLOCKS" else None,
+                block_size=obj.BlockSize
+                if obj.GridMode == "BLOCK_SIZE" else None
+            )
+            u = size / 2.0
+            average = Vector(origin) + Vector((u, u, u))
+
+        initial_bb = [
+            Vector((-u, -u, -u)) + average,
+            Vector((-u, -u, u)) + average,
+            Vector((-u, u, u)) + average,
+            Vector((-u, u, -u)) + average,
+            Vector((u, -u, -u)) + average,
+            Vector((u, -u, u)) + average,
+            Vector((u, u, u)) + average,
+            Vector((u, u, -u)) + average
+        ]
+
+        previous = None
+        if obj.Incremental and Global.ID_INCREMENTAL_STATE in obj:
+            previous = incremental.IncrementalState.loads(
+                obj[Global.ID_INCREMENTAL_STATE]
+            )
+            self._cvt.preview_target = bpy.data.objects.get(
+                obj.get(Global.ID_PREVIEW_OBJECT, "")
+            )
+        if context.scene.B2UseCache:
+            self._cvt.cache = conversion_cache(context.scene)
+        block_def.BlockDef.use_lut(
+            block_def.LUT_BITS if context.scene.B2FastMatch else None,
+            cache_directory(context.scene)
+            if context.scene.B2UseCache else None
+        )
+        return initial_bb, octree, obj.SolidFill, previous, dims
+
+    def execute(self, context):
+        try:
+            box, octree, solid, previous, dims = self.prepare(context)
+        except ValueError as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        self._cvt.invoke(
+            box, octree, solid=solid, previous=previous, dims=dims
+        )
+        self.store()
+        flush_trace()
+        return {"FINISHED"}
+
+    def invoke(self, context, event):
+        try:
+            box, octree, solid, previous, dims = self.prepare(context)
+        except ValueError as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
+        self._origin = box[0]
+        # A partial preview would hide the unchanged part of the previous
+        # one, so incremental runs only show the result
+        self._show_partial = previous is None
+        self._drawn = 0
+        self._last_preview = 0.0
+        self._progress = self._cvt.progress = progress.Progress()
+        return self.start(context, lambda: self._cvt.compute(
+            box, octree, solid, previous, dims
+        ))
+
+    def update(self, context):
+        now = time.time()
+        if not self._show_partial or \
+                now - self._last_preview < self.PREVIEW_INTERVAL:
+            return
+        if len(self._cvt.partial_leaves) != self._drawn:
+            self._drawn = len(self._cvt.partial_leaves)
+            self._cvt.draw_partial(self._origin)
+        self._last_preview = now
+
+    def finish(self, context, block_map):
+        self._cvt.draw_voxel(self._origin)
+        self.store()
+        self.report({"INFO"}, "Converted to {} blocks{}".format(
+            len(block_map), " (cached)" if self._cvt.cache_hit else ""))
+
+    def cancelled(self, context):
+        drawn = self._cvt.draw_partial(self._origin) \
+            if self._show_partial else 0
+        self.report({"WARNING"}, "Cancelled, {} voxels previewed".format(
+            drawn))
+
+    def store(self):
+        obj, cvt = self._obj, self._cvt
+        store_block_map(obj, cvt.block_map)
+        if cvt.pyramid is not None:
+            obj[Global.ID_PYRAMID] = cvt.pyramid.dumps()
+        # Set as an ID property so switch_lod is not called
+        obj["LodLevel"] = 0
+
+        if cvt.state is not None:
+            obj[Global.ID_INCREMENTAL_STATE] = cvt.state.dumps()
+        if cvt.preview is not None:
+            obj[Global.ID_PREVIEW_OBJECT] = cvt.preview.name
+
+
+def draw_progress(layout, scene):
+    if scene.B2Progress:
+        box = layout.box()
+        box.label(scene.B2Progress, icon="TIME")
+        box.label("Press Esc to cancel")
+
+
+class BlockConversionPanel(bpy.types.Panel):
+    """Creates a Panel in the Object properties window"""
+    bl_label = "BlockConversion"
+    bl_idname = "OBJECT_PT_b2mine"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "object"
+
+    def draw(self, context):
+        layout = self.layout
+
+        obj = context.object
+        row = layout.row()
+        row.prop(obj, "GridMode", text="Grid")
+
+        row = layout.row()
+        if obj.GridMode == "BLOCKS":
+            row.prop(obj, "Blocks", text="Blocks along longest axis")
+        elif obj.GridMode == "BLOCK_SIZE":
+            row.prop(obj, "BlockSize", text="Block size")
+        else:
+            row.prop(obj, "Octree")
+        row.operator("ws_takuro.convert2block")
+
+        row = layout.row()
+        row.prop(obj, "SolidFill", text="Solid")
+        row.prop(obj, "Incremental", text="Incremental")
+        row.prop(obj, "UseLab", text="Match colors in CIELAB")
+        row.prop(context.scene, "B2FastMatch", text="Fast matching")
+
+        row = layout.row()
+        row.prop(obj, "Decimate", text="Decimate to voxel size")
+
+        row = layout.row()
+        row.prop(obj, "BlockMapFile", text="Sidecar file")
+
+        if Global.ID_PYRAMID in obj:
+            row = layout.row()
+            row.prop(obj, "LodLevel", text="Coarser levels")
+
+        scene = context.scene
+        box = layout.box()
+        row = box.row()
+        row.prop(scene, "B2UseCache", text="Cache")
+        row.prop(scene, "B2CacheSize", text="MB")
+        if scene.B2UseCache:
+            box.row().prop(scene, "B2CacheDir", text="")
+            if cache_directory(scene) in _caches:
+                box.label(str(_caches[cache_directory(scene)]))
+
+        draw_progress(layout, context.scene)
+
+
+class MinecraftPanel(bpy.types.Panel):
+    bl_label = "Minecraft"
+    bl_idname = "OBJECT_PT_mine"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "object"
+
+    def draw(self, context):
+        layout = self.layout
+
+        obj = context.object
+        scene = context.scene
+
+        box = layout.box()
+        row = box.row()
+
+        if scene.McStatus == "CONNECTED":
+            row.label("Connected", icon="FILE_TICK")
+        else:
+            row.label("Disconnected", icon="ERROR")
+
+        row = box.row()
+        row.prop(scene, "McIpAddr", text="IP addr")
+        row.prop(scene, "McPort", text="Port number")
+
+        row = box.row()
+        row.prop(scene, "McConnections", text="Connections")
+
+        row = box.row()
+        row.alignment = 'RIGHT'
+        row.operator("ws_takuro.mine_connect")
+
+        row = layout.row()
+        row.prop(scene, "McDeltaSync", text="Only send changes")
+        row.prop(scene, "McVerify", text="Verify")
+
+        row = layout.row()
+        row.prop(scene, "McCull", text="Cull hidden blocks")
+        sub = row.row()
+        sub.enabled = scene.McCull
+        sub.prop(scene, "McShell", text="Shell")
+        sub.prop(scene, "McCullFill", text="Stone inside")
+
+        row = layout.row()
+        row.prop(scene, "McCoarseLevels", text="Coarse levels first")
+
+        row = layout.row()
+        row.prop(scene, "McMergeBlocks", text="Merge into cuboids")
+        row.operator("ws_takuro.mc_send_blocks")
+
+        row = layout.row()
+        row.prop(scene, "B2ExportPath", text="")
+        row.operator("ws_takuro.export_schematic")
+
+        draw_progress(layout, scene)
+
+
+def register():
+    connection_status = [
+        ("DISCONNECTED", "Disconnected", "", 0),
+        ("CONNECTED", "Connected", "", 1),
+        ("FAILED", "Failed", "", 2),
+    ]
+    grid_modes = [
+        ("OCTREE", "Octree", "Cube around the object, split Octree times", 0),
+        ("BLOCKS", "Blocks", "Fitted to the object, with a number of "
+                             "blocks along its longest axis", 1),
+        ("BLOCK_SIZE", "Block size", "Fitted to the object, with blocks "
+                                     "of a given size", 2),
+    ]
+
+    bpy.types.Object.Octree = IntProperty(
+        name="Octree",
+        description="Enter an integer",
+        min=1,
+        max=convert2block.Converter.MAX_OCTREE,
+        default=3
+    )
+
+    bpy.types.Object.GridMode = EnumProperty(
+        items=grid_modes,
+        name="GridMode",
+        description="How the voxel grid is sized",
+        default="OCTREE"
+    )
+
+    bpy.types.Object.Blocks = IntProperty(
+        name="Blocks",
+        description="Number of blocks along the longest axis of the object",
+        min=1,
+        max=2 ** (convert2block.Converter.MAX_OCTREE - 1),
+        default=64
+    )
+
+    bpy.types.Object.BlockSize = FloatProperty(
+        name="BlockSize",
+        description="Edge length of a block, in object units",
+        min=1e-4,
+        default=0.1,
+        subtype="DISTANCE"
+    )
+
+    bpy.types.Object.SolidFill = BoolProperty(
+        name="SolidFill",
+        description="Fill the inside of closed surfaces instead of a shell",
+        default=False
+    )
+
+    bpy.types.Object.Incremental = BoolProperty(
+        name="Incremental",
+        description="Only convert again the parts changed since the last run",
+        default=True
+    )
+
+    bpy.types.Object.UseLab = BoolProperty(
+        name="UseLab",
+        description="Measure color distances in CIELAB instead of RGB",
+        default=False
+    )
+
+    bpy.types.Object.Decimate = BoolProperty(
+        name="Decimate",
+        description="Merge vertices closer than half a voxel before "
+                    "converting",
+        default=False
+    )
+
+    bpy.types.Object.LodLevel = IntProperty(
+        name="LodLevel",
+        description="Show and send the last conversion this many octree "
+                    "levels coarser, without converting again",
+        min=0,
+        max=convert2block.Converter.MAX_OCTREE - 1,
+        default=0,
+        update=switch_lod
+    )
+
+    bpy.types.Object.BlockMapFile = StringProperty(
+        name="BlockMapFile",
+        description="Store the block map in this file instead of the .blend",
+        subtype="FILE_PATH",
+        default=""
+    )
+
+    bpy.types.Scene.McStatus = EnumProperty(
+        items=connection_status,
+        name='mc_status',
+        description='Status of connection to Minecraft Server',
+        default="DISCONNECTED"
+    )
+
+    bpy.types.Scene.McIpAddr = StringProperty(
+        name='ip',
+        description='IP address of server',
+        default='127.0.0.1'
+    )
+
+    bpy.types.Scene.McPort = IntProperty(
+        name='port',
+        description='Port number of server',
+        default=4711
+    )
+
+    bpy.types.Scene.McConnections = IntProperty(
+        name='connections',
+        description='Number of connections used to send blocks in parallel',
+        min=1,
+        max=16,
+        default=4
+    )
+
+    bpy.types.Scene.McMergeBlocks = BoolProperty(
+        name='merge',
+        description='Merge blocks of the same kind and send them with setBlocks',
+        default=True
+    )
+
+    bpy.types.Scene.McDeltaSync = BoolProperty(
+        name='delta',
+        description='Only send blocks changed since the last send from the same position',
+        default=True
+    )
+
+    bpy.types.Scene.McVerify = BoolProperty(
+        name='verify',
+        description='Read block ids and data back from the server and '
+                    'repair the blocks that differ',
+        default=False
+    )
+
+    bpy.types.Scene.McCull = BoolProperty(
+        name='cull',
+        description='Leave out blocks enclosed by other blocks',
+        default=False
+    )
+
+    bpy.types.Scene.McShell = IntProperty(
+        name='shell',
+        description='Blocks of shell kept under the surface when culling',
+        min=1,
+        max=64,
+        default=1
+    )
+
+    bpy.types.Scene.McCullFill = BoolProperty(
+        name='cull_fill',
+        description='Fill hidden blocks with stone, which merges into few '
+                    'cuboids, instead of leaving them out',
+        default=False
+    )
+
+    bpy.types.Scene.McCoarseLevels = IntProperty(
+        name='coarse',
+        description='Send a build this many levels coarser first, then '
+                    'refine it',
+        min=0,
+        max=3,
+        default=0
+    )
+
+    bpy.types.Scene.B2UseCache = BoolProperty(
+        name='cache',
+        description='Reuse conversions of the same mesh and settings '
+                    'stored on disk',
+        default=True
+    )
+
+    bpy.types.Scene.B2FastMatch = BoolProperty(
+        name='fast_match',
+        description='Match colors through a lookup table, filled once and '
+                    'kept in the cache directory. A few percent of colors '
+                    'get a block nearly as close as the nearest one',
+        default=False
+    )
+
+    bpy.types.Scene.B2CacheDir = StringProperty(
+        name='cache_dir',
+        description='Directory of the conversion cache, the user cache '
+                    'directory when empty',
+        subtype='DIR_PATH',
+        default=''
+    )
+
+    bpy.types.Scene.B2CacheSize = IntProperty(
+        name='cache_size',
+        description='Megabytes the conversion cache may use',
+        min=1,
+        default=cache.DEFAULT_MAX_BYTES >> 20
+    )
+
+    bpy.types.Scene.B2ExportPath = StringProperty(
+        name='export_path',
+        description='Sponge schematic (.schem) or structure (.nbt) to '
+                    'write the blocks to',
+        subtype='FILE_PATH',
+        default='//blocks.schem'
+    )
+
+    bpy.types.Scene.B2Progress = StringProperty(
+        name='progress',
+        description='Progress of the conversion or transfer running',
+        default=''
+    )
+
+    bpy.utils.register_class(MineConnectOperator)
+    bpy.utils.register_class(MCSendBlocksOperator)
+    bpy.utils.register_class(ExportSchematicOperator)
+    bpy.utils.register_class(Convert2BlockOperator)
+    bpy.utils.register_class(BlockConversionPanel)
+    bpy.utils.register_class(MinecraftPanel)
+
+
+def unregister():
+    bpy.utils.unregister_class(MineConnectOperator)
+    bpy.utils.unregister_class(MCSendBlocksOperator)
+    bpy.utils.unregister_class(ExportSchematicOperator)
+    bpy.utils.unregister_class(Convert2BlockOperator)
+    bpy.utils.unregister_class(BlockConversionPanel)
+    bpy.utils.unregister_class(MinecraftPanel)
+
+# bpy.utils.register_module(__name__)
+
+if __name__ == "__main__":
+    register()
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""Convert many models to block maps from the command line
+
+Without Blender, OBJ and PLY files are read directly::
+
+    python -m b2mine.batch manifest.json --workers 8
+
+Inside Blender, objects of the opened .blend can be listed as well::
+
+    blender scene.blend --background --python b2mine/batch.py -- manifest.json
+
+The manifest is JSON. Paths are relative to it and every model may
+override the defaults::
+
+    {
+        "output": "blocks",
+        "defaults": {"octree": 6, "solid": false, "lab": false,
+                     "decimate": false},
+        "models": [
+            "chair.obj",
+            {"path": "car.ply", "octree": 7, "output": "car.b2mb"},
+            {"object": "Suzanne", "texture": "suzanne.png"},
+            {"path": "tower.obj", "blocks": 100},
+            {"path": "room.obj", "block_size": 0.5},
+            {"path": "house.obj", "output": "house.schem"}
+        ]
+    }
+
+``blocks`` (along the longest axis) or ``block_size`` fit the grid to the
+bounding box of the model instead of splitting a cube ``octree`` times.
+
+An output ending in .schem or .nbt is written as a schematic to paste with
+WorldEdit or a structure block instead of a block map, see schematic.py.
+
+With ``--cache DIR``, conversions already done with the same mesh and
+settings are read from that directory instead, see cache.py.
+
+Models are converted by a pool of ``--workers`` processes. Workers are
+forked, so use ``--workers 1`` where fork is not available. Textures are
+read with Pillow, or by Blender when Pillow is not installed.
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+if not __package__:
+    # Run as a script, e.g. blender --background --python b2mine/batch.py
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "b2mine"
+
+from . import block_io
+from . import cache
+from . import mesh_io
+from . import pipeline
+from . import sampler
+from . import schematic
+from . import trace
+from . import transfer
+from .mesh_data import MeshData
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+DEFAULTS = {
+    "octree": pipeline.Pipeline.DEFAULT_OCTREE,
+    "solid": False,
+    "lab": False,
+    "decimate": False,
+}
+
+
+class BatchError(Exception):
+    pass
+
+
+def load_manifest(path, output=None):
+    """Jobs described by a manifest
+    :param str path: manifest file
+    :param str output: directory overriding the one of the manifest
+    :return: list of job dicts, ready for convert_model
+    """
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"models": manifest}
+
+    folder = os.path.dirname(os.path.abspath(path))
+    output = os.path.join(folder, output or manifest.get("output", "."))
+    defaults = dict(DEFAULTS)
+    defaults.update(manifest.get("defaults", {}))
+
+    jobs = []
+    for entry in manifest.get("models", []):
+        if not isinstance(entry, dict):
+            entry = {"path": entry}
+        job = dict(defaults)
+        job.update(entry)
+
+        if "path" in job:
+            job["path"] = os.path.join(folder, job["path"])
+            name = os.path.splitext(os.path.basename(job["path"]))[0]
+        elif "object" in job:
+            name = job["object"]
+        else:
+            raise BatchError("Model without path or object: {}".format(entry))
+        job.setdefault("name", name)
+
+        if job.get("texture"):
+            job["texture"] = os.path.join(folder, job["texture"])
+        job["output"] = os.path.join(
+            output, job.get("output", job["name"] + block_io.EXTENSION)
+        )
+        _check_grid(job)
+        jobs.append(job)
+    return jobs
+
+
+def _check_grid(job):
+    """Reject grid settings of a job the add-on would not accept"""
+    try:
+        octree = int(job["octree"])
+        blocks = job.get("blocks")
+        block_size = job.get("block_size")
+        if not 1 <= octree <= pipeline.Pipeline.MAX_OCTREE:
+            raise ValueError("octree depth out of range")
+        if blocks is not None and int(blocks) < 1:
+            raise ValueError("blocks must be positive")
+        if block_size is not None and not float(block_size) > 0:
+            raise ValueError("block_size must be positive")
+    except (TypeError, ValueError) as e:
+        raise BatchError("Grid of {}: {}".format(job["name"], e))
+
+
+def read_blender_objects(jobs):
+    """Read the meshes of the jobs naming objects of the opened .blend
+
+    Done in the parent, so workers never touch Blender data.
+    """
+    for job in jobs:
+        if "object" not in job:
+            continue
+        if bpy is None:
+            raise BatchError(
+                "{} names an object, run inside Blender".format(job["name"]))
+        obj = bpy.data.objects.get(job["object"])
+        if obj is None or obj.type != "MESH":
+            raise BatchError("No mesh object {}".format(job["object"]))
+
+        start = time.time()
+        job["mesh"] = MeshData.from_bpy(obj.data)
+        if not job.get("texture"):
+            # find_image lives with the add-on, which needs bpy anyway
+            from .convert2block import find_image
+            job["pixels"] = sampler.image_pixels(find_image(obj))
+        job["read_seconds"] = time.time() - start
+
+
+def load_texture(path):
+    """
+    :param str path:
+    :return: (H, W, 3) float32 pixels, or None when no reader is available
+    """
+    if mesh_io.Image is not None:
+        return mesh_io.load_image(path)
+    if bpy is not None:
+        image = bpy.data.images.load(path)
+        try:
+            return sampler.image_pixels(image)
+        finally:
+            bpy.data.images.remove(image)
+    print("Pillow is not installed, {} is not used".format(path))
+    return None
+
+
+def convert_model(job):
+    """Convert one model and write its block map, run in the workers
+    :param dict job: as returned by load_manifest
+    :return: result dict, with "error" set if the conversion failed
+    """
+    result = {
+        "name": job["name"],
+        "output": job["output"],
+        "num_triangles": 0,
+        "num_blocks": 0,
+        "cache_hit": False,
+        "timings": {},
+        "error": None,
+    }
+    start = time.time()
+    with trace.span("convert_model", model=job["name"]):
+        try:
+            _convert(job, result)
+        except Exception:
+            result["error"] = traceback.format_exc()
+    result["seconds"] = time.time() - start
+    if trace.enabled():
+        # Handed back to the parent, which merges them into one trace
+        result["trace"] = trace.collect()
+    return result
+
+
+def _convert(job, result):
+    read_start = time.time()
+    mesh = job.get("mesh")
+    pixels = job.get("pixels")
+    if mesh is None:
+        mesh = mesh_io.load_mesh(job["path"])
+    texture = job.get("texture")
+    if texture is None and job.get("path", "").lower().endswith(".obj"):
+        texture = mesh_io.obj_texture(job["path"])
+    if texture and os.path.exists(texture):
+        pixels = load_texture(texture)
+    read_seconds = job.get("read_seconds", 0.0) + time.time() - read_start
+
+    converter = pipeline.Pipeline(
+        mesh, pixels, use_lab=bool(job["lab"]),
+        decimate=bool(job["decimate"])
+    )
+    if job.get("cache"):
+        converter.cache = cache.ConversionCache(
+            job["cache"], job.get("cache_size", cache.DEFAULT_MAX_BYTES)
+        )
+    if job.get("blocks") or job.get("block_size"):
+        origin, size, depth, dims = pipeline.fit_grid(
+            mesh, blocks=job.get("blocks"), block_size=job.get("block_size")
+        )
+    else:
+        origin, size = pipeline.root_cell(mesh)
+        depth, dims = int(job["octree"]), None
+    block_map = converter.run(
+        origin, size, depth, solid=bool(job["solid"]), dims=dims
+    )
+
+    write_start = time.time()
+    folder = os.path.dirname(job["output"])
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    if os.path.splitext(job["output"])[1].lower() in \
+            (schematic.SCHEMATIC, schematic.STRUCTURE):
+        world = transfer.WorldTransform().apply(block_map)
+        schematic.export(world, job["output"])
+    else:
+        block_io.dump(block_map, job["output"])
+
+    result["timings"]["read"] = read_seconds
+    result["timings"].update(converter.timings)
+    result["timings"]["write"] = time.time() - write_start
+    result["num_triangles"] = mesh.num_triangles
+    result["num_blocks"] = len(block_map)
+    result["cache_hit"] = converter.cache_hit
+
+
+def run(jobs, workers=None):
+    """Convert every job on a pool of processes
+    :param list jobs:
+    :param int workers: number of processes, the CPU count by default
+    :return: iterator of results in completion order
+    """
+    workers = workers or multiprocessing.cpu_count()
+    # Pickled by reference, so refer to this module even when run as a script
+    worker = importlib.import_module(__package__ + ".batch").convert_model
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield worker(job)
+        return
+
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    try:
+        for result in pool.imap_unordered(worker, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_result(result):
+    if result["error"]:
+        return "{name}: FAILED\n{error}".format(**result)
+    stages = " ".join(
+        "{} {:.2f}s".format(stage, seconds)
+        for stage, seconds in result["timings"].items()
+    )
+    return "{}: {} triangles -> {} blocks in {:.2f}s ({}){}".format(
+        result["name"], result["num_triangles"], result["num_blocks"],
+        result["seconds"], stages, " cached" if result["cache_hit"] else ""
+    )
+
+
+def summarize(results, seconds):
+    """Throughput of a batch
+    :param list results:
+    :param float seconds: wall clock time of the batch
+    :rtype: dict
+    """
+    done = [r for r in results if not r["error"]]
+    stages = {}
+    for r in done:
+        for stage, value in r["timings"].items():
+            stages[stage] = stages.get(stage, 0.0) + value
+    seconds = max(seconds, 1e-9)
+    return {
+        "num_models": len(results),
+        "num_failed": len(results) - len(done),
+        "num_cached": sum(1 for r in done if r["cache_hit"]),
+        "seconds": seconds,
+        "models_per_minute": 60.0 * len(done) / seconds,
+        "triangles_per_second":
+            sum(r["num_triangles"] for r in done) / seconds,
+        "blocks_per_second": sum(r["num_blocks"] for r in done) / seconds,
+        "stage_seconds": stages,
+    }
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        if "--" in sys.argv:
+            # Arguments after "--" when run by blender --python
+            argv = sys.argv[sys.argv.index("--") + 1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, the CPU count by default")
+    parser.add_argument("--output", default=None,
+                        help="directory of the block maps")
+    parser.add_argument("--report", default=None,
+                        help="write the results and the summary as JSON")
+    parser.add_argument("--trace", default=None,
+                        help="write a Chrome trace of all processes")
+    parser.add_argument("--cache", default=None,
+                        help="directory of the conversion cache")
+    parser.add_argument("--cache-size", type=int,
+                        default=cache.DEFAULT_MAX_BYTES >> 20,
+                        help="megabytes the cache may use")
+    args = parser.parse_args(argv)
+    if args.trace:
+        trace.enable()
+
+    jobs = load_manifest(args.manifest, args.output)
+    if args.cache:
+        for job in jobs:
+            job["cache"] = os.path.abspath(args.cache)
+            job["cache_size"] = args.cache_size << 20
+    read_blender_objects(jobs)
+
+    start = time.time()
+    results = []
+    for result in run(jobs, args.workers):
+        trace.merge(result.pop("trace", ()))
+        print(format_result(result))
+        results.append(result)
+    summary = summarize(results, time.time() - start)
+
+    print("{num_models} models ({num_failed} failed, {num_cached} cached) "
+          "in {seconds:.2f}s: "
+          "{models_per_minute:.1f} models/min, "
+          "{triangles_per_second:.0f} triangles/s, "
+          "{blocks_per_second:.0f} blocks/s".format(**summary))
+    for stage, seconds in summary["stage_seconds"].items():
+        print("    {:<10} {:.2f}s".format(stage, seconds))
+
+    if args.trace:
+        trace.export_chrome(args.trace)
+        for name, total in trace.counters().items():
+            print("    {:<16} {}".format(name, total))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"summary": summary, "models": results}, f, indent=2)
+    return 1 if summary["num_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of every conversion and transfer stage
+
+Procedural meshes are converted at several octree depths and every stage
+is timed on its own, taking the best of ``--repeat`` runs. Transfers go to
+a local MockRaspberryJuice. Results are written as JSON and can be compared
+with a stored baseline::
+
+    python -m b2mine.benchmark --save baseline.json
+    python -m b2mine.benchmark --baseline baseline.json
+
+The comparison exits with status 1 when a stage got slower than
+``--threshold`` times its baseline.
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from . import merge
+from . import morton
+from . import occlusion
+from . import pipeline
+from . import preview
+from . import pyramid
+from . import sampler
+from . import schematic
+from . import transfer
+from . import voxelizer
+from .block_def import LUT_BITS, BlockDef, Palette
+from .block_map import BlockMap
+from .mesh_data import MeshData
+from .mock_server import MockRaspberryJuice
+
+
+FORMAT_VERSION = 1
+DEFAULT_DEPTHS = (3, 4, 5, 6, 7, 8)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.25
+
+# Stages shorter than this are too noisy to be compared
+MIN_COMPARED_SECONDS = 0.005
+
+
+def parametric_mesh(points, wrap_u=False, wrap_v=False):
+    """Quad grid of points, split into triangles and colored by position
+    :param numpy.ndarray points: (N, M, 3)
+    :param bool wrap_u: connect the last row to the first
+    :param bool wrap_v: connect the last column to the first
+    :rtype: MeshData
+    """
+    n, m = points.shape[:2]
+    index = np.arange(n * m).reshape(n, m)
+    if wrap_u:
+        index = np.vstack((index, index[:1]))
+    if wrap_v:
+        index = np.hstack((index, index[:, :1]))
+
+    a, b = index[:-1, :-1], index[1:, :-1]
+    c, d = index[1:, 1:], index[:-1, 1:]
+    tri_vertex = np.concatenate((
+        np.stack((a, b, c), axis=-1).reshape(-1, 3),
+        np.stack((a, c, d), axis=-1).reshape(-1, 3),
+    ))
+
+    vertices = points.reshape(-1, 3)
+    lower, upper = vertices.min(axis=0), vertices.max(axis=0)
+    rgb = ((vertices - lower) / np.maximum(upper - lower, 1e-9))
+    tri_loop = np.arange(tri_vertex.size).reshape(-1, 3)
+    return MeshData(
+        vertices, tri_vertex, tri_loop,
+        rgb[tri_vertex.reshape(-1)].astype(np.float32)
+    )
+
+
+def sphere(segments=64, radius=1.0):
+    u, v = np.meshgrid(
+        np.linspace(0, np.pi, segments + 1),
+        np.linspace(0, 2 * np.pi, 2 * segments, endpoint=False),
+        indexing="ij"
+    )
+    points = radius * np.stack((
+        np.sin(u) * np.cos(v), np.sin(u) * np.sin(v), np.cos(u)
+    ), axis=-1)
+    return parametric_mesh(points, wrap_v=True)
+
+
+def torus(segments=64, radius=1.0, tube=0.35):
+    u, v = np.meshgrid(
+        np.linspace(0, 2 * np.pi, 2 * segments, endpoint=False),
+        np.linspace(0, 2 * np.pi, segments, endpoint=False),
+        indexing="ij"
+    )
+    ring = radius + tube * np.cos(v)
+    points = np.stack((
+        ring * np.cos(u), ring * np.sin(u), tube * np.sin(v)
+    ), axis=-1)
+    return parametric_mesh(points, wrap_u=True, wrap_v=True)
+
+
+def terrain(segments=128, seed=0):
+    """Height field of summed random sine waves, seeded for repeatability"""
+    rng = np.random.RandomState(seed)
+    x, y = np.meshgrid(
+        np.linspace(-1, 1, segments + 1), np.linspace(-1, 1, segments + 1),
+        indexing="ij"
+    )
+    z = np.zeros_like(x)
+    for octave in range(6):
+        frequency = 2.0 ** octave
+        phase = rng.uniform(0, 2 * np.pi, 2)
+        direction = rng.normal(size=2)
+        z += np.sin(
+            frequency * np.pi * (direction[0] * x + direction[1] * y) +
+            phase[0]
+        ) * np.cos(frequency * np.pi * y + phase[1]) / frequency
+    z += 0.02 * rng.normal(size=z.shape)
+    return parametric_mesh(np.stack((x, y, 0.3 * z), axis=-1))
+
+
+def thin_shell(segments=64, thickness=0.01):
+    """Two concentric spheres, closer than a voxel at every depth"""
+    outer = sphere(segments, 1.0)
+    inner = sphere(segments, 1.0 - thickness)
+    offset = len(outer.vertices)
+    return MeshData(
+        np.concatenate((outer.vertices, inner.vertices)),
+        np.concatenate((outer.tri_vertex, inner.tri_vertex[:, ::-1] + offset)),
+        np.concatenate((outer.tri_loop, inner.tri_loop + outer.tri_loop.size)),
+        np.concatenate((outer.loop_colors, inner.loop_colors))
+    )
+
+
+MESHES = (
+    ("sphere", sphere),
+    ("torus", torus),
+    ("terrain", terrain),
+    ("thin_shell", thin_shell),
+)
+
+
+def best_of(repeat, func):
+    """Smallest wall clock time of repeat calls, and the last result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def bench_case(mesh, depth, repeat, server):
+    """Time every stage of converting and sending mesh at depth
+    :param MeshData mesh:
+    :param int depth: octree depth, as set on the add-on panel
+    :param int repeat:
+    :param MockRaspberryJuice server: started mock server
+    :return: dict of stage seconds and counts
+    """
+    origin, size = pipeline.root_cell(mesh)
+    leaf_depth = max(depth - 1, 0)
+    cell_unit = size / float(2 ** leaf_depth)
+    seconds = {}
+
+    seconds["decimate"], _ = best_of(repeat, lambda: mesh.decimated(
+        cell_unit * pipeline.Pipeline.CLUSTER_FRACTION))
+
+    triangles = mesh.triangles
+    seconds["descend"], pairs = best_of(repeat, lambda: list(
+        voxelizer.iter_leaf_pairs(triangles, origin, size, leaf_depth)))
+
+    colors = sampler.SurfaceColors(mesh.triangle_colors)
+
+    def color():
+        codes, rgb = [], []
+        for pair_codes, pair_tris in pairs:
+            leaf_codes, leaf_tris, bary = sampler.nearest_triangles(
+                pair_codes, pair_tris, triangles, origin, cell_unit)
+            codes.append(leaf_codes)
+            rgb.append(colors.sample(leaf_tris, bary))
+        return np.concatenate(codes), np.concatenate(rgb)
+    seconds["color"], (codes, rgb) = best_of(repeat, color)
+
+    cells = morton.decode(codes)
+    seconds["match"], (block_ids, block_data) = best_of(
+        repeat, lambda: BlockDef.match_many(rgb))
+    scale = int(round(cell_unit / (size / float(2 ** depth))))
+    block_map = BlockMap(cells * scale, block_ids, block_data)
+
+    seconds["pyramid"], _ = best_of(repeat, lambda: pyramid.Pyramid.build(
+        cells, rgb, origin, size, leaf_depth))
+
+    seconds["preview"], _ = best_of(repeat, lambda: preview.build_geometry(
+        cells, rgb, origin, cell_unit))
+
+    seconds["world"], world = best_of(
+        repeat, lambda: transfer.WorldTransform().apply(block_map))
+    seconds["cull"], _ = best_of(repeat, lambda: occlusion.cull(world))
+    seconds["schematic"], _ = best_of(repeat, lambda: schematic.write_sponge(
+        world, io.BytesIO()))
+    seconds["merge"], cuboids = best_of(
+        repeat, lambda: merge.merge_cuboids(world))
+
+    sender = transfer.AsyncSender(server.address, server.port)
+    unordered = transfer.cuboid_commands(cuboids, (0, 0, 0))
+    commands, chunks = transfer.chunk_commands(cuboids, (0, 0, 0))
+
+    def send(commands, groups=None):
+        server.reset()
+        sender.send(commands, num_blocks=len(world), groups=groups)
+        return server.chunk_switches
+    seconds["transfer_unordered"], switches_unordered = best_of(
+        repeat, lambda: send(unordered))
+    seconds["transfer"], switches = best_of(
+        repeat, lambda: send(commands, chunks))
+
+    def send_slices():
+        server.reset()
+        sender.send_slices(
+            (transfer.chunk_commands(merge.merge_cuboids(block_map),
+                                     (0, 0, 0))[0], len(block_map))
+            for block_map in transfer.column_slices(world, (0, 0, 0))
+        )
+        return server.chunk_switches
+    seconds["transfer_sliced"], switches_sliced = best_of(
+        repeat, send_slices)
+    _, columns = transfer.column_order(world.positions, (0, 0, 0))
+
+    seconds["pipeline"], _ = best_of(repeat, lambda: pipeline.Pipeline(
+        mesh).run(origin, size, depth))
+
+    return {
+        "seconds": seconds,
+        "num_triangles": mesh.num_triangles,
+        "num_blocks": len(block_map),
+        "num_commands": len(commands),
+        "chunk_switches": switches,
+        "chunk_switches_unordered": switches_unordered,
+        "chunk_switches_sliced": switches_sliced,
+        "num_columns": len(np.unique(columns)),
+    }
+
+
+def bench_palette(repeat):
+    """Time filling the lookup tables of the block palette, as done by a
+    process finding none stored
+    :return: dict of stage seconds
+    """
+    colors = [block.color for block in BlockDef.BLOCK_LIST]
+    seconds = {}
+    for lab, stage in ((False, "lut_rgb"), (True, "lut_lab")):
+        seconds[stage], _ = best_of(
+            repeat, lambda: Palette(colors, lab, LUT_BITS).build_lut())
+    return {"mesh": "palette", "depth": 0, "num_blocks": len(colors),
+            "seconds": seconds}
+
+
+def run(meshes=None, depths=DEFAULT_DEPTHS, repeat=DEFAULT_REPEAT):
+    """
+    :param list meshes: names of MESHES, all by default
+    :param depths: octree depths
+    :param int repeat:
+    :return: report dict, as saved to JSON
+    """
+    builders = dict(MESHES)
+    meshes = meshes or [name for name, _ in MESHES]
+    results = [bench_palette(repeat)]
+    print(format_result(results[0]))
+    # Built once so the palettes are not timed with the first case
+    BlockDef.match_many(np.zeros((1, 3), dtype=np.float32))
+
+    with MockRaspberryJuice() as server:
+        for name in meshes:
+            mesh = builders[name]()
+            for depth in depths:
+                result = bench_case(mesh, depth, repeat, server)
+                result.update({"mesh": name, "depth": depth})
+                print(format_result(result))
+                results.append(result)
+
+    return {
+        "version": FORMAT_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def format_result(result):
+    stages = " ".join("{} {:.4f}".format(stage, seconds)
+                      for stage, seconds in result["seconds"].items())
+    text = "{:<10} depth {}: {} blocks".format(
+        result["mesh"], result["depth"], result["num_blocks"])
+    if "num_columns" in result:
+        text += ", {} columns, {} chunk switches ({} unordered, {} " \
+            "sliced)".format(
+                result["num_columns"], result["chunk_switches"],
+                result["chunk_switches_unordered"],
+                result["chunk_switches_sliced"])
+    return "{} | {}".format(text, stages)
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Stages slower than threshold times their baseline
+    :return: list of (mesh, depth, stage, seconds, baseline seconds)
+    """
+    previous = {
+        (r["mesh"], r["depth"]): r["seconds"] for r in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        base = previous.get((result["mesh"], result["depth"]))
+        if base is None:
+            continue
+        for stage, seconds in result["seconds"].items():
+            if stage not in base:
+                continue
+            if max(seconds, base[stage]) < MIN_COMPARED_SECONDS:
+                continue
+            if seconds > threshold * base[stage]:
+                regressions.append((result["mesh"], result["depth"], stage,
+                                    seconds, base[stage]))
+    return regressions
+
+
+def _depths(text):
+    """"3-8" or "3,5,7" """
+    if "-" in text:
+        first, last = text.split("-")
+        return tuple(range(int(first), int(last) + 1))
+    return tuple(int(v) for v in text.split(","))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meshes", default=None,
+                        help="comma separated, of: {}".format(
+                            ", ".join(name for name, _ in MESHES)))
+    parser.add_argument("--depths", type=_depths, default=DEFAULT_DEPTHS,
+                        help="e.g. 3-8 or 3,5")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--save", default=None, help="write the report here")
+    parser.add_argument("--baseline", default=None,
+                        help="report to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.meshes.split(",") if args.meshes else None,
+        args.depths, args.repeat
+    )
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for mesh, depth, stage, seconds, base in regressions:
+            print("SLOWER {} depth {} {}: {:.4f}s (baseline {:.4f}s)".format(
+                mesh, depth, stage, seconds, base))
+        print("{} regressions".format(len(regressions)))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
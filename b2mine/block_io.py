@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Versioned binary storage of BlockMap
+
+Layout (little endian)::
+
+    header      magic "B2MB", version u16, flags u16,
+                number of blocks u64, number of chunks u32
+    chunk table number of chunks x (offset u64, size u32, blocks u32)
+    chunks      zlib compressed columns of the chunk:
+                positions int32 (n, 3), block ids uint16, block data uint8
+
+Each chunk can be decompressed on its own, so a reader backed by a memory
+mapped sidecar file only touches the chunks it is asked for.
+"""
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+from .block_map import BlockMap
+
+
+MAGIC = b"B2MB"
+EXTENSION = ".b2mb"
+FORMAT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 1 << 15
+COMPRESS_LEVEL = 6
+
+_HEADER = struct.Struct("<4sHHQI")
+_CHUNK_ENTRY = struct.Struct("<QII")
+
+
+class BlockMapFormatError(Exception):
+    pass
+
+
+def is_block_map(data):
+    """
+    :param bytes data:
+    :return: True if data starts like a serialized BlockMap
+    """
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def dumps(block_map, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    :param BlockMap block_map:
+    :param int chunk_size: number of blocks per chunk
+    :rtype: bytes
+    """
+    chunks = []
+    for begin in range(0, len(block_map), chunk_size):
+        part = block_map[begin:begin + chunk_size]
+        payload = b"".join((
+            part.positions.astype("<i4").tobytes(),
+            part.block_ids.astype("<u2").tobytes(),
+            part.block_data.astype("u1").tobytes()
+        ))
+        chunks.append((zlib.compress(payload, COMPRESS_LEVEL), len(part)))
+
+    offset = _HEADER.size + _CHUNK_ENTRY.size * len(chunks)
+    table = []
+    for payload, num_blocks in chunks:
+        table.append(_CHUNK_ENTRY.pack(offset, len(payload), num_blocks))
+        offset += len(payload)
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, len(block_map), len(chunks)
+    )
+    return b"".join([header] + table + [payload for payload, _ in chunks])
+
+
+def dump(block_map, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write a sidecar file
+    :param BlockMap block_map:
+    :param str path:
+    :param int chunk_size:
+    """
+    with open(path, "wb") as f:
+        f.write(dumps(block_map, chunk_size))
+
+
+def loads(data):
+    """
+    :param bytes data:
+    :rtype: BlockMap
+    """
+    return BlockMapReader(data).read()
+
+
+def load(path):
+    """
+    :param str path:
+    :rtype: BlockMap
+    """
+    with BlockMapReader.open(path) as reader:
+        return reader.read()
+
+
+class BlockMapReader(object):
+    """Decodes a serialized BlockMap one chunk at a time"""
+
+    def __init__(self, buffer):
+        """
+        :param buffer: bytes, or any object supporting the buffer protocol
+        """
+        self._buffer = memoryview(buffer)
+        self._mmap = None
+
+        if len(self._buffer) < _HEADER.size:
+            raise BlockMapFormatError("Truncated block map header")
+        magic, version, _flags, num_blocks, num_chunks = \
+            _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise BlockMapFormatError("Not a block map")
+        if version > FORMAT_VERSION:
+            raise BlockMapFormatError(
+                "Unsupported block map version {}".format(version))
+
+        self.version = version
+        self._num_blocks = num_blocks
+        self._chunks = [
+            _CHUNK_ENTRY.unpack_from(
+                self._buffer, _HEADER.size + i * _CHUNK_ENTRY.size)
+            for i in range(num_chunks)
+        ]
+
+    @classmethod
+    def open(cls, path):
+        """Memory map a sidecar file
+        :param str path:
+        :rtype: BlockMapReader
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = cls(mapped)
+        reader._mmap = mapped
+        return reader
+
+    def close(self):
+        self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._num_blocks
+
+    @property
+    def num_chunks(self):
+        return len(self._chunks)
+
+    def read_chunk(self, index):
+        """
+        :param int index:
+        :rtype: BlockMap
+        """
+        offset, size, num_blocks = self._chunks[index]
+        payload = zlib.decompress(self._buffer[offset:offset + size])
+        if len(payload) != num_blocks * 15:
+            raise BlockMapFormatError("Corrupted chunk {}".format(index))
+
+        ids_at = num_blocks * 12
+        data_at = ids_at + num_blocks * 2
+        return BlockMap(
+            np.frombuffer(payload, "<i4", num_blocks * 3).reshape(-1, 3),
+            np.frombuffer(payload, "<u2", num_blocks, ids_at),
+            np.frombuffer(payload, "u1", num_blocks, data_at)
+        )
+
+    def iter_chunks(self):
+        for i in range(self.num_chunks):
+            yield self.read_chunk(i)
+
+    def read(self):
+        """Decode every chunk
+        :rtype: BlockMap
+        """
+        return BlockMap.concatenate(self.iter_chunks())
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+def position_keys(positions):
+    """Pack integer positions into sortable int64 keys
+    :param numpy.ndarray positions: (N, 3) within +-2**20 on every axis
+    :rtype: numpy.ndarray
+    """
+    p = np.asarray(positions).astype(np.int64).reshape(-1, 3) + (1 << 20)
+    return (p[:, 0] << 42) | (p[:, 1] << 21) | p[:, 2]
+
+
+class BlockInfo(object):
+
+    def __init__(self, has_block, block_type, color=None, pos=None):
+        """
+        :param bool has_block:
+        :param int block_type:
+        """
+        self._has_block = has_block
+        self._block_type = block_type
+        self._color = color
+        self._pos = pos
+
+    def update(self, has_block, block_type, color=None, pos=None):
+        self._has_block = has_block
+        self._block_type = block_type
+        self._color = color
+        self._pos = pos
+
+    def to_dict(self):
+        return {
+            "has_block": self._has_block,
+            "block_type": self._block_type,
+            "color": self._color,
+            "pos": self._pos
+        }
+
+    @property
+    def has_block(self):
+        return self._has_block
+
+    @property
+    def block_type(self):
+        return self._block_type
+
+    @property
+    def color(self):
+        return self._color
+
+    @property
+    def pos(self):
+        return self._pos
+
+
+class BlockMap(object):
+    """Column oriented set of blocks
+
+    Positions are kept in an (N, 3) int32 array, block ids and block data
+    in uint16 / uint8 columns. Block data 0 stands for "no data", which is
+    what Minecraft assumes when it is omitted.
+    """
+
+    POS_DTYPE = np.int32
+    ID_DTYPE = np.uint16
+    DATA_DTYPE = np.uint8
+
+    def __init__(self, positions=None, block_ids=None, block_data=None):
+        """
+        :param positions: (N, 3) integer positions
+        :param block_ids: (N,) block ids
+        :param block_data: (N,) block data, zeros when omitted
+        """
+        if positions is None:
+            positions = np.empty((0, 3))
+        self._positions = np.asarray(
+            positions, dtype=BlockMap.POS_DTYPE).reshape(-1, 3)
+
+        if block_ids is None:
+            block_ids = np.zeros(len(self._positions))
+        self._block_ids = np.asarray(block_ids, dtype=BlockMap.ID_DTYPE)
+
+        if block_data is None:
+            block_data = np.zeros(len(self._positions))
+        self._block_data = np.asarray(block_data, dtype=BlockMap.DATA_DTYPE)
+
+        if not (len(self._positions) == len(self._block_ids) ==
+                len(self._block_data)):
+            raise ValueError("Columns of a BlockMap must have the same length")
+
+        self._index = None
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """Build from an iterable of BlockInfo, e.g. a legacy block_map
+        :param blocks:
+        :rtype: BlockMap
+        """
+        blocks = list(blocks)
+        return cls(
+            [b.pos for b in blocks],
+            [b.block_type for b in blocks],
+            [b.color or 0 for b in blocks]
+        )
+
+    @classmethod
+    def concatenate(cls, block_maps):
+        """
+        :param list block_maps:
+        :rtype: BlockMap
+        """
+        block_maps = list(block_maps)
+        if not block_maps:
+            return cls()
+        return cls(
+            np.concatenate([m.positions for m in block_maps]),
+            np.concatenate([m.block_ids for m in block_maps]),
+            np.concatenate([m.block_data for m in block_maps])
+        )
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def block_ids(self):
+        return self._block_ids
+
+    @property
+    def block_data(self):
+        return self._block_data
+
+    @property
+    def nbytes(self):
+        return (self._positions.nbytes + self._block_ids.nbytes +
+                self._block_data.nbytes)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __iter__(self):
+        for pos, block_id, block_data in zip(
+                self._positions.tolist(),
+                self._block_ids.tolist(),
+                self._block_data.tolist()):
+            yield BlockInfo(
+                has_block=True,
+                block_type=block_id,
+                color=block_data or None,
+                pos=tuple(pos)
+            )
+
+    def __getitem__(self, item):
+        """Index, slice, boolean mask or index array
+        :return: BlockInfo for an integer index, BlockMap otherwise
+        """
+        if isinstance(item, (int, np.integer)):
+            block_data = int(self._block_data[item])
+            return BlockInfo(
+                has_block=True,
+                block_type=int(self._block_ids[item]),
+                color=block_data or None,
+                pos=tuple(self._positions[item].tolist())
+            )
+        return BlockMap(
+            self._positions[item],
+            self._block_ids[item],
+            self._block_data[item]
+        )
+
+    def __getstate__(self):
+        return {
+            "positions": self._positions,
+            "block_ids": self._block_ids,
+            "block_data": self._block_data
+        }
+
+    def __setstate__(self, state):
+        self.__init__(
+            state["positions"], state["block_ids"], state["block_data"]
+        )
+
+    def bounds(self):
+        """
+        :return: minimum and maximum position (both inclusive)
+        """
+        if not len(self):
+            return None
+        return (tuple(self._positions.min(axis=0).tolist()),
+                tuple(self._positions.max(axis=0).tolist()))
+
+    def region(self, lower, upper):
+        """Blocks with lower <= pos < upper on every axis
+        :param lower: (x, y, z)
+        :param upper: (x, y, z)
+        :rtype: BlockMap
+        """
+        mask = ((self._positions >= np.asarray(lower)) &
+                (self._positions < np.asarray(upper))).all(axis=1)
+        return self[mask]
+
+    def find(self, pos):
+        """Index of the block at the given position
+        :param pos: (x, y, z)
+        :return: index, or -1 when there is no block at pos
+        """
+        return int(self.find_many([pos])[0])
+
+    def find_many(self, positions):
+        """Index of the block at every position
+        :param numpy.ndarray positions: (M, 3)
+        :return: (M,) indices, -1 where there is no block
+        """
+        if self._index is None:
+            keys = position_keys(self._positions)
+            order = np.argsort(keys, kind="mergesort")
+            self._index = (keys[order], order)
+
+        sorted_keys, order = self._index
+        keys = position_keys(positions)
+        if not len(sorted_keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return np.where(sorted_keys[i] == keys, order[i], -1)
+
+    def lookup(self, pos):
+        """
+        :param pos: (x, y, z)
+        :return: BlockInfo at pos or None
+        """
+        i = self.find(pos)
+        return None if i < 0 else self[i]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Content addressed on-disk cache of finished conversions
+
+An entry is keyed by a hash of everything the conversion depends on: the
+mesh arrays, the texture, the grid, the settings and the block palette. The
+same model converted again, after reopening a .blend, on another machine
+sharing the directory or in a batch job, is then read back instead.
+
+Every entry is one file whose modification time records its last use.
+Once the cache grows past its size cap, the least recently used entries
+are removed. Files are written under a temporary name and renamed, so
+processes sharing the directory never read half of one.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from .block_def import BlockDef
+
+
+# Changing what a conversion produces must change this
+FORMAT_VERSION = 1
+ENV_VAR = "B2MINE_CACHE"
+DEFAULT_DIRECTORY = os.environ.get(ENV_VAR) or os.path.join(
+    os.path.expanduser("~"), ".cache", "b2mine"
+)
+DEFAULT_MAX_BYTES = 1 << 30
+SUFFIX = ".npz"
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("{!r} is not a setting".format(value))
+
+
+def _update(digest, array):
+    if array is None:
+        digest.update(b"-")
+        return
+    array = np.ascontiguousarray(array)
+    digest.update("{}{}".format(array.dtype.str, array.shape).encode("ascii"))
+    digest.update(array.tobytes())
+
+
+def conversion_key(mesh, pixels=None, **settings):
+    """
+    :param MeshData mesh:
+    :param numpy.ndarray pixels: (H, W, 3) image texture or None
+    :param settings: grid and options of the conversion, JSON serializable
+        or NumPy values
+    :return: hexadecimal digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update("b2mine {}".format(FORMAT_VERSION).encode("ascii"))
+    for array in (mesh.vertices, mesh.tri_vertex, mesh.tri_loop,
+                  mesh.loop_colors, mesh.loop_uvs, pixels):
+        _update(digest, array)
+    for array in (BlockDef.BLOCK_IDS, BlockDef.BLOCK_DATA,
+                  np.array([b.color for b in BlockDef.BLOCK_LIST])):
+        _update(digest, array)
+    # Matching through a lookup table gives other blocks for a few colors
+    digest.update("lut {}".format(BlockDef.lut_bits).encode("ascii"))
+    digest.update(json.dumps(
+        settings, sort_keys=True, default=_jsonable
+    ).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ConversionCache(object):
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param str directory: created when missing
+        :param int max_bytes: size cap of all entries
+        """
+        self.directory = directory or DEFAULT_DIRECTORY
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """
+        :param str key: as returned by conversion_key
+        :return: dict of the arrays stored under key, or None
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+            # Last use, for the eviction order
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, zipfile.BadZipFile):
+            # Missing, removed meanwhile or truncated
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        """Store arrays under key, then evict down to the size cap
+        :param str key:
+        :param dict arrays: names to arrays
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fd, temp = tempfile.mkstemp(suffix=SUFFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temp, self.path(key))
+        except BaseException:
+            os.remove(temp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        :return: list of (last use, bytes, path), least recently used first
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX) or name.startswith("tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+    def stats(self):
+        """
+        :return: dict of hits, misses and evictions of this instance,
+            and the entries and bytes on disk
+        """
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / float(lookups) if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+    def __str__(self):
+        return ("{hits} hits, {misses} misses, {evictions} evicted, "
+                "{entries} entries of {bytes} bytes").format(**self.stats())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Delta transfer of block maps
+
+Works on block maps in world offsets from an anchor. The blocks sent last
+time at an anchor are compared with the new ones, so only added or changed
+blocks are written and blocks that disappeared are cleared with air.
+"""
+import numpy as np
+
+from .block_map import BlockMap
+
+
+AIR = 0
+VERIFY_SLAB = 32
+
+
+class DeltaTracker(object):
+    """Diff of a block map streamed chunk by chunk against the previous one"""
+
+    def __init__(self, previous=None):
+        """
+        :param BlockMap previous: blocks sent last time, None to send all
+        """
+        self.previous = previous
+        self._seen = None
+        if previous is not None:
+            self._seen = np.zeros(len(previous), dtype=bool)
+        self.num_unchanged = 0
+
+    def changes(self, chunk):
+        """Blocks of chunk that are new or differ from the previous ones
+        :param BlockMap chunk:
+        :rtype: BlockMap
+        """
+        if self.previous is None:
+            return chunk
+
+        index = self.previous.find_many(chunk.positions)
+        found = index >= 0
+        self._seen[index[found]] = True
+
+        same = np.zeros(len(chunk), dtype=bool)
+        same[found] = (
+            (self.previous.block_ids[index[found]] == chunk.block_ids[found]) &
+            (self.previous.block_data[index[found]] == chunk.block_data[found])
+        )
+        self.num_unchanged += int(same.sum())
+        return chunk[~same]
+
+    def removals(self):
+        """Air for every previous block no chunk covered
+        :rtype: BlockMap
+        """
+        if self.previous is None:
+            return BlockMap()
+        gone = self.previous.positions[~self._seen]
+        return BlockMap(gone, np.full(len(gone), AIR), None)
+
+
+def diff(previous, current):
+    """Blocks to write to turn previous into current
+    :param BlockMap previous:
+    :param BlockMap current:
+    :rtype: BlockMap
+    """
+    tracker = DeltaTracker(previous)
+    return BlockMap.concatenate((tracker.changes(current), tracker.removals()))
+
+
+def iter_regions(block_map, slab=VERIFY_SLAB):
+    """Split the bounds of block_map into boxes of at most slab blocks a side
+    :return: iterator of inclusive (lower, upper) corners holding blocks
+    """
+    if not len(block_map):
+        return
+    lower, upper = (np.array(b) for b in block_map.bounds())
+    cells = np.unique((block_map.positions - lower) // slab, axis=0)
+    for cell in cells:
+        box_lower = lower + cell * slab
+        box_upper = np.minimum(box_lower + slab - 1, upper)
+        yield tuple(box_lower.tolist()), tuple(box_upper.tolist())
+
+
+def parse_get_blocks(reply, lower, upper):
+    """Block ids replied to world.getBlocks, as a dense array
+    :param str reply: comma separated ids, y major then x then z
+    :param tuple lower: inclusive corner sent with the query
+    :param tuple upper: inclusive corner sent with the query
+    :return: (X, Y, Z) int array indexed by position - lower
+    """
+    shape = tuple(u - l + 1 for l, u in zip(lower, upper))
+    ids = np.array(reply.strip().split(","), dtype=np.int64)
+    return ids.reshape(shape[1], shape[0], shape[2]).transpose(1, 0, 2)
+
+
+def block_data_queries(positions, origin):
+    """world.getBlockWithData lines for positions
+    :param numpy.ndarray positions: (N, 3) offsets from origin
+    :param tuple origin: integer (x, y, z)
+    :rtype: list
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3) + \
+        np.asarray(origin, dtype=np.int64)
+    return ["world.getBlockWithData({},{},{})\n".format(x, y, z)
+            for x, y, z in positions.tolist()]
+
+
+def parse_block_data(replies):
+    """Block data replied to world.getBlockWithData
+    :param list replies: "id,data" lines
+    :return: (N,) int array
+    """
+    return np.array([int(reply.split(",")[1]) for reply in replies],
+                    dtype=np.int64).reshape(-1)
+
+
+def find_mismatches(block_map, read_region, read_data=None,
+                    slab=VERIFY_SLAB):
+    """Blocks of block_map the server does not hold
+    :param BlockMap block_map: world offsets, as sent
+    :param read_region: callable taking inclusive (lower, upper) corners
+        and returning the reply of world.getBlocks for them
+    :param read_data: callable taking (M, 3) positions and returning
+        their (M,) block data, asked for the blocks of the right id. None
+        to compare block ids only, which misses e.g. a wool of another
+        colour.
+    :param int slab: edge of the regions read at once
+    :return: BlockMap of the blocks to send again
+    """
+    positions = block_map.positions
+    wrong = np.zeros(len(block_map), dtype=bool)
+    for lower, upper in iter_regions(block_map, slab):
+        inside = np.flatnonzero(
+            ((positions >= lower) & (positions <= upper)).all(axis=1))
+        actual = parse_get_blocks(read_region(lower, upper), lower, upper)
+        local = positions[inside] - np.asarray(lower)
+        wrong[inside] = (actual[local[:, 0], local[:, 1], local[:, 2]] !=
+                         block_map.block_ids[inside])
+        if read_data is None:
+            continue
+        same_id = inside[~wrong[inside]]
+        if len(same_id):
+            wrong[same_id] = (np.asarray(read_data(positions[same_id])) !=
+                              block_map.block_data[same_id])
+    return block_map[wrong]
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Incremental re-voxelization
+
+Every triangle gets a content hash of its corners and colors. Octree nodes
+at ``hash_level`` store the wrapping sum of the hashes of the triangles
+overlapping them, so a node whose triangle set did not change keeps its
+hash. A reconversion compares node hashes with the stored state and only
+descends into the nodes that differ, reusing the leaves of all others.
+Triangles only hash their UVs, so the texture they sample is hashed once
+for the whole state: another texture makes every leaf outdated.
+"""
+import hashlib
+import io
+
+import numpy as np
+
+
+# Levels between the hashed nodes and the leaves
+HASH_LEVELS_ABOVE_LEAVES = 3
+
+
+def hash_level(depth):
+    """
+    :param int depth: level of the leaves
+    :return: level of the hashed nodes
+    """
+    return max(depth - HASH_LEVELS_ABOVE_LEAVES, 0)
+
+
+def _mix(v):
+    """splitmix64 finalizer"""
+    with np.errstate(over="ignore"):
+        v = v.astype(np.uint64)
+        v ^= v >> np.uint64(30)
+        v *= np.uint64(0xbf58476d1ce4e5b9)
+        v ^= v >> np.uint64(27)
+        v *= np.uint64(0x94d049bb133111eb)
+        v ^= v >> np.uint64(31)
+    return v
+
+
+def triangle_hashes(triangles, colors=None, uvs=None):
+    """Content hash of every triangle
+    :param numpy.ndarray triangles: (T, 3, 3) corners
+    :param numpy.ndarray colors: (T, 3, 3) corner colors in [0, 1] or None
+    :param numpy.ndarray uvs: (T, 3, 2) corner UVs or None
+    :return: (T,) uint64
+    """
+    words = np.ascontiguousarray(triangles, dtype=np.float32)
+    words = words.reshape(len(words), -1).view(np.uint32)
+    if colors is not None:
+        rgb = np.clip(np.asarray(colors).reshape(len(words), -1), 0.0, 1.0)
+        words = np.hstack((words, (rgb * 255 + 0.5).astype(np.uint32)))
+    if uvs is not None:
+        uv = np.ascontiguousarray(uvs, dtype=np.float32)
+        words = np.hstack((words, uv.reshape(len(words), -1).view(np.uint32)))
+
+    h = np.zeros(len(words), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for column in words.T:
+            h = _mix(h * np.uint64(31) + column.astype(np.uint64))
+    return h
+
+
+def pixels_digest(pixels):
+    """
+    :param numpy.ndarray pixels: (H, W, 3) image texture or None
+    :return: hexadecimal digest, empty without texture
+    """
+    if pixels is None:
+        return ""
+    pixels = np.ascontiguousarray(pixels)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("{}{}".format(pixels.dtype.str, pixels.shape).encode(
+        "ascii"))
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+
+def node_hashes(codes, tri_index, tri_hashes):
+    """Hash of the set of triangles overlapping every node
+    :param numpy.ndarray codes: (P,) sorted node codes of the pairs
+    :param numpy.ndarray tri_index: (P,) triangle of every pair
+    :param numpy.ndarray tri_hashes: (T,) hash of every triangle
+    :return: unique node codes and their hashes
+    """
+    if not len(codes):
+        return codes, np.empty(0, dtype=np.uint64)
+    nodes, first = np.unique(codes, return_index=True)
+    with np.errstate(over="ignore"):
+        hashes = np.add.reduceat(_mix(tri_hashes[tri_index]), first)
+    return nodes, hashes.astype(np.uint64)
+
+
+def changed_nodes(old_nodes, old_hashes, new_nodes, new_hashes):
+    """Nodes added, removed, or whose triangle set changed
+    :return: sorted uint64 codes
+    """
+    common, old_i, new_i = np.intersect1d(
+        old_nodes, new_nodes, assume_unique=True, return_indices=True
+    )
+    modified = common[old_hashes[old_i] != new_hashes[new_i]]
+    added_or_removed = np.setxor1d(old_nodes, new_nodes, assume_unique=True)
+    return np.union1d(added_or_removed, modified).astype(np.uint64)
+
+
+def leaf_parents(leaf_codes, depth, level):
+    """Code of the ancestor at level of every leaf at depth"""
+    return np.asarray(leaf_codes, dtype=np.uint64) >> np.uint64(
+        3 * (depth - level))
+
+
+class IncrementalState(object):
+    """What a conversion leaves behind for the next one"""
+
+    VERSION = 2
+
+    def __init__(self, origin, size, depth, nodes, hashes, leaf_codes,
+                 leaf_rgb, pixels=""):
+        """
+        :param origin: minimum corner of the root cell
+        :param float size: edge length of the root cell
+        :param int depth: level of the leaves
+        :param numpy.ndarray nodes: codes of the hashed nodes
+        :param numpy.ndarray hashes: hash of every node
+        :param numpy.ndarray leaf_codes: sorted codes of the leaves
+        :param numpy.ndarray leaf_rgb: (N, 3) color of every leaf
+        :param str pixels: pixels_digest of the texture
+        """
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.size = float(size)
+        self.depth = int(depth)
+        self.nodes = np.asarray(nodes, dtype=np.uint64)
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.leaf_codes = np.asarray(leaf_codes, dtype=np.uint64)
+        self.leaf_rgb = np.asarray(leaf_rgb, dtype=np.float32)
+        self.pixels = str(pixels)
+
+    @property
+    def level(self):
+        return hash_level(self.depth)
+
+    def compatible(self, origin, size, depth, pixels=""):
+        """True if the grid and the texture are the same, i.e. leaves can
+        be reused
+        :param str pixels: pixels_digest of the texture
+        """
+        return (self.depth == depth and np.isclose(self.size, size) and
+                np.allclose(self.origin, origin) and self.pixels == pixels)
+
+    def dumps(self):
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            version=np.array(IncrementalState.VERSION),
+            origin=self.origin,
+            size=np.array(self.size),
+            depth=np.array(self.depth),
+            nodes=self.nodes,
+            hashes=self.hashes,
+            leaf_codes=self.leaf_codes,
+            leaf_rgb=self.leaf_rgb,
+            pixels=np.array(self.pixels)
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        """
+        :param bytes data:
+        :return: IncrementalState, or None for an unknown version
+        """
+        with np.load(io.BytesIO(bytes(data))) as f:
+            if int(f["version"]) != cls.VERSION:
+                return None
+            return cls(
+                f["origin"], float(f["size"]), int(f["depth"]), f["nodes"],
+                f["hashes"], f["leaf_codes"], f["leaf_rgb"], str(f["pixels"])
+            )
+
+
+def update(state, nodes, hashes, new_leaves):
+    """Merge the kept leaves with new ones below the changed nodes
+    :param IncrementalState state: previous state
+    :param numpy.ndarray nodes: node codes of the new mesh at state.level
+    :param numpy.ndarray hashes: their hashes
+    :param new_leaves: callable taking the changed node codes and
+        returning the sorted leaf codes below them and their (N, 3) rgb
+    :return: sorted leaf codes and their rgb
+    """
+    changed = changed_nodes(state.nodes, state.hashes, nodes, hashes)
+
+    parents = leaf_parents(state.leaf_codes, state.depth, state.level)
+    keep = ~np.isin(parents, changed)
+    fresh, fresh_rgb = new_leaves(changed)
+
+    codes = np.concatenate((state.leaf_codes[keep], fresh))
+    rgb = np.concatenate((
+        state.leaf_rgb[keep], np.asarray(fresh_rgb, dtype=np.float32)
+    ))
+
+    order = np.argsort(codes, kind="mergesort")
+    return codes[order], rgb[order]
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Greedy merging of blocks into axis aligned cuboids
+
+Adjacent blocks sharing block id and block data are merged into maximal
+boxes so that a whole box is sent with one ``setBlocks`` command.
+"""
+import numpy as np
+
+from .block_map import position_keys
+
+
+# Tile edge as a power of two, a multiple of the 16 blocks of a chunk
+# column: 64**3 cells take 1 MB of grid
+TILE_BITS = 6
+
+
+class CuboidList(object):
+    """Cuboids given by inclusive lower and upper corners"""
+
+    def __init__(self, lower, upper, block_ids, block_data):
+        self.lower = np.asarray(lower, dtype=np.int32).reshape(-1, 3)
+        self.upper = np.asarray(upper, dtype=np.int32).reshape(-1, 3)
+        self.block_ids = np.asarray(block_ids, dtype=np.uint16)
+        self.block_data = np.asarray(block_data, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.lower)
+
+    def __iter__(self):
+        return zip(
+            self.lower.tolist(),
+            self.upper.tolist(),
+            self.block_ids.tolist(),
+            self.block_data.tolist()
+        )
+
+    def take(self, index):
+        """
+        :param index: indices or boolean mask of the cuboids to keep
+        :rtype: CuboidList
+        """
+        return CuboidList(
+            self.lower[index], self.upper[index], self.block_ids[index],
+            self.block_data[index]
+        )
+
+    @property
+    def volumes(self):
+        return (self.upper - self.lower + 1).prod(axis=1)
+
+
+def merge_cuboids(block_map, tile_bits=TILE_BITS):
+    """Greedy 3D box merging over the block grid
+
+    Blocks are merged one tile of 2**tile_bits blocks a side at a time, so
+    the dense grid stays small however far apart the blocks are. Within a
+    tile, cells are visited in x, y, z order; each unvisited cell is grown
+    along z, then y, then x as long as the whole face stays of the same
+    kind. Cuboids do not cross tile borders.
+
+    :param BlockMap block_map:
+    :param int tile_bits: tile edge as a power of two
+    :rtype: CuboidList
+    """
+    if not len(block_map):
+        return CuboidList([], [], [], [])
+
+    positions = block_map.positions.astype(np.int64)
+    kinds = block_map.block_ids.astype(np.int64) << 8 | block_map.block_data
+    kind_values, labels = np.unique(kinds, return_inverse=True)
+    labels = labels.reshape(-1)
+
+    # Arithmetic shifts round down, negative positions included
+    tiles = position_keys(positions >> tile_bits)
+    order = np.argsort(tiles, kind="stable")
+    bounds = np.flatnonzero(np.diff(tiles[order])) + 1
+    boxes = [
+        _merge_grid(positions[index], labels[index])
+        for index in np.split(order, bounds)
+    ]
+
+    boxes = np.concatenate(boxes)
+    kind = kind_values[boxes[:, 6]]
+    return CuboidList(boxes[:, :3], boxes[:, 3:6], kind >> 8, kind & 0xff)
+
+
+def _merge_grid(positions, labels):
+    """
+    :return: (N, 7) inclusive lower and upper corners and label of the
+        cuboids covering positions
+    """
+    lower = positions.min(axis=0)
+    shape = tuple((positions.max(axis=0) - lower + 1).tolist())
+
+    grid = np.full(shape, -1, dtype=np.int32)
+    local = positions - lower
+    grid[local[:, 0], local[:, 1], local[:, 2]] = labels
+
+    done = grid < 0
+    done_flat = done.reshape(-1)
+    size_x, size_y, size_z = shape
+
+    boxes = []
+    for flat in np.flatnonzero(~done_flat).tolist():
+        if done_flat[flat]:
+            continue
+        x, y, z = np.unravel_index(flat, shape)
+        label = grid[x, y, z]
+
+        row = (grid[x, y, z:] == label) & ~done[x, y, z:]
+        z1 = z + (int(np.argmin(row)) if not row.all() else len(row))
+
+        y1 = y + 1
+        while y1 < size_y and _fits(grid, done, label, x, x + 1, y1, y1 + 1, z, z1):
+            y1 += 1
+
+        x1 = x + 1
+        while x1 < size_x and _fits(grid, done, label, x1, x1 + 1, y, y1, z, z1):
+            x1 += 1
+
+        done[x:x1, y:y1, z:z1] = True
+        boxes.append((x, y, z, x1 - 1, y1 - 1, z1 - 1, label))
+
+    boxes = np.array(boxes, dtype=np.int64).reshape(-1, 7)
+    boxes[:, :3] += lower
+    boxes[:, 3:6] += lower
+    return boxes
+
+
+def _fits(grid, done, label, x0, x1, y0, y1, z0, z1):
+    return ((grid[x0:x1, y0:y1, z0:z1] == label).all() and
+            not done[x0:x1, y0:y1, z0:z1].any())
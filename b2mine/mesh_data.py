@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Meshes as NumPy arrays
+
+A mesh is read once with ``foreach_get`` and fan triangulated. Nothing is
+linked to the scene and no operator is called, so conversion does not
+depend on the context it runs in. Decimation is optional and done by
+clustering vertices on a grid finer than the voxels.
+"""
+import numpy as np
+
+
+class MeshData(object):
+    """Triangulated mesh, with per loop colors and UVs kept per corner"""
+
+    def __init__(self, vertices, tri_vertex, tri_loop=None, loop_colors=None,
+                 loop_uvs=None):
+        """
+        :param numpy.ndarray vertices: (V, 3) coordinates
+        :param numpy.ndarray tri_vertex: (T, 3) vertex of every corner
+        :param numpy.ndarray tri_loop: (T, 3) loop of every corner or None
+        :param numpy.ndarray loop_colors: (L, 3) colors or None
+        :param numpy.ndarray loop_uvs: (L, 2) UVs or None
+        """
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.tri_vertex = np.asarray(tri_vertex, dtype=np.int64).reshape(-1, 3)
+        self.tri_loop = tri_loop
+        self.loop_colors = loop_colors
+        self.loop_uvs = loop_uvs
+
+    @classmethod
+    def from_bpy(cls, mesh):
+        """Read a bpy mesh
+        :param bpy.types.Mesh mesh:
+        :rtype: MeshData
+        """
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+
+        loop_vertex = np.empty(len(mesh.loops), dtype=np.int64)
+        mesh.loops.foreach_get("vertex_index", loop_vertex)
+
+        loop_start = np.empty(len(mesh.polygons), dtype=np.int64)
+        loop_total = np.empty(len(mesh.polygons), dtype=np.int64)
+        mesh.polygons.foreach_get("loop_start", loop_start)
+        mesh.polygons.foreach_get("loop_total", loop_total)
+
+        tri_loop = triangulate_loops(loop_start, loop_total)
+        return cls(
+            co.reshape(-1, 3), loop_vertex[tri_loop], tri_loop,
+            _loop_colors(mesh), _loop_uvs(mesh)
+        )
+
+    @property
+    def num_triangles(self):
+        return len(self.tri_vertex)
+
+    @property
+    def triangles(self):
+        """(T, 3, 3) triangle corners"""
+        return self.vertices[self.tri_vertex]
+
+    @property
+    def triangle_colors(self):
+        """(T, 3, 3) corner colors, or None"""
+        if self.tri_loop is None or self.loop_colors is None:
+            return None
+        return self.loop_colors[self.tri_loop]
+
+    @property
+    def triangle_uvs(self):
+        """(T, 3, 2) corner UVs, or None"""
+        if self.tri_loop is None or self.loop_uvs is None:
+            return None
+        return self.loop_uvs[self.tri_loop]
+
+    def bounds(self):
+        """
+        :return: minimum and maximum corner of the vertices
+        """
+        return self.vertices.min(axis=0), self.vertices.max(axis=0)
+
+    def decimated(self, cluster_size):
+        """Merge the vertices of every cluster_size cube into their mean
+        and drop the triangles that collapse
+        :param float cluster_size: edge of the clustering grid
+        :rtype: MeshData
+        """
+        if not len(self.vertices) or cluster_size <= 0:
+            return self
+
+        keys = np.floor(
+            (self.vertices - self.vertices.min(axis=0)) / cluster_size
+        ).astype(np.int64)
+        _, cluster, counts = np.unique(
+            keys, axis=0, return_inverse=True, return_counts=True
+        )
+        cluster = cluster.reshape(-1)
+        vertices = np.column_stack([
+            np.bincount(cluster, weights=self.vertices[:, axis])
+            for axis in range(3)
+        ]) / counts[:, None]
+
+        tri_vertex = cluster[self.tri_vertex]
+        keep = ((tri_vertex[:, 0] != tri_vertex[:, 1]) &
+                (tri_vertex[:, 1] != tri_vertex[:, 2]) &
+                (tri_vertex[:, 2] != tri_vertex[:, 0]))
+        return MeshData(
+            vertices, tri_vertex[keep],
+            None if self.tri_loop is None else self.tri_loop[keep],
+            self.loop_colors, self.loop_uvs
+        )
+
+
+def triangulate(co, loop_vertex, loop_start, loop_total):
+    """Fan triangulate polygons given in Blender's loop layout
+    :param numpy.ndarray co: (V, 3) vertex coordinates
+    :param numpy.ndarray loop_vertex: vertex index of every loop
+    :param numpy.ndarray loop_start: first loop of every polygon
+    :param numpy.ndarray loop_total: number of loops of every polygon
+    :return: (T, 3, 3) triangle corners
+    """
+    return co[triangulate_loops(loop_start, loop_total, loop_vertex)]
+
+
+def triangulate_loops(loop_start, loop_total, loop_vertex=None):
+    """Fan triangulate polygons into (T, 3) loop (or vertex) indices
+    :param numpy.ndarray loop_start:
+    :param numpy.ndarray loop_total:
+    :param numpy.ndarray loop_vertex: map the loops to vertices when given
+    :rtype: numpy.ndarray
+    """
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    num_tris = np.maximum(loop_total - 2, 0)
+    poly = np.repeat(np.arange(len(loop_start)), num_tris)
+    first = np.cumsum(num_tris) - num_tris
+    k = np.arange(len(poly)) - first[poly]
+
+    start = loop_start[poly]
+    tris = np.stack((start, start + k + 1, start + k + 2), axis=1)
+    if loop_vertex is not None:
+        tris = np.asarray(loop_vertex)[tris]
+    return tris
+
+
+def _loop_colors(mesh):
+    """(L, 3) colors of the active color layer, or None"""
+    if not mesh.vertex_colors:
+        return None
+    layer = mesh.vertex_colors.active or mesh.vertex_colors[0]
+    channels = len(layer.data[0].color) if len(layer.data) else 3
+    colors = np.empty(len(layer.data) * channels, dtype=np.float32)
+    layer.data.foreach_get("color", colors)
+    return colors.reshape(-1, channels)[:, :3]
+
+
+def _loop_uvs(mesh):
+    """(L, 2) coordinates of the active UV map, or None"""
+    if not mesh.uv_layers:
+        return None
+    layer = mesh.uv_layers.active or mesh.uv_layers[0]
+    uvs = np.empty(len(layer.data) * 2, dtype=np.float32)
+    layer.data.foreach_get("uv", uvs)
+    return uvs.reshape(-1, 2)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""OBJ and PLY readers producing MeshData, for conversions without Blender
+
+Vertex colors are read from the ``v x y z r g b`` extension of OBJ and the
+red / green / blue properties of PLY. UVs come from ``vt`` and the usual
+PLY texture coordinate properties. Textures of OBJ materials are found
+through ``mtllib`` / ``map_Kd``.
+"""
+import os
+
+import numpy as np
+
+from .mesh_data import MeshData, triangulate_loops
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+MESH_EXTENSIONS = (".obj", ".ply")
+
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1",
+    "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2",
+    "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4",
+    "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4",
+    "double": "f8", "float64": "f8",
+}
+
+_PLY_UV_NAMES = (("s", "t"), ("u", "v"), ("texture_u", "texture_v"))
+
+
+class MeshFormatError(Exception):
+    pass
+
+
+def load_mesh(path):
+    """
+    :param str path: .obj or .ply file
+    :rtype: MeshData
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".obj":
+        return load_obj(path)
+    if ext == ".ply":
+        return load_ply(path)
+    raise MeshFormatError("Unsupported mesh file: {}".format(path))
+
+
+def load_obj(path):
+    """
+    :param str path:
+    :rtype: MeshData
+    """
+    co, rgb, uv = [], [], []
+    loop_vertex, loop_uv, loop_start, loop_total = [], [], [], []
+
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            key = fields[0]
+            if key == "v":
+                co.append([float(v) for v in fields[1:4]])
+                if len(fields) >= 7:
+                    rgb.append([float(v) for v in fields[4:7]])
+            elif key == "vt":
+                uv.append([float(v) for v in fields[1:3]])
+            elif key == "f":
+                loop_start.append(len(loop_vertex))
+                loop_total.append(len(fields) - 1)
+                for corner in fields[1:]:
+                    refs = corner.split("/")
+                    loop_vertex.append(_obj_index(refs[0], len(co)))
+                    loop_uv.append(
+                        _obj_index(refs[1], len(uv))
+                        if len(refs) > 1 and refs[1] else -1
+                    )
+
+    if not co:
+        raise MeshFormatError("No vertices in {}".format(path))
+    loop_vertex = np.array(loop_vertex, dtype=np.int64)
+    loop_uv = np.array(loop_uv, dtype=np.int64)
+
+    loop_colors = None
+    if rgb and len(rgb) == len(co):
+        loop_colors = np.array(rgb, dtype=np.float32)[loop_vertex]
+    loop_uvs = None
+    if uv and (loop_uv >= 0).all():
+        loop_uvs = np.array(uv, dtype=np.float32)[loop_uv]
+
+    tri_loop = triangulate_loops(loop_start, loop_total)
+    return MeshData(
+        co, loop_vertex[tri_loop], tri_loop, loop_colors, loop_uvs
+    )
+
+
+def obj_texture(path):
+    """Diffuse texture of the first material of an OBJ defining one
+    :param str path:
+    :return: path of the image, or None
+    """
+    folder = os.path.dirname(path)
+    with open(path, "r") as f:
+        libraries = [line.split(None, 1)[1].strip() for line in f
+                     if line.startswith("mtllib ")]
+    for library in libraries:
+        library = os.path.join(folder, library)
+        if not os.path.exists(library):
+            continue
+        with open(library, "r") as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == "map_Kd":
+                    # Options come first, the file name last
+                    return os.path.join(
+                        os.path.dirname(library), fields[-1]
+                    )
+    return None
+
+
+def load_ply(path):
+    """ASCII and binary PLY with vertex and face elements
+    :param str path:
+    :rtype: MeshData
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    header_end = data.find(b"end_header")
+    if not data.startswith(b"ply") or header_end < 0:
+        raise MeshFormatError("Not a PLY file: {}".format(path))
+    body = data.index(b"\n", header_end) + 1
+    fmt, elements = _ply_header(data[:body].decode("ascii").splitlines())
+
+    values = iter(data[body:].split()) if fmt == "ascii" else None
+    endian = ">" if fmt == "binary_big_endian" else "<"
+    offset = body
+
+    vertices = faces = None
+    for element in elements:
+        if values is not None:
+            result = _ply_ascii(values, element)
+        else:
+            result, offset = _ply_binary(data, offset, element, endian)
+        if element["name"] == "vertex":
+            vertices = result
+        elif element["name"] == "face":
+            faces = result
+    if vertices is None or faces is None:
+        raise MeshFormatError("PLY without vertex or face: {}".format(path))
+
+    co = np.column_stack([vertices[k] for k in "xyz"]).astype(np.float64)
+    loop_vertex = np.concatenate(faces) if faces else \
+        np.empty(0, dtype=np.int64)
+    loop_total = np.array([len(face) for face in faces], dtype=np.int64)
+    loop_start = np.cumsum(loop_total) - loop_total
+
+    loop_colors = None
+    if all(k in vertices for k in ("red", "green", "blue")):
+        rgb = np.column_stack(
+            [vertices[k] for k in ("red", "green", "blue")]
+        ).astype(np.float32)
+        if vertices["red"].dtype.kind in "iu":
+            rgb /= 255.0
+        loop_colors = rgb[loop_vertex]
+
+    loop_uvs = None
+    for u, v in _PLY_UV_NAMES:
+        if u in vertices and v in vertices:
+            uv = np.column_stack((vertices[u], vertices[v]))
+            loop_uvs = uv.astype(np.float32)[loop_vertex]
+            break
+
+    tri_loop = triangulate_loops(loop_start, loop_total)
+    return MeshData(
+        co, loop_vertex[tri_loop], tri_loop, loop_colors, loop_uvs
+    )
+
+
+def load_image(path):
+    """Read an image with Pillow, the way sampler.image_pixels returns it
+    :param str path:
+    :return: (H, W, 3) float32 array, bottom row first
+    """
+    if Image is None:
+        raise MeshFormatError(
+            "Pillow is needed to read {} outside Blender".format(path))
+    with Image.open(path) as image:
+        pixels = np.asarray(image.convert("RGB"), dtype=np.float32) / 255.0
+    return pixels[::-1]
+
+
+def _obj_index(ref, count):
+    """OBJ indices are 1 based, negative ones count from the end"""
+    i = int(ref)
+    return i - 1 if i > 0 else count + i
+
+
+def _ply_header(lines):
+    fmt = None
+    elements = []
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == "format":
+            fmt = fields[1]
+        elif fields[0] == "element":
+            elements.append(
+                {"name": fields[1], "count": int(fields[2]), "props": []}
+            )
+        elif fields[0] == "property":
+            if fields[1] == "list":
+                prop = (fields[4], _PLY_TYPES[fields[2]],
+                        _PLY_TYPES[fields[3]])
+            else:
+                prop = (fields[2], _PLY_TYPES[fields[1]], None)
+            elements[-1]["props"].append(prop)
+    if fmt not in ("ascii", "binary_little_endian", "binary_big_endian"):
+        raise MeshFormatError("Unknown PLY format {}".format(fmt))
+    return fmt, elements
+
+
+def _ply_ascii(values, element):
+    """Dict of property arrays, or a list of index arrays for faces"""
+    props = element["props"]
+    if element["name"] == "face":
+        faces = []
+        for _ in range(element["count"]):
+            face = None
+            for name, dtype, item in props:
+                if item is None:
+                    next(values)
+                    continue
+                n = int(next(values))
+                items = [int(next(values)) for _ in range(n)]
+                if name in ("vertex_indices", "vertex_index"):
+                    face = np.array(items, dtype=np.int64)
+            faces.append(face)
+        return faces
+
+    if any(item is not None for _, _, item in props):
+        raise MeshFormatError(
+            "List properties of {} are not supported".format(element["name"]))
+    rows = [[next(values) for _ in props] for _ in range(element["count"])]
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(props))
+    return {name: table[:, i].astype(dtype)
+            for i, (name, dtype, _) in enumerate(props)}
+
+
+def _ply_binary(data, offset, element, endian):
+    """Like _ply_ascii, also returning the offset after the element"""
+    props = element["props"]
+    count = element["count"]
+    if element["name"] != "face":
+        if any(item is not None for _, _, item in props):
+            raise MeshFormatError("List properties of {} are not "
+                                  "supported".format(element["name"]))
+        dtype = np.dtype([(name, endian + t) for name, t, _ in props])
+        table = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        return ({name: table[name] for name in table.dtype.names},
+                offset + dtype.itemsize * count)
+
+    if len(props) == 1 and props[0][2] is not None:
+        # Fast path when every face has as many corners as the first one
+        _, count_type, index_type = props[0]
+        count_type = np.dtype(endian + count_type)
+        index_type = np.dtype(endian + index_type)
+        if count:
+            n = int(np.frombuffer(data, count_type, 1, offset)[0])
+            dtype = np.dtype([("n", count_type), ("i", index_type, (n,))])
+            end = offset + dtype.itemsize * count
+            if end <= len(data):
+                table = np.frombuffer(data, dtype, count, offset)
+                if (table["n"] == n).all():
+                    indices = table["i"].astype(np.int64).reshape(count, n)
+                    return list(indices), end
+
+    faces = []
+    for _ in range(count):
+        face = None
+        for name, t, item in props:
+            t = np.dtype(endian + t)
+            n = int(np.frombuffer(data, t, 1, offset)[0])
+            offset += t.itemsize
+            if item is None:
+                continue
+            item = np.dtype(endian + item)
+            items = np.frombuffer(data, item, n, offset)
+            offset += item.itemsize * n
+            if name in ("vertex_indices", "vertex_index"):
+                face = items.astype(np.int64)
+        faces.append(face)
+    return faces, offset
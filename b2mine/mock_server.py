@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for a Spigot server running RaspberryJuice
+
+Speaks the line based text protocol of the Minecraft Pi API and keeps the
+world in a dict, so transfers can be measured and checked without a real
+server. Only depends on the standard library, so it can also be started
+on its own::
+
+    python mock_server.py --port 4711
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+
+class MockRaspberryJuice(object):
+
+    def __init__(self, address="127.0.0.1", port=0, player_pos=(0, 0, 0)):
+        """
+        :param str address:
+        :param int port: 0 picks a free port
+        :param tuple player_pos: returned by player.getPos
+        """
+        self.address = address
+        self.port = port
+        self.player_pos = player_pos
+        self.blocks = {}
+        self.num_commands = 0
+        self.num_connections = 0
+        # Writes landing in another chunk column than the previous write of
+        # their connection, what makes a server load and relight chunks
+        self.chunk_switches = 0
+        # Runs of writes of one connection into one column, the number of
+        # columns when every column is written in one go
+        self.chunk_visits = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Serve from a background thread
+        :return: address and port actually listened on
+        """
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(asyncio.start_server(
+                self._handle, self.address, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.address, self.port
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def reset(self):
+        with self._lock:
+            self.blocks.clear()
+            self.num_commands = 0
+            self.chunk_switches = 0
+            self.chunk_visits = 0
+
+    def get_block(self, x, y, z):
+        """
+        :return: (block id, block data), air being (0, 0)
+        """
+        return self.blocks.get((x, y, z), (0, 0))
+
+    async def _handle(self, reader, writer):
+        self.num_connections += 1
+        session = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = self.execute(line.decode("ascii").strip(), session)
+                if reply is not None:
+                    writer.write((reply + "\n").encode("ascii"))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, line, session=None):
+        """Run one protocol command
+        :param str line: e.g. "world.setBlock(1,2,3,35,4)"
+        :param dict session: state of the connection line came from
+        :return: reply line without newline, or None
+        """
+        if not line:
+            return None
+        name, _, args = line.partition("(")
+        args = args.rstrip(")")
+        args = args.split(",") if args else []
+
+        with self._lock:
+            self.num_commands += 1
+            if name == "world.setBlock":
+                x, y, z, block_id = (int(float(a)) for a in args[:4])
+                block_data = int(args[4]) if len(args) > 4 else 0
+                self._touch_chunk(session, x, z)
+                self.blocks[(x, y, z)] = (block_id, block_data)
+            elif name == "world.setBlocks":
+                x0, y0, z0, x1, y1, z1, block_id = \
+                    (int(float(a)) for a in args[:7])
+                block_data = int(args[7]) if len(args) > 7 else 0
+                self._touch_chunk(session, min(x0, x1), min(z0, z1))
+                for x in _span(x0, x1):
+                    for y in _span(y0, y1):
+                        for z in _span(z0, z1):
+                            self.blocks[(x, y, z)] = (block_id, block_data)
+            elif name == "world.getBlock":
+                return str(self.get_block(*(int(a) for a in args))[0])
+            elif name == "world.getBlockWithData":
+                return "{},{}".format(*self.get_block(*(int(a) for a in args)))
+            elif name == "world.getBlocks":
+                x0, y0, z0, x1, y1, z1 = (int(a) for a in args)
+                return ",".join(
+                    str(self.get_block(x, y, z)[0])
+                    for y in _span(y0, y1)
+                    for x in _span(x0, x1)
+                    for z in _span(z0, z1)
+                )
+            elif name == "world.getHeight":
+                return "0"
+            elif name in ("player.getPos", "player.getTilePos"):
+                return ",".join(str(v) for v in self.player_pos)
+            return None
+
+    def _touch_chunk(self, session, x, z):
+        if session is None:
+            return
+        chunk = (x >> 4, z >> 4)
+        if session.get("chunk", chunk) != chunk:
+            self.chunk_switches += 1
+        if session.get("chunk") != chunk:
+            self.chunk_visits += 1
+        session["chunk"] = chunk
+
+
+def _span(a, b):
+    return range(min(a, b), max(a, b) + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4711)
+    args = parser.parse_args()
+
+    server = MockRaspberryJuice(args.address, args.port)
+    address, port = server.start()
+    print("Listening on {}:{}".format(address, port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print("{} commands, {} blocks, {} chunk switches".format(
+            server.num_commands, len(server.blocks), server.chunk_switches))
+
+
+if __name__ == "__main__":
+    main()
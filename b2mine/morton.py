@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Morton (Z-order) codes of octree cells
+
+A cell at level L with integer coordinates (x, y, z) is coded by
+interleaving the bits of x, y and z, x being the most significant of each
+triple. The eight children of ``code`` are then ``code << 3 | child`` with
+``child = dx << 2 | dy << 1 | dz``, so sorting codes sorts cells by subtree.
+"""
+import numpy as np
+
+
+MAX_LEVEL = 21
+
+_SPREAD = (
+    (32, 0x1f00000000ffff),
+    (16, 0x1f0000ff0000ff),
+    (8, 0x100f00f00f00f00f),
+    (4, 0x10c30c30c30c30c3),
+    (2, 0x1249249249249249),
+)
+
+_COMPACT = (
+    (2, 0x10c30c30c30c30c3),
+    (4, 0x100f00f00f00f00f),
+    (8, 0x1f0000ff0000ff),
+    (16, 0x1f00000000ffff),
+    (32, 0x1fffff),
+)
+
+
+def _spread(v):
+    v = v.astype(np.uint64) & np.uint64(0x1fffff)
+    for shift, mask in _SPREAD:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def _compact(v):
+    v = v & np.uint64(0x1249249249249249)
+    for shift, mask in _COMPACT:
+        v = (v | (v >> np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def encode(cells):
+    """
+    :param numpy.ndarray cells: (N, 3) non negative integer coordinates
+    :return: (N,) uint64 codes
+    """
+    cells = np.asarray(cells).reshape(-1, 3)
+    return ((_spread(cells[:, 0]) << np.uint64(2)) |
+            (_spread(cells[:, 1]) << np.uint64(1)) |
+            _spread(cells[:, 2]))
+
+
+def decode(codes):
+    """
+    :param numpy.ndarray codes: (N,) uint64 codes
+    :return: (N, 3) int64 coordinates
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    return np.stack((
+        _compact(codes >> np.uint64(2)),
+        _compact(codes >> np.uint64(1)),
+        _compact(codes)
+    ), axis=1).astype(np.int64)
+
+
+def children(codes):
+    """Codes of the eight children of every code, child major per parent
+    :param numpy.ndarray codes: (N,) uint64
+    :return: (N * 8,) uint64
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    return ((codes[:, None] << np.uint64(3)) |
+            np.arange(8, dtype=np.uint64)[None]).reshape(-1)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Blocks enclosed by other blocks, which no player can see
+
+A block is on the surface when one of its six neighbours is empty. Peeling
+the surface off ``thickness`` times leaves the blocks hidden below a shell
+that thick. Neighbours are looked up on sorted position keys, where a step
+along an axis is a constant added to the key.
+"""
+import numpy as np
+
+from .block_map import BlockMap, position_keys
+
+
+STONE = 1
+
+# Key offsets of the six neighbours, see position_keys
+_NEIGHBOURS = np.array(
+    [1 << 42, -(1 << 42), 1 << 21, -(1 << 21), 1, -1], dtype=np.int64
+)
+
+
+def hidden_mask(positions, thickness=1):
+    """
+    :param numpy.ndarray positions: (N, 3) unique block positions
+    :param int thickness: blocks of shell kept under the surface
+    :return: (N,) True for blocks deeper than thickness
+    """
+    keys = position_keys(positions)
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    inside = np.ones(len(keys), dtype=bool)
+    for _ in range(max(int(thickness), 1)):
+        remaining = keys[inside]
+        if not len(remaining):
+            break
+        covered = np.ones(len(remaining), dtype=bool)
+        for offset in _NEIGHBOURS:
+            neighbours = remaining + offset
+            i = np.minimum(
+                np.searchsorted(remaining, neighbours), len(remaining) - 1
+            )
+            covered &= remaining[i] == neighbours
+        inside[inside] = covered
+
+    mask = np.empty(len(keys), dtype=bool)
+    mask[order] = inside
+    return mask
+
+
+def cull(block_map, thickness=1, fill=None, in_place=False):
+    """Drop the hidden blocks, or make them all one kind so they merge
+    into few cuboids
+    :param BlockMap block_map:
+    :param int thickness: blocks of shell kept under the surface
+    :param int fill: block id of the hidden blocks, None to drop them
+    :param bool in_place: fill the hidden blocks of block_map itself
+        instead of a copy
+    :return: BlockMap and the number of hidden blocks
+    """
+    hidden = hidden_mask(block_map.positions, thickness)
+    num_hidden = int(hidden.sum())
+    if not num_hidden:
+        return block_map, 0
+    if fill is None:
+        return block_map[~hidden], num_hidden
+
+    if in_place:
+        block_map.block_ids[hidden] = fill
+        block_map.block_data[hidden] = 0
+        return block_map, num_hidden
+    block_ids = block_map.block_ids.copy()
+    block_data = block_map.block_data.copy()
+    block_ids[hidden] = fill
+    block_data[hidden] = 0
+    return BlockMap(block_map.positions, block_ids, block_data), num_hidden
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""Mesh to BlockMap conversion without Blender
+
+Converter wraps this for the add-on, the batch converter uses it directly
+on meshes read from files.
+"""
+import contextlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from . import cache
+from . import incremental
+from . import morton
+from . import sampler
+from . import trace
+from . import voxelizer
+from .block_def import BlockDef
+from .block_map import BlockMap
+from .pyramid import Pyramid
+
+
+def root_cell(mesh):
+    """Cube around the bounding box of mesh, as the add-on chooses it
+    :param MeshData mesh:
+    :return: minimum corner and edge length
+    """
+    lower, upper = mesh.bounds()
+    size = float((upper - lower).max())
+    if size <= 0:
+        size = 1.0
+    return tuple(((lower + upper) / 2.0 - size / 2.0).tolist()), size
+
+
+def fit_grid(mesh, blocks=None, block_size=None):
+    """Grid of cubic cells fitted to the bounding box of mesh
+
+    Cells are ``block_size`` long, or as long as needed for ``blocks`` of
+    them along the longest axis. Every axis gets the number of cells
+    covering the box, centred on it. The octree is rooted at the minimum
+    corner of the grid, and its cells outside the box hold no triangles, so
+    the descent never enters them.
+
+    :param MeshData mesh:
+    :param int blocks: number of blocks along the longest axis
+    :param float block_size: edge length of a block, used over ``blocks``
+    :return: origin, size and max_depth as taken by Pipeline.run, and the
+        (3,) number of cells along every axis, its ``dims`` argument
+    """
+    lower, upper = mesh.bounds()
+    extent = upper - lower
+    if block_size is None:
+        if not blocks or blocks < 1:
+            raise ValueError("Give a number of blocks or a block size")
+        longest = float(extent.max())
+        block_size = longest / blocks if longest > 0 else 1.0
+    if block_size <= 0:
+        raise ValueError("Block size must be positive")
+
+    # The tolerance keeps the longest axis at exactly ``blocks`` cells
+    dims = np.maximum(
+        np.ceil(extent / block_size - 1e-6).astype(np.int64), 1
+    )
+    leaf_depth = (int(dims.max()) - 1).bit_length()
+    if leaf_depth + 1 > Pipeline.MAX_OCTREE:
+        raise ValueError("At most {} blocks along an axis".format(
+            2 ** (Pipeline.MAX_OCTREE - 1)))
+
+    origin = (lower + upper) / 2.0 - dims * block_size / 2.0
+    size = block_size * 2 ** leaf_depth
+    return tuple(origin.tolist()), size, leaf_depth + 1, dims
+
+
+class Pipeline(object):
+
+    DEFAULT_OCTREE = 3
+    MAX_OCTREE = 12
+
+    # Leaves and their colors, as collected while descending the octree
+    LEAF_DTYPE = np.dtype([("code", np.uint64), ("rgb", np.float32, 3)])
+
+    # Edge of the decimation clusters, relative to the leaf cells
+    CLUSTER_FRACTION = 0.5
+
+    def __init__(self, mesh, pixels=None, use_lab=False, decimate=False):
+        """
+        :param MeshData mesh:
+        :param numpy.ndarray pixels: (H, W, 3) image texture or None
+        :param bool use_lab: match block colors in CIELAB instead of RGB
+        :param bool decimate: merge vertices closer than half a voxel
+            before voxelizing
+        """
+        self.mesh = mesh
+        self.pixels = pixels
+        self.use_lab = use_lab
+        self.decimate = decimate
+        self.memory_budget = voxelizer.DEFAULT_MEMORY_BUDGET
+        self.triangles = None
+        self.cells = None
+        self.cell_unit = None
+        self.leaf_rgb = None
+        self.rgb = None
+        self.state = None
+        self.block_map = BlockMap()
+        self.unit = None
+        # Cells along every axis of a grid from fit_grid, or None
+        self.dims = None
+        self.pyramid = None
+        # cache.ConversionCache looked up by run, and whether it had the
+        # result
+        self.cache = None
+        self.cache_hit = False
+        # Seconds spent in every stage, in the order they ran
+        self.timings = OrderedDict()
+        # Set to a progress.Progress to follow and cancel a run from
+        # another thread
+        self.progress = None
+        # (codes, rgb) of the leaves colored so far while a progress is
+        # followed, for partial previews
+        self.partial_leaves = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.progress is not None:
+            self.progress.check()
+            self.progress.start_stage(name)
+        start = time.time()
+        try:
+            with trace.span(name):
+                yield
+        finally:
+            self.timings[name] = \
+                self.timings.get(name, 0.0) + time.time() - start
+
+    def run(self, origin, size, max_depth, solid=False, previous=None,
+            dims=None, pyramid=False):
+        """
+        :param tuple origin: minimum corner of the root cell
+        :param float size: edge length of the root cell
+        :param int max_depth: octree depth
+        :param bool solid: also fill the interior of closed surfaces
+        :param incremental.IncrementalState previous: state of the last
+            conversion, only octree nodes whose triangles changed since
+            then are voxelized again
+        :param dims: cells along every axis, leaves beyond are dropped
+        :param bool pyramid: also build self.pyramid
+        :rtype: BlockMap
+        """
+        key = None
+        if self.cache is not None:
+            with self.stage("cache"):
+                key = cache.conversion_key(
+                    self.mesh, self.pixels, origin=origin, size=size,
+                    max_depth=max_depth, solid=solid, dims=dims,
+                    lab=self.use_lab, decimate=self.decimate
+                )
+                self.cache_hit = self.restore(self.cache.get(key))
+            if self.cache_hit:
+                if pyramid and self.pyramid is None:
+                    self.build_pyramid(origin)
+                return self.block_map
+
+        self.create_voxel(origin, size, max_depth, previous, dims)
+        self.assign_blocks(origin, solid)
+        if pyramid:
+            self.build_pyramid(origin)
+        if key is not None:
+            with self.stage("cache"):
+                self.cache.put(key, self.cached_arrays())
+        return self.block_map
+
+    def cached_arrays(self):
+        """Everything restore needs, as arrays for the cache
+        :rtype: dict
+        """
+        arrays = {
+            "unit": np.array(self.unit),
+            "cell_unit": np.array(self.cell_unit),
+            "dims": np.zeros(0) if self.dims is None else self.dims,
+            "cells": self.cells,
+            "rgb": self.rgb,
+            "positions": self.block_map.positions,
+            "block_ids": self.block_map.block_ids,
+            "block_data": self.block_map.block_data,
+            "state": np.frombuffer(self.state.dumps(), dtype=np.uint8),
+        }
+        if self.pyramid is not None:
+            arrays["pyramid"] = np.frombuffer(
+                self.pyramid.dumps(), dtype=np.uint8
+            )
+        return arrays
+
+    def restore(self, arrays):
+        """Take the result of a run from cached_arrays
+        :param dict arrays: or None
+        :return: False if arrays are None or outdated
+        """
+        if arrays is None:
+            return False
+        state = incremental.IncrementalState.loads(arrays["state"].tobytes())
+        if state is None:
+            return False
+        self.pyramid = None
+        if "pyramid" in arrays:
+            self.pyramid = Pyramid.loads(arrays["pyramid"].tobytes())
+        self.state = state
+        self.unit = float(arrays["unit"])
+        self.cell_unit = float(arrays["cell_unit"])
+        self.dims = arrays["dims"] if len(arrays["dims"]) else None
+        self.cells = arrays["cells"]
+        self.rgb = arrays["rgb"]
+        self.leaf_rgb = state.leaf_rgb
+        self.block_map = BlockMap(
+            arrays["positions"], arrays["block_ids"], arrays["block_data"]
+        )
+        return True
+
+    def create_voxel(self, origin, size, max_depth, previous=None,
+                     dims=None):
+        # Calc unit length
+        self.unit = size / float(2 ** max_depth)
+
+        # Leaves are one level above max_depth, hence block positions
+        # being on a grid of twice the unit length
+        leaf_depth = max(max_depth - 1, 0)
+        self.cell_unit = size / float(2 ** leaf_depth)
+
+        mesh = self.mesh
+        if self.decimate:
+            with self.stage("decimate"):
+                mesh = mesh.decimated(
+                    self.cell_unit * Pipeline.CLUSTER_FRACTION
+                )
+            trace.count("triangles decimated",
+                        self.mesh.num_triangles - mesh.num_triangles)
+        self.triangles = mesh.triangles
+        colors = sampler.SurfaceColors(
+            mesh.triangle_colors, mesh.triangle_uvs, self.pixels
+        )
+
+        # Hash the triangle set of every node a few levels above the leaves
+        with self.stage("hash"):
+            level = incremental.hash_level(leaf_depth)
+            codes, tri_index = voxelizer.frontier(
+                self.triangles, origin, size, level
+            )
+            nodes, hashes = incremental.node_hashes(
+                codes, tri_index, incremental.triangle_hashes(
+                    self.triangles, colors.loop_colors, colors.uvs
+                )
+            )
+            pixels = incremental.pixels_digest(self.pixels)
+
+        def leaves_below(selected):
+            # Every leaf is colored from the closest of the triangles
+            # passing through it as soon as its pairs come out
+            mask = np.isin(codes, selected)
+            # Chunks come out in Morton order, so the share of start nodes
+            # up to the parent of the last leaf is the fraction done
+            start_nodes = np.unique(codes[mask])
+            shift = np.uint64(3 * (leaf_depth - level))
+            store = voxelizer.LeafStore(
+                self.memory_budget, Pipeline.LEAF_DTYPE
+            )
+            try:
+                for leaf_codes, leaf_tris in voxelizer.iter_leaf_pairs(
+                        self.triangles, origin, size, leaf_depth,
+                        memory_budget=self.memory_budget,
+                        start=(codes[mask], tri_index[mask], level),
+                        progress=self.progress):
+                    leaf_codes, leaf_tris, bary = sampler.nearest_triangles(
+                        leaf_codes, leaf_tris, self.triangles, origin,
+                        self.cell_unit
+                    )
+                    leaves = np.empty(len(leaf_codes), Pipeline.LEAF_DTYPE)
+                    leaves["code"] = leaf_codes
+                    leaves["rgb"] = colors.sample(leaf_tris, bary)
+                    store.append(leaves)
+                    trace.count("voxels emitted", len(leaves))
+                    if self.progress is not None:
+                        self.partial_leaves.append(
+                            (leaves["code"], leaves["rgb"])
+                        )
+                        self.progress.voxels += len(leaves)
+                        done = np.searchsorted(
+                            start_nodes, leaf_codes[-1] >> shift, "right"
+                        )
+                        self.progress.fraction = \
+                            done / float(len(start_nodes))
+                # Read back a block at a time, never all records at once
+                leaf_codes = np.empty(store.count, dtype=np.uint64)
+                leaf_rgb = np.empty((store.count, 3), dtype=np.float32)
+                begin = 0
+                for leaves in store.iter_values():
+                    end = begin + len(leaves)
+                    leaf_codes[begin:end] = leaves["code"]
+                    leaf_rgb[begin:end] = leaves["rgb"]
+                    begin = end
+                return leaf_codes, leaf_rgb
+            finally:
+                store.close()
+
+        self.partial_leaves = []
+        with self.stage("voxelize"):
+            reusable = previous is not None and \
+                previous.compatible(origin, size, leaf_depth, pixels)
+            if reusable:
+                leaf_codes, self.leaf_rgb = incremental.update(
+                    previous, nodes, hashes, leaves_below
+                )
+            else:
+                leaf_codes, self.leaf_rgb = leaves_below(nodes)
+
+        self.partial_leaves = []
+        self.cells = morton.decode(leaf_codes)
+        self.dims = dims
+        if dims is not None:
+            # Only triangles on the maximum faces of the box reach beyond,
+            # and they are in the last cells inside as well
+            keep = np.all(self.cells < np.asarray(dims), axis=1)
+            if not keep.all():
+                leaf_codes = leaf_codes[keep]
+                self.leaf_rgb = self.leaf_rgb[keep]
+                self.cells = self.cells[keep]
+        self.state = incremental.IncrementalState(
+            origin, size, leaf_depth, nodes, hashes, leaf_codes, self.leaf_rgb,
+            pixels
+        )
+
+    def assign_blocks(self, origin, solid=False):
+        rgb = self.leaf_rgb
+
+        # Block positions are on the grid of self.unit
+        scale = int(round(self.cell_unit / self.unit))
+        positions = self.cells * scale
+
+        if solid:
+            with self.stage("fill"):
+                filled, nearest = voxelizer.fill_interior(
+                    self.cells, self.triangles, origin, self.cell_unit
+                )
+            # Filled cells take the color of the surface voxel closing
+            # their column
+            self.cells = np.concatenate((self.cells, filled))
+            rgb = np.concatenate((rgb, rgb[nearest]))
+            positions = np.concatenate((positions, filled * scale))
+
+        with self.stage("match"):
+            self.block_map = BlockMap(
+                positions, *BlockDef.match_many(rgb, lab=self.use_lab)
+            )
+        self.rgb = rgb
+
+    def build_pyramid(self, origin):
+        """Every coarser level of the last run, see pyramid.Pyramid
+        :param tuple origin: minimum corner of the root cell
+        :rtype: Pyramid
+        """
+        with self.stage("pyramid"):
+            self.pyramid = Pyramid.build(
+                self.cells, self.rgb, origin, self.state.size,
+                self.state.depth, self.dims, lab=self.use_lab
+            )
+        return self.pyramid
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Geometry of the voxel preview as one mesh
+
+Only faces between an occupied and an empty cell are emitted, and cube
+corners are shared between neighbouring cells.
+"""
+import numpy as np
+
+from .block_map import position_keys
+
+
+# Direction of every face and its corners, counter clockwise seen from outside
+FACE_DIRECTIONS = np.array((
+    (1, 0, 0), (-1, 0, 0),
+    (0, 1, 0), (0, -1, 0),
+    (0, 0, 1), (0, 0, -1),
+), dtype=np.int64)
+
+FACE_CORNERS = np.array((
+    ((1, 0, 0), (1, 1, 0), (1, 1, 1), (1, 0, 1)),
+    ((0, 0, 0), (0, 0, 1), (0, 1, 1), (0, 1, 0)),
+    ((0, 1, 0), (0, 1, 1), (1, 1, 1), (1, 1, 0)),
+    ((0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1)),
+    ((0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)),
+    ((0, 0, 0), (0, 1, 0), (1, 1, 0), (1, 0, 0)),
+), dtype=np.int64)
+
+
+class PreviewGeometry(object):
+
+    def __init__(self, vertices, faces, face_colors):
+        """
+        :param numpy.ndarray vertices: (V, 3) float coordinates
+        :param numpy.ndarray faces: (F, 4) vertex indices of quads
+        :param numpy.ndarray face_colors: (F, 3) RGB of every face
+        """
+        self.vertices = vertices
+        self.faces = faces
+        self.face_colors = face_colors
+
+    @property
+    def loop_colors(self):
+        """(F * 4, 3) color of every loop"""
+        return np.repeat(self.face_colors, 4, axis=0)
+
+
+def visible_faces(cells):
+    """Faces of the cells not shared with another cell
+    :param numpy.ndarray cells: (N, 3) integer cell coordinates
+    :return: (F,) cell index and (F,) direction index of every face
+    """
+    cells = np.asarray(cells, dtype=np.int64)
+    keys = position_keys(cells)
+    sorted_keys = np.sort(keys)
+
+    face_cell = []
+    face_dir = []
+    for d, direction in enumerate(FACE_DIRECTIONS):
+        neighbour = position_keys(cells + direction)
+        i = np.minimum(np.searchsorted(sorted_keys, neighbour),
+                       len(sorted_keys) - 1)
+        exposed = np.flatnonzero(sorted_keys[i] != neighbour)
+        face_cell.append(exposed)
+        face_dir.append(np.full(len(exposed), d, dtype=np.int64))
+
+    return np.concatenate(face_cell), np.concatenate(face_dir)
+
+
+def build_geometry(cells, colors, origin, unit, cull=True):
+    """
+    :param numpy.ndarray cells: (N, 3) integer cell coordinates
+    :param numpy.ndarray colors: (N, 3) RGB of every cell
+    :param origin: minimum corner of the grid
+    :param float unit: edge length of a cell
+    :param bool cull: drop faces shared by two occupied cells
+    :rtype: PreviewGeometry
+    """
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+    if not len(cells):
+        return PreviewGeometry(
+            np.empty((0, 3)), np.empty((0, 4), dtype=np.int64),
+            np.empty((0, 3), dtype=np.float32)
+        )
+
+    if cull:
+        face_cell, face_dir = visible_faces(cells)
+    else:
+        face_cell = np.repeat(np.arange(len(cells)), 6)
+        face_dir = np.tile(np.arange(6), len(cells))
+
+    lattice = (cells[face_cell][:, None, :] +
+               FACE_CORNERS[face_dir]).reshape(-1, 3)
+    _, first, faces = np.unique(
+        position_keys(lattice), return_index=True, return_inverse=True
+    )
+    vertices = (np.asarray(origin, dtype=np.float64) +
+                lattice[first] * float(unit))
+
+    return PreviewGeometry(
+        vertices, faces.reshape(-1, 4), colors[face_cell]
+    )
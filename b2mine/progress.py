@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Progress reporting and cancellation of work running in the background
+
+A Progress is shared between the thread doing the work, which updates it
+and calls ``check`` at safe points, and the UI, which reads it and may
+call ``cancel``. Nothing here touches Blender data.
+"""
+import threading
+import time
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Progress(object):
+
+    def __init__(self):
+        self.stage = ""
+        self.level = None
+        self.voxels = 0
+        self.blocks_sent = 0
+        self.commands_sent = 0
+        self.total_blocks = None
+        # Fraction of the current stage done, None when unknown
+        self.fraction = None
+        self.started = time.time()
+        self._stage_started = self.started
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        """Called by the worker where it can stop cleanly
+        :raises Cancelled: when cancel was called
+        """
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+    def start_stage(self, name):
+        self.stage = name
+        self.level = None
+        self.fraction = None
+        self._stage_started = time.time()
+
+    def eta(self):
+        """Seconds left in the current stage, extrapolated from its
+        fraction done, or None
+        """
+        if not self.fraction:
+            return None
+        spent = time.time() - self._stage_started
+        return spent * (1.0 - self.fraction) / self.fraction
+
+    def __str__(self):
+        parts = [self.stage or "starting"]
+        if self.level is not None:
+            parts.append("level {}".format(self.level))
+        if self.voxels:
+            parts.append("{} voxels".format(self.voxels))
+        if self.total_blocks:
+            parts.append("{}/{} blocks sent".format(
+                self.blocks_sent, self.total_blocks))
+        elif self.blocks_sent:
+            parts.append("{} blocks sent".format(self.blocks_sent))
+        if self.fraction is not None:
+            parts.append("{:.0f}%".format(100 * self.fraction))
+        eta = self.eta()
+        if eta is not None:
+            parts.append("ETA {:.0f} s".format(eta))
+        return ", ".join(parts)
+
+
+class BackgroundTask(object):
+    """Run a callable in a daemon thread, keeping its result or error"""
+
+    def __init__(self, target):
+        self.target = target
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self.result = self.target()
+        except BaseException as e:
+            self.error = e
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Block maps of every octree level, derived from a single conversion
+
+A cell of a level is occupied when one of its children is, so the levels
+above the leaves follow from the leaves by shifting their Morton codes.
+Colors are averaged over the leaves below and blocks matched once, so any
+coarser resolution is a slice of the stored arrays.
+"""
+import io
+
+import numpy as np
+
+from . import morton
+from .block_def import BlockDef
+from .block_map import BlockMap
+
+
+class Pyramid(object):
+
+    VERSION = 1
+
+    def __init__(self, origin, size, codes, rgb, block_ids, block_data,
+                 offsets, dims=None):
+        """Levels are stored one after the other, the root level first
+        :param origin: minimum corner of the root cell
+        :param float size: edge length of the root cell
+        :param numpy.ndarray codes: sorted codes of the cells of each level
+        :param numpy.ndarray rgb: (N, 3) mean color of every cell
+        :param numpy.ndarray block_ids: block matched to every cell
+        :param numpy.ndarray block_data:
+        :param numpy.ndarray offsets: (L + 2,) start of every level in the
+            arrays, then their length
+        :param dims: cells along every axis of the finest level, or None
+        """
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.size = float(size)
+        self.codes = np.asarray(codes, dtype=np.uint64)
+        self.rgb = np.asarray(rgb, dtype=np.float32)
+        self.block_ids = np.asarray(block_ids, dtype=BlockMap.ID_DTYPE)
+        self.block_data = np.asarray(block_data, dtype=BlockMap.DATA_DTYPE)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.dims = None if dims is None else np.asarray(dims, np.int64)
+
+    @classmethod
+    def build(cls, cells, rgb, origin, size, leaf_depth, dims=None,
+              lab=False):
+        """
+        :param numpy.ndarray cells: (N, 3) unique cells at leaf_depth
+        :param numpy.ndarray rgb: (N, 3) their colors
+        :param origin: minimum corner of the root cell
+        :param float size: edge length of the root cell
+        :param int leaf_depth: level of the cells, the root being level 0
+        :param dims: cells along every axis of a grid from fit_grid
+        :param bool lab: match block colors in CIELAB instead of RGB
+        :rtype: Pyramid
+        """
+        codes = morton.encode(cells)
+        order = np.argsort(codes)
+        codes = codes[order]
+        sums = np.asarray(rgb, dtype=np.float64)[order]
+        counts = np.ones(len(codes))
+
+        levels = [(codes, sums)]
+        for _ in range(leaf_depth):
+            codes, inverse = np.unique(
+                codes >> np.uint64(3), return_inverse=True
+            )
+            inverse = inverse.reshape(-1)
+            sums = np.stack([
+                np.bincount(inverse, sums[:, c], len(codes))
+                for c in range(3)
+            ], axis=1)
+            counts = np.bincount(inverse, counts, len(codes))
+            # Sums and counts carry on, so colors are the mean of leaves
+            levels.append((codes, sums / counts[:, None]))
+        levels.reverse()
+
+        offsets = np.cumsum([0] + [len(c) for c, _ in levels])
+        rgb = np.concatenate([r for _, r in levels]).astype(np.float32)
+        block_ids, block_data = BlockDef.match_many(rgb, lab=lab)
+        return cls(
+            origin, size, np.concatenate([c for c, _ in levels]), rgb,
+            block_ids, block_data, offsets, dims
+        )
+
+    @property
+    def max_depth(self):
+        """Octree depth of the finest level, as set on the panel"""
+        return len(self.offsets) - 1
+
+    def _level(self, max_depth):
+        if not 1 <= max_depth <= self.max_depth:
+            raise ValueError("Depth {} is not in the pyramid (1 to {})".format(
+                max_depth, self.max_depth))
+        level = max_depth - 1
+        return slice(self.offsets[level], self.offsets[level + 1])
+
+    def cell_unit(self, max_depth):
+        return self.size / float(2 ** (max_depth - 1))
+
+    def cells(self, max_depth):
+        """
+        :param int max_depth: octree depth
+        :return: (N, 3) cells and (N, 3) colors of that depth
+        """
+        level = self._level(max_depth)
+        return morton.decode(self.codes[level]), self.rgb[level]
+
+    def block_map(self, max_depth, expand_to=None):
+        """Blocks of a level, on the grid of the level or of a finer one
+        :param int max_depth: octree depth
+        :param int expand_to: depth of the grid to fill, e.g. to send a
+            coarse build as large as the full one. Every cell becomes a
+            cube of blocks.
+        :rtype: BlockMap
+        """
+        level = self._level(max_depth)
+        cells = morton.decode(self.codes[level])
+        block_ids = self.block_ids[level]
+        block_data = self.block_data[level]
+        if expand_to is not None and expand_to > max_depth:
+            factor = 2 ** (expand_to - max_depth)
+            offsets = np.indices((factor,) * 3).reshape(3, -1).T
+            cells = (cells[:, None, :] * factor + offsets[None]) \
+                .reshape(-1, 3)
+            block_ids = np.repeat(block_ids, len(offsets))
+            block_data = np.repeat(block_data, len(offsets))
+        # Block positions are on a grid of half the cells, see Pipeline
+        return BlockMap(cells * 2, block_ids, block_data)
+
+    def dumps(self):
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            version=np.array(Pyramid.VERSION),
+            origin=self.origin,
+            size=np.array(self.size),
+            codes=self.codes,
+            rgb=self.rgb,
+            block_ids=self.block_ids,
+            block_data=self.block_data,
+            offsets=self.offsets,
+            dims=np.zeros(0) if self.dims is None else self.dims
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        """
+        :param bytes data:
+        :return: Pyramid, or None for an unknown version
+        """
+        with np.load(io.BytesIO(bytes(data))) as f:
+            if int(f["version"]) != cls.VERSION:
+                return None
+            dims = f["dims"] if len(f["dims"]) else None
+            return cls(
+                f["origin"], float(f["size"]), f["codes"], f["rgb"],
+                f["block_ids"], f["block_data"], f["offsets"], dims
+            )
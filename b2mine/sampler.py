@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Batched surface color sampling at voxel centres
+
+The leaf pairs of the octree already tell which triangles pass through a
+cell, so the closest of them to the cell centre is found for every voxel
+at once. Its color is interpolated barycentrically from the loop colors,
+or looked up in an image texture through the interpolated UV.
+"""
+import numpy as np
+
+from . import morton
+
+
+# Number of pairs measured per NumPy batch
+BATCH_SIZE = 1 << 16
+
+WHITE = (1.0, 1.0, 1.0)
+
+
+def closest_points(points, tris):
+    """Closest point of every triangle to the point it is paired with
+    :param numpy.ndarray points: (P, 3)
+    :param numpy.ndarray tris: (P, 3, 3) triangle corners
+    :return: (P,) squared distances and (P, 3) barycentric coordinates of
+        the closest points
+    """
+    a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+    ab, ac, ap = b - a, c - a, points - a
+
+    # Projection on the plane, only valid when it falls inside
+    d00 = (ab * ab).sum(axis=1)
+    d01 = (ab * ac).sum(axis=1)
+    d11 = (ac * ac).sum(axis=1)
+    d20 = (ap * ab).sum(axis=1)
+    d21 = (ap * ac).sum(axis=1)
+    denom = d00 * d11 - d01 * d01
+    with np.errstate(divide="ignore", invalid="ignore"):
+        v = (d11 * d20 - d01 * d21) / denom
+        w = (d00 * d21 - d01 * d20) / denom
+        u = 1.0 - v - w
+        inside = (denom > 0) & (u >= 0) & (v >= 0) & (w >= 0)
+        normal = np.cross(ab, ac)
+        plane = (ap * normal).sum(axis=1) ** 2 / (normal * normal).sum(axis=1)
+
+    candidates = [np.stack((u, v, w), axis=1)]
+    dist2 = [np.where(inside, plane, np.inf)]
+
+    # Closest points on the three edges
+    for i, j in ((0, 1), (1, 2), (2, 0)):
+        start, edge = tris[:, i], tris[:, j] - tris[:, i]
+        length2 = (edge * edge).sum(axis=1)
+        t = ((points - start) * edge).sum(axis=1) / np.maximum(length2, 1e-30)
+        t = np.clip(t, 0.0, 1.0)
+        bary = np.zeros((len(points), 3))
+        bary[:, i] = 1.0 - t
+        bary[:, j] = t
+        candidates.append(bary)
+        q = start + t[:, None] * edge
+        dist2.append(((points - q) ** 2).sum(axis=1))
+
+    dist2 = np.stack(dist2, axis=1)
+    best = dist2.argmin(axis=1)
+    rows = np.arange(len(points))
+    return dist2[rows, best], np.stack(candidates, axis=1)[rows, best]
+
+
+def nearest_triangles(codes, tri_index, triangles, origin, unit):
+    """Closest triangle to the centre of every cell among its pairs
+    :param numpy.ndarray codes: (P,) cell codes of the pairs
+    :param numpy.ndarray tri_index: (P,) triangle of every pair
+    :param numpy.ndarray triangles: (T, 3, 3) triangle corners
+    :param origin: minimum corner of the grid
+    :param float unit: edge length of a cell
+    :return: sorted unique codes, their closest triangle and the (N, 3)
+        barycentric coordinates of the closest point on it
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    tri_index = np.asarray(tri_index, dtype=np.int64)
+    origin = np.asarray(origin, dtype=np.float64)
+
+    dist2 = np.empty(len(codes))
+    bary = np.empty((len(codes), 3))
+    for begin in range(0, len(codes), BATCH_SIZE):
+        end = begin + BATCH_SIZE
+        centers = origin + (morton.decode(codes[begin:end]) + 0.5) * unit
+        dist2[begin:end], bary[begin:end] = closest_points(
+            centers, triangles[tri_index[begin:end]]
+        )
+
+    order = np.lexsort((dist2, codes))
+    sorted_codes = codes[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    best = order[first]
+    return codes[best], tri_index[best], bary[best]
+
+
+def image_pixels(image):
+    """Read the pixels of a bpy image once
+    :param bpy.types.Image image: or None
+    :return: (H, W, 3) float32 array, bottom row first, or None
+    """
+    if image is None:
+        return None
+    width, height = image.size
+    channels = image.channels
+    if not width or not height or channels < 3:
+        return None
+
+    pixels = np.empty(width * height * channels, dtype=np.float32)
+    try:
+        image.pixels.foreach_get(pixels)
+    except (AttributeError, TypeError):
+        # Older Blender, slower but the pixels are still read only once
+        pixels[:] = image.pixels[:]
+    return pixels.reshape(height, width, channels)[:, :, :3]
+
+
+def sample_image(pixels, uv):
+    """Bilinear lookup with repeat wrapping
+    :param numpy.ndarray pixels: (H, W, 3) as returned by image_pixels
+    :param numpy.ndarray uv: (N, 2)
+    :return: (N, 3) float32
+    """
+    height, width = pixels.shape[:2]
+    x = np.asarray(uv[:, 0], dtype=np.float64) * width - 0.5
+    y = np.asarray(uv[:, 1], dtype=np.float64) * height - 0.5
+    x0, y0 = np.floor(x), np.floor(y)
+    tx, ty = (x - x0)[:, None], (y - y0)[:, None]
+    x0 = x0.astype(np.int64) % width
+    y0 = y0.astype(np.int64) % height
+    x1, y1 = (x0 + 1) % width, (y0 + 1) % height
+
+    bottom = pixels[y0, x0] * (1 - tx) + pixels[y0, x1] * tx
+    top = pixels[y1, x0] * (1 - tx) + pixels[y1, x1] * tx
+    return (bottom * (1 - ty) + top * ty).astype(np.float32)
+
+
+class SurfaceColors(object):
+    """Color sources of a triangle soup, in order of preference: an image
+    texture mapped through UVs, loop colors, plain white
+    """
+
+    def __init__(self, loop_colors=None, uvs=None, pixels=None):
+        """
+        :param numpy.ndarray loop_colors: (T, 3, 3) corner colors or None
+        :param numpy.ndarray uvs: (T, 3, 2) corner UVs or None
+        :param numpy.ndarray pixels: (H, W, 3) image or None
+        """
+        self.loop_colors = loop_colors
+        self.uvs = uvs
+        self.pixels = pixels
+
+    @property
+    def textured(self):
+        return self.uvs is not None and self.pixels is not None
+
+    def sample(self, tri_index, bary):
+        """
+        :param numpy.ndarray tri_index: (N,) triangles
+        :param numpy.ndarray bary: (N, 3) barycentric coordinates on them
+        :return: (N, 3) float32 rgb
+        """
+        if self.textured:
+            uv = np.einsum("nk,nkc->nc", bary, self.uvs[tri_index])
+            return sample_image(self.pixels, uv)
+        if self.loop_colors is not None:
+            rgb = np.einsum("nk,nkc->nc", bary, self.loop_colors[tri_index])
+            return rgb.astype(np.float32)
+        return np.tile(np.array(WHITE, dtype=np.float32), (len(tri_index), 1))
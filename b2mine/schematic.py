@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""Block maps as files to paste in one go, without a running server
+
+Two gzip compressed NBT formats are written:
+
+* Sponge schematic version 2 (``.schem``), pasted with WorldEdit. Blocks
+  are a palette and a dense box of varint palette indices, x fastest, then
+  z, then y.
+* Vanilla structure (``.nbt``), loaded by a structure block from the
+  ``generated/minecraft/structures`` folder of a world. Blocks are listed
+  one by one, air left out. Structure blocks take at most 48 blocks a
+  side.
+
+Both are streamed to the file one layer or one chunk at a time, so the
+memory used besides the block map stays flat, however large the box.
+
+Block ids and data of the pre-1.13 protocol spoken to RaspberryJuice are
+named as the block states of the flattened game. Convert a sidecar file
+with::
+
+    python -m b2mine.schematic blocks.b2mb blocks.schem
+"""
+import argparse
+import gzip
+import os
+import struct
+import sys
+
+import numpy as np
+
+if not __package__:
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "b2mine"
+
+from . import block_io
+from . import transfer
+
+
+SCHEMATIC = ".schem"
+STRUCTURE = ".nbt"
+SPONGE_VERSION = 2
+# Game version the block states are named for, 1.16.5
+DATA_VERSION = 2586
+COMPRESS_LEVEL = 6
+CHUNK_SIZE = 1 << 16
+# Width, height and length are unsigned shorts
+MAX_EDGE = (1 << 16) - 1
+MAX_ARRAY = (1 << 31) - 1
+# Edge of the largest structure a structure block loads
+MAX_STRUCTURE_EDGE = 48
+
+AIR = "minecraft:air"
+
+TAG_END = 0
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+
+_COLORS = (
+    "white", "orange", "magenta", "light_blue", "yellow", "lime", "pink",
+    "gray", "light_gray", "cyan", "purple", "blue", "brown", "green", "red",
+    "black",
+)
+_VARIANTS = {
+    1: ("stone", "granite", "polished_granite", "diorite",
+        "polished_diorite", "andesite", "polished_andesite"),
+    5: ("oak_planks", "spruce_planks", "birch_planks", "jungle_planks",
+        "acacia_planks", "dark_oak_planks"),
+    12: ("sand", "red_sand"),
+    19: ("sponge", "wet_sponge"),
+    24: ("sandstone", "chiseled_sandstone", "cut_sandstone"),
+    35: tuple(color + "_wool" for color in _COLORS),
+    41: ("gold_block",),
+    42: ("iron_block",),
+    159: tuple(color + "_terracotta" for color in _COLORS),
+}
+
+# (block id, block data) to the name of the block state
+BLOCK_STATES = {(0, 0): AIR}
+for _block_id, _names in _VARIANTS.items():
+    for _block_data, _name in enumerate(_names):
+        BLOCK_STATES[(_block_id, _block_data)] = "minecraft:" + _name
+
+
+def block_state(block_id, block_data=0):
+    """
+    :param int block_id:
+    :param int block_data: 0 standing for None
+    :return: e.g. "minecraft:orange_wool"
+    """
+    try:
+        return BLOCK_STATES[(int(block_id), int(block_data))]
+    except KeyError:
+        raise ValueError("No block state for block {}:{}".format(
+            block_id, block_data))
+
+
+def palette(block_map):
+    """Block states used by block_map
+    :param BlockMap block_map:
+    :return: list of block state names, and the (N,) index of every block
+        in that list
+    """
+    kinds, index = np.unique(
+        block_map.block_ids.astype(np.int64) << 8 | block_map.block_data,
+        return_inverse=True
+    )
+    names = [block_state(kind >> 8, kind & 0xff) for kind in kinds]
+    return names, index.reshape(-1)
+
+
+def varint_lengths(values):
+    """
+    :param numpy.ndarray values: non negative integers below 2**32
+    :return: bytes taken by every value as a varint
+    """
+    values = np.asarray(values, dtype=np.uint32)
+    lengths = np.ones(values.shape, dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        lengths += values >= (1 << shift)
+    return lengths
+
+
+def encode_varints(values):
+    """LEB128 as in the Minecraft protocol, 7 bits a byte, low bits first
+    :param numpy.ndarray values: non negative integers below 2**32
+    :rtype: bytes
+    """
+    values = np.asarray(values, dtype=np.uint32).reshape(-1)
+    if not len(values) or values.max() < 0x80:
+        return values.astype(np.uint8).tobytes()
+    lengths = varint_lengths(values)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for i in range(int(lengths.max())):
+        more = lengths > i
+        byte = (values[more] >> np.uint32(7 * i)) & 0x7f
+        byte |= (lengths[more] > i + 1).astype(np.uint32) << 7
+        out[starts[more] + i] = byte
+    return out.tobytes()
+
+
+def _tag(tag, name):
+    name = name.encode("utf-8")
+    return struct.pack(">bH", tag, len(name)) + name
+
+
+def _int(name, value):
+    return _tag(TAG_INT, name) + struct.pack(">i", value)
+
+
+def _string(name, value):
+    value = value.encode("utf-8")
+    return _tag(TAG_STRING, name) + struct.pack(">H", len(value)) + value
+
+
+def _int_array(name, values):
+    return _tag(TAG_INT_ARRAY, name) + struct.pack(
+        ">i{}i".format(len(values)), len(values), *values)
+
+
+def _list(name, tag, length):
+    """Header of a list, its length elements follow without names"""
+    return _tag(TAG_LIST, name) + struct.pack(">bi", tag, length)
+
+
+def _compound(name):
+    return _tag(TAG_COMPOUND, name)
+
+
+def _end():
+    return struct.pack(">b", TAG_END)
+
+
+def _box(block_map):
+    """
+    :return: minimum corner and (width, height, length) of the blocks
+    """
+    if not len(block_map):
+        return np.zeros(3, dtype=np.int64), (0, 0, 0)
+    lower, upper = block_map.bounds()
+    lower = np.asarray(lower, dtype=np.int64)
+    size = tuple(int(v) for v in np.asarray(upper) - lower + 1)
+    return lower, size
+
+
+def write_sponge(block_map, f, offset=(0, 0, 0), data_version=DATA_VERSION,
+                 progress=None):
+    """Sponge schematic version 2, without compression
+    :param BlockMap block_map: world positions, each written once
+    :param f: binary file object
+    :param offset: where the minimum corner lands relative to the player
+        pasting it, recorded as WorldEdit metadata
+    :param int data_version:
+    :param progress.Progress progress: fraction advances layer by layer
+    :return: (width, height, length)
+    """
+    lower, (width, height, length) = _box(block_map)
+    if max(width, height, length) > MAX_EDGE:
+        raise ValueError("{}x{}x{} blocks do not fit a schematic".format(
+            width, height, length))
+    names, index = palette(block_map)
+    # Air, filling what the blocks leave empty, sorts first when used
+    if names[:1] != [AIR]:
+        names = [AIR] + names
+        index = index + 1
+
+    # Sizes of the varints, known from the palette alone
+    counts = np.bincount(index, minlength=len(names))
+    counts[0] += width * height * length - len(block_map)
+    num_bytes = int((counts * varint_lengths(np.arange(len(names)))).sum())
+    if num_bytes > MAX_ARRAY:
+        raise ValueError("{}x{}x{} blocks do not fit a schematic".format(
+            width, height, length))
+
+    f.write(_compound("Schematic"))
+    f.write(_int("Version", SPONGE_VERSION))
+    f.write(_int("DataVersion", data_version))
+    f.write(_compound("Metadata"))
+    for axis, value in zip("XYZ", offset):
+        f.write(_int("WEOffset" + axis, int(value)))
+    f.write(_end())
+    for name, value in (("Width", width), ("Height", height),
+                        ("Length", length)):
+        f.write(_tag(TAG_SHORT, name) + struct.pack(">H", value))
+    f.write(_int_array("Offset", (0, 0, 0)))
+    f.write(_int("PaletteMax", len(names)))
+    f.write(_compound("Palette"))
+    for i, name in enumerate(names):
+        f.write(_int(name, i))
+    f.write(_end())
+
+    f.write(_tag(TAG_BYTE_ARRAY, "BlockData"))
+    f.write(struct.pack(">i", num_bytes))
+    local = block_map.positions.astype(np.int64) - lower
+    order = np.argsort(local[:, 1], kind="stable")
+    layers = np.searchsorted(local[order, 1], np.arange(height + 1))
+    layer = np.empty(width * length, dtype=np.int64)
+    for y in range(height):
+        if progress is not None:
+            progress.check()
+        layer[:] = 0
+        blocks = order[layers[y]:layers[y + 1]]
+        layer[local[blocks, 2] * width + local[blocks, 0]] = index[blocks]
+        f.write(encode_varints(layer))
+        if progress is not None:
+            progress.fraction = (y + 1) / float(height)
+    f.write(_end())
+    return width, height, length
+
+
+def write_structure(block_map, f, data_version=DATA_VERSION, progress=None):
+    """Vanilla structure, without compression
+    :param BlockMap block_map: world positions, each written once
+    :param f: binary file object
+    :param int data_version:
+    :param progress.Progress progress: fraction advances chunk by chunk
+    :return: (width, height, length)
+    """
+    lower, size = _box(block_map)
+    if max(size) > MAX_STRUCTURE_EDGE:
+        raise ValueError(
+            "{}x{}x{} blocks exceed the {} a side a structure block loads, "
+            "export a schematic".format(
+                size[0], size[1], size[2], MAX_STRUCTURE_EDGE))
+    names, index = palette(block_map)
+
+    f.write(_compound(""))
+    f.write(_int("DataVersion", data_version))
+    f.write(_list("size", TAG_INT, 3))
+    f.write(struct.pack(">3i", *size))
+    f.write(_list("palette", TAG_COMPOUND, len(names)))
+    for name in names:
+        f.write(_string("Name", name) + _end())
+    f.write(_list("entities", TAG_END, 0))
+
+    # Every block is the same compound, so whole chunks are filled in
+    # place of a template
+    entry = np.dtype([
+        ("pos_tag", "V{}".format(len(_list("pos", TAG_INT, 3)))),
+        ("pos", ">i4", 3),
+        ("state_tag", "V{}".format(len(_tag(TAG_INT, "state")))),
+        ("state", ">i4"),
+        ("end", "u1"),
+    ])
+    template = np.zeros(1, dtype=entry)
+    template["pos_tag"] = np.void(_list("pos", TAG_INT, 3))
+    template["state_tag"] = np.void(_tag(TAG_INT, "state"))
+
+    f.write(_list("blocks", TAG_COMPOUND, len(block_map)))
+    for begin in range(0, len(block_map), CHUNK_SIZE):
+        if progress is not None:
+            progress.check()
+        end = min(begin + CHUNK_SIZE, len(block_map))
+        entries = np.repeat(template, end - begin)
+        entries["pos"] = block_map.positions[begin:end] - lower
+        entries["state"] = index[begin:end]
+        f.write(entries.tobytes())
+        if progress is not None:
+            progress.fraction = end / float(len(block_map))
+    f.write(_end())
+    return size
+
+
+def export(block_map, path, data_version=DATA_VERSION, progress=None):
+    """Write a gzip compressed schematic or structure, by extension of path
+    :param BlockMap block_map: world positions relative to the player,
+        see transfer.WorldTransform
+    :param str path: ending in .schem or .nbt
+    :param int data_version:
+    :param progress.Progress progress:
+    :return: (width, height, length)
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in (SCHEMATIC, STRUCTURE):
+        raise ValueError("Unknown schematic format {}".format(path))
+    if progress is not None:
+        progress.start_stage("export")
+    # Written under a temporary name, a cancelled export leaves no file
+    temp = path + ".part"
+    try:
+        with open(temp, "wb") as raw, gzip.GzipFile(
+                fileobj=raw, mode="wb", compresslevel=COMPRESS_LEVEL) as f:
+            if extension == SCHEMATIC:
+                size = write_sponge(
+                    block_map, f, _box(block_map)[0], data_version, progress)
+            else:
+                size = write_structure(block_map, f, data_version, progress)
+        os.replace(temp, path)
+    except BaseException:
+        # Opening may have failed before there was a file to remove
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="block map, .b2mb")
+    parser.add_argument("output", help=".schem or .nbt")
+    parser.add_argument("--data-version", type=int, default=DATA_VERSION)
+    args = parser.parse_args(argv)
+
+    world = transfer.WorldTransform().apply(block_io.load(args.input))
+    size = export(world, args.output, args.data_version)
+    print("{} blocks, {}x{}x{} written to {}".format(
+        len(world), size[0], size[1], size[2], args.output))
+
+
+if __name__ == "__main__":
+    main()
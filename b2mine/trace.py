@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Nested spans and counters, exported as Chrome trace JSON
+
+Tracing is off by default and then costs one flag check per span or
+counter. Every record carries the process and thread it was made in.
+Worker processes hand theirs back with ``collect`` and the parent adds them
+with ``merge``, so a single trace covers the whole run. Open the exported
+file in chrome://tracing or https://ui.perfetto.dev.
+
+Setting the ``B2MINE_TRACE`` environment variable to a file name enables
+tracing when the module is imported, the add-on then exports there after
+every conversion.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+ENV_VAR = "B2MINE_TRACE"
+
+_enabled = False
+_records = []
+_local = threading.local()
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0.0
+        self.depth = 0
+
+    def __enter__(self):
+        self.depth = getattr(_local, "depth", 0)
+        _local.depth = self.depth + 1
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        end = time.time()
+        _local.depth = self.depth
+        _records.append((
+            "X", self.name, self.start, end - self.start, os.getpid(),
+            threading.current_thread().ident, self.depth, self.args
+        ))
+        return False
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = bool(flag)
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    del _records[:]
+
+
+def span(name, **args):
+    """Context manager timing the enclosed block
+    :param str name:
+    :param args: shown with the span in the trace viewer
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def traced(func):
+    """Decorator recording every call of func as a span"""
+
+    @wraps(func)
+    def __traced(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with _Span(func.__name__, {}):
+            return func(*args, **kwargs)
+    return __traced
+
+
+def count(name, value=1):
+    """Add value to a counter
+    :param str name:
+    :param int value:
+    """
+    if not _enabled:
+        return
+    _records.append((
+        "C", name, time.time(), value, os.getpid(),
+        threading.current_thread().ident
+    ))
+
+
+def collect():
+    """Take the records made by this process out of the trace, e.g. to
+    return them from a worker. Records inherited through fork stay.
+    :rtype: list
+    """
+    pid = os.getpid()
+    own = [r for r in _records if r[4] == pid]
+    _records[:] = [r for r in _records if r[4] != pid]
+    return own
+
+
+def merge(records):
+    """Add records collected in another process
+    :param list records:
+    """
+    _records.extend(tuple(r) for r in records)
+
+
+def counters():
+    """Total of every counter over all processes
+    :rtype: OrderedDict
+    """
+    totals = OrderedDict()
+    for record in _records:
+        if record[0] == "C":
+            totals[record[1]] = totals.get(record[1], 0) + record[3]
+    return totals
+
+
+def chrome_events():
+    """Records as Chrome trace events, counters as running totals
+    :rtype: list
+    """
+    events = []
+    running = {}
+    for record in sorted(_records, key=lambda r: r[2]):
+        if record[0] == "X":
+            _, name, start, seconds, pid, tid, _, args = record
+            events.append({
+                "name": name, "ph": "X", "ts": start * 1e6,
+                "dur": seconds * 1e6, "pid": pid, "tid": tid, "args": args
+            })
+        else:
+            _, name, start, value, pid, tid = record
+            key = (pid, name)
+            running[key] = running.get(key, 0) + value
+            events.append({
+                "name": name, "ph": "C", "ts": start * 1e6, "pid": pid,
+                "tid": tid, "args": {name: running[key]}
+            })
+    return events
+
+
+def export_chrome(path):
+    """Write the trace for chrome://tracing
+    :param str path:
+    """
+    with open(path, "w") as f:
+        json.dump({
+            "traceEvents": chrome_events(),
+            "displayTimeUnit": "ms",
+            "otherData": {"counters": counters()},
+        }, f)
+
+
+def report():
+    """Spans indented by nesting, then the counters
+    :rtype: str
+    """
+    lines = []
+    spans = sorted((r for r in _records if r[0] == "X"),
+                   key=lambda r: (r[4], r[5], r[2]))
+    for _, name, _, seconds, pid, _, depth, _ in spans:
+        lines.append("{}[{}] {} = {:.3f} [milliseconds]".format(
+            "    " * depth, pid, name, seconds * 1000))
+    for name, total in counters().items():
+        lines.append("{}: {}".format(name, total))
+    return "\n".join(lines)
+
+
+if os.environ.get(ENV_VAR):
+    enable()
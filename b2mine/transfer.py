@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""Pipelined transfer of blocks over a pool of RaspberryJuice connections
+
+Commands are formatted once, split into one shard per connection and
+written in large batches without waiting for the server in between. Each
+connection ends with a query whose reply tells that the server has
+processed everything sent before it.
+
+Cuboids are written one Minecraft chunk column after the other, bottom-up
+within a column, and shards are split between columns. The server then
+loads, relights and resends every chunk once instead of on every write.
+Large block maps are ordered by column as a whole and cut into slices
+between columns, which the connections take one after the other.
+"""
+import asyncio
+import math
+import time
+
+import numpy as np
+
+from . import trace
+from .block_map import BlockMap
+
+
+DEFAULT_CONNECTIONS = 4
+BATCH_SIZE = 1024
+# Blocks merged and sent as one slice, cut between chunk columns
+SLICE_SIZE = 1 << 15
+# Edge of a chunk column, as a power of two
+CHUNK_BITS = 4
+BARRIER = "world.getHeight(0,0)\n"
+
+
+class TransferStats(object):
+
+    def __init__(self, num_blocks, num_commands, seconds):
+        self.num_blocks = num_blocks
+        self.num_commands = num_commands
+        self.seconds = seconds
+        # Set when occlusion culling ran before the transfer
+        self.hidden_blocks = 0
+        self.commands_saved = 0
+        # Set by delta sync and verification
+        self.unchanged_blocks = 0
+        self.repaired_blocks = 0
+
+    @property
+    def blocks_per_second(self):
+        return self.num_blocks / self.seconds if self.seconds else 0.0
+
+    @property
+    def commands_per_second(self):
+        return self.num_commands / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        text = "{} blocks, {} commands in {:.3f} s ({:.0f} blocks/s)".format(
+            self.num_blocks, self.num_commands, self.seconds,
+            self.blocks_per_second
+        )
+        if self.unchanged_blocks:
+            text += ", {} unchanged blocks skipped".format(
+                self.unchanged_blocks)
+        if self.repaired_blocks:
+            text += ", {} blocks repaired".format(self.repaired_blocks)
+        if self.hidden_blocks:
+            text += ", {} hidden blocks culled, {} commands saved".format(
+                self.hidden_blocks, self.commands_saved)
+        return text
+
+
+class WorldTransform(object):
+    """Integer map of grid positions to world blocks
+
+    Positions are floor divided by scale, then their axes are permuted and
+    flipped, Blender being z up and Minecraft y up.
+    """
+
+    def __init__(self, scale=2, axes=(0, 2, 1), signs=(1, 1, -1),
+                 anchor=(0, 0, 0)):
+        """
+        :param int scale: grid positions per block
+        :param tuple axes: grid axis of every world axis
+        :param tuple signs: 1 or -1 for every world axis
+        :param tuple anchor: integer offset added last
+        """
+        self.scale = int(scale)
+        self.axes = list(axes)
+        self.signs = np.array(signs, dtype=np.int64)
+        self.anchor = np.array(anchor, dtype=np.int64)
+
+    def positions(self, positions):
+        """
+        :param numpy.ndarray positions: (N, 3) grid positions
+        :return: (N, 3) int64 world positions
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+        return (positions // self.scale)[:, self.axes] * self.signs + \
+            self.anchor
+
+    def apply(self, block_map):
+        """
+        :param BlockMap block_map:
+        :return: BlockMap of world positions
+        """
+        return BlockMap(
+            self.positions(block_map.positions), block_map.block_ids,
+            block_map.block_data
+        )
+
+    def apply_chunks(self, chunks, num_blocks, progress=None):
+        """Transform chunks as they are read into one map filled in place,
+        without holding the chunks or a copy of them
+        :param chunks: iterable of BlockMap
+        :param int num_blocks: number of blocks in all chunks
+        :param progress.Progress progress: checked between chunks
+        :rtype: BlockMap
+        """
+        positions = np.empty((num_blocks, 3), dtype=BlockMap.POS_DTYPE)
+        block_ids = np.empty(num_blocks, dtype=BlockMap.ID_DTYPE)
+        block_data = np.empty(num_blocks, dtype=BlockMap.DATA_DTYPE)
+        end = 0
+        for block_map in chunks:
+            if progress is not None:
+                progress.check()
+            begin, end = end, end + len(block_map)
+            positions[begin:end] = self.positions(block_map.positions)
+            block_ids[begin:end] = block_map.block_ids
+            block_data[begin:end] = block_map.block_data
+        return BlockMap(positions[:end], block_ids[:end], block_data[:end])
+
+
+def to_world(block_map):
+    """Grid positions to block offsets from the player
+    :param BlockMap block_map:
+    :rtype: BlockMap
+    """
+    return WorldTransform().apply(block_map)
+
+
+def cuboid_commands(cuboids, origin):
+    """Protocol lines for a list of cuboids
+    :param merge.CuboidList cuboids:
+    :param tuple origin: integer (x, y, z) added to every cuboid
+    :rtype: list
+    """
+    ox, oy, oz = (int(math.floor(v)) for v in origin)
+    lines = []
+    for lower, upper, block_id, block_data in cuboids:
+        x0, y0, z0 = lower[0] + ox, lower[1] + oy, lower[2] + oz
+        kind = "{},{}".format(block_id, block_data) if block_data \
+            else str(block_id)
+        if lower == upper:
+            lines.append("world.setBlock({},{},{},{})\n".format(
+                x0, y0, z0, kind))
+        else:
+            lines.append("world.setBlocks({},{},{},{},{},{},{})\n".format(
+                x0, y0, z0, upper[0] + ox, upper[1] + oy, upper[2] + oz, kind))
+    return lines
+
+
+def column_order(positions, origin):
+    """Order positions by chunk column, then bottom-up in y, then along x
+    and z
+    :param numpy.ndarray positions: (N, 3) integer positions
+    :param tuple origin: integer (x, y, z) added to every position
+    :return: (N,) index and the (N,) chunk column key of every position in
+        that order
+    """
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3) + \
+        np.array([int(math.floor(v)) for v in origin], dtype=np.int64)
+    # Arithmetic shifts round down, negative coordinates included
+    cx = positions[:, 0] >> CHUNK_BITS
+    cz = positions[:, 2] >> CHUNK_BITS
+    order = np.lexsort(
+        (positions[:, 2], positions[:, 0], positions[:, 1], cz, cx))
+    keys = (cx << 32) ^ (cz & 0xFFFFFFFF)
+    return order, keys[order]
+
+
+def chunk_order(cuboids, origin):
+    """Order writing cuboids by chunk column of their lower corner, see
+    column_order
+    :param merge.CuboidList cuboids:
+    :param tuple origin: integer (x, y, z) added to every cuboid
+    :return: (N,) index and the (N,) chunk column key of every cuboid in
+        that order
+    """
+    return column_order(cuboids.lower, origin)
+
+
+def column_slices(block_map, origin, size=SLICE_SIZE):
+    """Blocks in chunk column order, cut between columns, so that sending
+    the slices one after the other visits every column once
+    :param BlockMap block_map:
+    :param tuple origin: integer (x, y, z) added to every position
+    :param int size: blocks per slice, more when a column is larger
+    :return: iterator of BlockMap
+    """
+    order, keys = column_order(block_map.positions, origin)
+    num_slices = max(int(math.ceil(len(order) / float(size))), 1)
+    for begin, end in shard_bounds(len(order), num_slices, keys):
+        yield block_map[order[begin:end]]
+
+
+def chunk_commands(cuboids, origin):
+    """Protocol lines in chunk order, see chunk_order
+    :param merge.CuboidList cuboids:
+    :param tuple origin: integer (x, y, z) added to every cuboid
+    :return: list of lines and the chunk column key of every line, to be
+        passed to AsyncSender.send
+    """
+    order, keys = chunk_order(cuboids, origin)
+    return cuboid_commands(cuboids.take(order), origin), keys
+
+
+def shard_bounds(num_commands, connections, groups=None):
+    """Split points of commands into one shard per connection
+    :param int num_commands:
+    :param int connections:
+    :param numpy.ndarray groups: key of every command, a group is never
+        split across shards when given
+    :return: list of (begin, end)
+    """
+    size = max(int(math.ceil(num_commands / float(connections))), 1)
+    bounds = list(range(size, num_commands, size))
+    if groups is not None and len(groups):
+        groups = np.asarray(groups)
+        starts = np.flatnonzero(groups[1:] != groups[:-1]) + 1
+        # Move every split point forward to the start of a group
+        index = np.searchsorted(starts, bounds)
+        bounds = sorted(set(
+            int(starts[i]) for i in index if i < len(starts)
+        ))
+    bounds = [0] + bounds + [num_commands]
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+class AsyncSender(object):
+
+    def __init__(self, address="127.0.0.1", port=4711,
+                 connections=DEFAULT_CONNECTIONS, batch_size=BATCH_SIZE):
+        """
+        :param str address:
+        :param int port:
+        :param int connections: number of connections opened in parallel
+        :param int batch_size: commands written per socket write
+        """
+        self.address = address
+        self.port = port
+        self.connections = max(int(connections), 1)
+        self.batch_size = batch_size
+
+    def send(self, commands, num_blocks=None, progress=None, groups=None):
+        """Send protocol lines and wait until the server processed them
+        :param list commands: lines as built by cuboid_commands
+        :param int num_blocks: blocks covered by the commands, for stats
+        :param progress.Progress progress: counts the commands written and
+            is checked for cancellation after every batch
+        :param numpy.ndarray groups: chunk column of every command, as
+            returned by chunk_commands, each column then goes through a
+            single connection
+        :rtype: TransferStats
+        """
+        shards = [
+            iter([(commands[begin:end], 0)]) for begin, end in
+            shard_bounds(len(commands), self.connections, groups)
+        ]
+        stats = self._run(shards, progress)
+        stats.num_blocks = len(commands) if num_blocks is None \
+            else num_blocks
+        return stats
+
+    def send_slices(self, slices, progress=None):
+        """Send slices of protocol lines as they are made, over one set of
+        connections. A connection takes the next slice once it wrote the
+        last one, so every slice goes through a single connection.
+        :param slices: iterable of (list of lines, number of blocks), made
+            on demand between writes
+        :param progress.Progress progress: counts the commands and blocks
+            written and is checked for cancellation after every batch
+        :rtype: TransferStats
+        """
+        slices = iter(slices)
+        return self._run([slices] * self.connections, progress)
+
+    def _run(self, sources, progress=None):
+        """
+        :param list sources: an iterator of (lines, number of blocks) per
+            connection, the same one may be shared
+        :rtype: TransferStats
+        """
+        stats = TransferStats(0, 0, 0.0)
+        loop = asyncio.new_event_loop()
+        start = time.time()
+        try:
+            with trace.span("send", connections=len(sources)):
+                loop.run_until_complete(
+                    self._send_sources(sources, stats, progress)
+                )
+        finally:
+            loop.close()
+        stats.seconds = time.time() - start
+        trace.count("commands sent", stats.num_commands)
+        return stats
+
+    def query(self, commands):
+        """Send queries over one connection, written a batch at a time
+        without waiting for every reply in between
+        :param list commands: lines, each answered by the server
+        :return: list of replies, without newlines
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            with trace.span("query", commands=len(commands)):
+                return loop.run_until_complete(self._query(commands))
+        finally:
+            loop.close()
+
+    async def _query(self, commands):
+        reader, writer = await asyncio.open_connection(self.address, self.port)
+        replies = []
+        try:
+            for i in range(0, len(commands), self.batch_size):
+                batch = commands[i:i + self.batch_size]
+                writer.write("".join(batch).encode("ascii"))
+                await writer.drain()
+                for _ in batch:
+                    line = await reader.readline()
+                    replies.append(line.decode("ascii").strip())
+        finally:
+            writer.close()
+        return replies
+
+    async def _send_sources(self, sources, stats, progress=None):
+        tasks = [
+            asyncio.ensure_future(self._send_source(source, stats, progress))
+            for source in sources
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other connections too, e.g. when cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _send_source(self, source, stats, progress=None):
+        reader, writer = await asyncio.open_connection(self.address, self.port)
+        try:
+            # Shared iterators are safe to pull from, the loop running one
+            # connection at a time between awaits
+            for commands, num_blocks in source:
+                for i in range(0, len(commands), self.batch_size):
+                    batch = commands[i:i + self.batch_size]
+                    writer.write("".join(batch).encode("ascii"))
+                    await writer.drain()
+                    if progress is not None:
+                        progress.commands_sent += len(batch)
+                        progress.check()
+                stats.num_commands += len(commands)
+                stats.num_blocks += num_blocks
+                if progress is not None:
+                    progress.blocks_sent += num_blocks
+                # Drain returns at once while the socket takes everything,
+                # let the other connections take the next slices
+                await asyncio.sleep(0)
+            writer.write(BARRIER.encode("ascii"))
+            await writer.drain()
+            await reader.readline()
+        finally:
+            writer.close()
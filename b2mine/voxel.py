@@ -1,38 +1,47 @@
 # -*- coding: utf-8 -*-
 
 import bpy
-
-
-class Voxel(object):
-
-    FACES = ((0, 1, 2, 3), (4, 7, 6, 5), (0, 4, 5, 1),
-             (1, 5, 6, 2), (2, 3, 7, 6), (4, 0, 3, 7))
-
-    def __init__(self, name, vertices, color):
-        self._name = name
-        self._vertices = vertices
-        self._color = color
-        self._obj = None
-
-    def create(self):
-        # Create Shape
-        mesh = bpy.data.meshes.new("cube_mesh_data")
-        mesh.from_pydata(self._vertices, [], Voxel.FACES)
-        mesh.update()
-
-        # Apply color
-        mesh.vertex_colors.new()
-        j = 0
-        for poly in mesh.polygons:
-            for _ in poly.loop_indices:
-                mesh.vertex_colors["Col"].data[j].color = self._color
-                j += 1
-
-        self._obj = bpy.data.objects.new(self._name, mesh)
-        return self
-
-    def add(self, scene, parent=None):
-        scene.objects.link(self._obj)
-        self._obj.select = True
-        if parent:
-            self._obj.parent = parent
+import numpy as np
+
+
+def create_preview_object(name, geometry):
+    """Build one object holding every voxel
+    :param str name:
+    :param preview.PreviewGeometry geometry:
+    :rtype: bpy.types.Object
+    """
+    return bpy.data.objects.new(name, create_preview_mesh(name, geometry))
+
+
+def create_preview_mesh(name, geometry):
+    """Build the mesh of every voxel, filled through foreach_set
+    :param str name:
+    :param preview.PreviewGeometry geometry:
+    :rtype: bpy.types.Mesh
+    """
+    num_faces = len(geometry.faces)
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(geometry.vertices))
+    mesh.vertices.foreach_set(
+        "co", geometry.vertices.astype(np.float32).ravel())
+    mesh.loops.add(num_faces * 4)
+    mesh.loops.foreach_set(
+        "vertex_index", geometry.faces.astype(np.int32).ravel())
+    mesh.polygons.add(num_faces)
+    mesh.polygons.foreach_set(
+        "loop_start", np.arange(0, num_faces * 4, 4, dtype=np.int32))
+    mesh.polygons.foreach_set(
+        "loop_total", np.full(num_faces, 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+    # Apply color, RGB in 2.7x and RGBA in later versions
+    layer = mesh.vertex_colors.new()
+    if num_faces:
+        loop_colors = geometry.loop_colors.astype(np.float32)
+        if len(layer.data[0].color) > 3:
+            alpha = np.ones((len(loop_colors), 1), dtype=np.float32)
+            loop_colors = np.hstack((loop_colors, alpha))
+        layer.data.foreach_set("color", loop_colors.ravel())
+
+    return mesh
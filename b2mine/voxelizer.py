@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""Batched triangle / axis aligned box overlap engine.
+
+The octree is descended one level at a time. Every level is a flat array of
+``(Morton code, triangle)`` candidate pairs and the separating axis test of
+Akenine-Moller is evaluated for all of them at once with NumPy, so no Blender
+datablock is ever created while voxelizing. Interiors of closed surfaces
+can then be filled by ray parity for solid builds.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from . import morton
+from . import trace
+
+
+# Corner order of a cell, same as the box handed over by Convert2BlockOperator
+CORNER_OFFSETS = np.array((
+    (0, 0, 0),
+    (0, 0, 1),
+    (0, 1, 1),
+    (0, 1, 0),
+    (1, 0, 0),
+    (1, 0, 1),
+    (1, 1, 1),
+    (1, 1, 0),
+), dtype=np.int64)
+
+# Number of candidate pairs tested per NumPy batch
+BATCH_SIZE = 1 << 16
+
+# Bytes held by the frontier and the leaf store before splitting / spilling
+DEFAULT_MEMORY_BUDGET = 256 << 20
+
+# Approximate bytes used per frontier pair while a level is expanded
+_PAIR_BYTES = 64
+
+_AXES = np.eye(3)
+
+
+def tri_box_overlap(centers, half, tris):
+    """Separating axis test between boxes and triangles, pairwise
+    :param numpy.ndarray centers: (P, 3) box centres
+    :param float half: half of the box edge length
+    :param numpy.ndarray tris: (P, 3, 3) triangle corners
+    :return: (P,) bool, True where the pair overlaps (touching included)
+    """
+    v = tris - centers[:, None, :]
+
+    # Box face normals, i.e. AABB of the triangle against the box
+    separated = (v.min(axis=1) > half).any(axis=1)
+    separated |= (v.max(axis=1) < -half).any(axis=1)
+
+    # Triangle normal
+    edges = np.roll(v, -1, axis=1) - v
+    normal = np.cross(edges[:, 0], edges[:, 1])
+    dist = np.abs((normal * v[:, 0]).sum(axis=1))
+    separated |= dist > half * np.abs(normal).sum(axis=1)
+
+    # Cross products of the box axes and the triangle edges
+    axes = np.cross(_AXES[None, :, None, :], edges[:, None, :, :])
+    proj = np.einsum("pabk,pvk->pabv", axes, v)
+    radius = half * np.abs(axes).sum(axis=3)
+    separated |= (
+        (proj.min(axis=3) > radius) | (proj.max(axis=3) < -radius)
+    ).any(axis=(1, 2))
+
+    return ~separated
+
+
+class LeafStore(object):
+    """Collects leaf records, spilling them to a temporary file once more
+    than ``memory_budget`` bytes are held
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.uint64):
+        """
+        :param int memory_budget:
+        :param dtype: of the records, plain codes by default
+        """
+        self.memory_budget = memory_budget
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self._chunks = []
+        self._nbytes = 0
+        self._file = None
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def append(self, values):
+        self._chunks.append(np.asarray(values, dtype=self.dtype))
+        self._nbytes += self._chunks[-1].nbytes
+        self.count += len(values)
+        if self._nbytes > self.memory_budget:
+            self._flush()
+
+    def iter_values(self, count=BATCH_SIZE * 16):
+        """Every record appended so far, in order, a block of at most count
+        records at a time. Spilled records are read back block by block.
+        :rtype: iterator of numpy.ndarray
+        """
+        if self._file is None:
+            for chunk in self._chunks:
+                yield chunk
+            return
+        self._flush()
+        self._file.seek(0)
+        remaining = self.count
+        while remaining:
+            n = min(count, remaining)
+            data = self._file.read(n * self.dtype.itemsize)
+            yield np.frombuffer(data, dtype=self.dtype)
+            remaining -= n
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="b2mine_leaves_")
+        # Appending after records were read back
+        self._file.seek(0, os.SEEK_END)
+        for chunk in self._chunks:
+            self._file.write(chunk.tobytes())
+        self._file.flush()
+        self._chunks = []
+        self._nbytes = 0
+
+
+def frontier(triangles, origin, size, level):
+    """Overlapping (cell, triangle) pairs of one level, without budget
+    :param numpy.ndarray triangles: (T, 3, 3) triangle corners
+    :param origin: minimum corner of the root cell
+    :param float size: edge length of the root cell
+    :param int level:
+    :return: sorted uint64 codes and the triangle index of every pair
+    """
+    origin = np.asarray(origin, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.float64)
+
+    codes, tri_index = _root_pairs(triangles, origin, size)
+    for current in range(level):
+        codes, tri_index = _expand(
+            codes, tri_index, triangles, origin, size, current
+        )
+    return codes, tri_index
+
+
+def iter_leaf_pairs(triangles, origin, size, depth,
+                    memory_budget=DEFAULT_MEMORY_BUDGET, start=None,
+                    progress=None):
+    """Descend the octree breadth first and yield the overlapping leaves
+
+    The frontier is a sorted array of Morton codes paired with the triangle
+    each cell is tested against. When expanding it would exceed the memory
+    budget, it is split on a cell boundary and the halves are descended one
+    after the other, so chunks come out in Morton order and never overlap.
+
+    :param numpy.ndarray triangles: (T, 3, 3) triangle corners
+    :param origin: minimum corner of the root cell
+    :param float size: edge length of the root cell
+    :param int depth: level of the leaves, the root being level 0
+    :param int memory_budget: bytes the frontier may use
+    :param tuple start: (codes, tri_index, level) to descend from instead
+        of the root, e.g. a subset of what frontier() returns
+    :param progress.Progress progress: told the level being expanded and
+        checked for cancellation before every expansion
+    :return: iterator of (codes, tri_index), the overlapping pairs of cells
+        at ``depth`` sorted by code
+    """
+    if depth > morton.MAX_LEVEL:
+        raise ValueError("Octree depth is limited to {}".format(
+            morton.MAX_LEVEL))
+
+    origin = np.asarray(origin, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.float64)
+    max_parents = max(memory_budget // (8 * _PAIR_BYTES), 1)
+
+    if start is None:
+        start = _root_pairs(triangles, origin, size) + (0,)
+
+    stack = [start]
+    first_level = start[2]
+    yielded = False
+    while stack:
+        codes, tri_index, level = stack.pop()
+        if not len(codes):
+            continue
+        if level == depth:
+            yielded = True
+            yield codes, tri_index
+            continue
+
+        if len(codes) > max_parents and codes[0] != codes[-1]:
+            split = _split_point(codes)
+            stack.append((codes[split:], tri_index[split:], level))
+            stack.append((codes[:split], tri_index[:split], level))
+            continue
+
+        if progress is not None:
+            progress.level = level
+            progress.check()
+            if not yielded:
+                # Surface cells quadruple at every level, until leaves come
+                # out and the caller knows better
+                progress.fraction = (4.0 ** (level - first_level) - 1) / \
+                    (4.0 ** (depth - first_level) - 1)
+        with trace.span("expand", level=level, pairs=len(codes)):
+            codes, tri_index = _expand(
+                codes, tri_index, triangles, origin, size, level
+            )
+        stack.append((codes, tri_index, level + 1))
+
+
+def iter_leaf_codes(triangles, origin, size, depth,
+                    memory_budget=DEFAULT_MEMORY_BUDGET, start=None):
+    """Like iter_leaf_pairs, without the triangles
+    :return: iterator of sorted unique uint64 codes of cells at ``depth``
+    """
+    for codes, _ in iter_leaf_pairs(triangles, origin, size, depth,
+                                    memory_budget, start):
+        yield np.unique(codes)
+
+
+def leaf_codes(triangles, origin, size, depth,
+               memory_budget=DEFAULT_MEMORY_BUDGET, start=None):
+    """Morton codes of every overlapping leaf, streamed into a LeafStore
+    :rtype: LeafStore
+    """
+    store = LeafStore(memory_budget)
+    for chunk in iter_leaf_codes(triangles, origin, size, depth,
+                                 memory_budget, start):
+        store.append(chunk)
+    return store
+
+
+def leaf_cells(triangles, origin, size, depth,
+               memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Integer coordinates of the overlapping cells at ``depth``
+    :param numpy.ndarray triangles: (T, 3, 3) triangle corners
+    :param origin: minimum corner of the root cell
+    :param float size: edge length of the root cell
+    :param int depth: level of the returned cells, the root being level 0
+    :param int memory_budget:
+    :return: (N, 3) int64 array in Morton order
+    """
+    store = leaf_codes(triangles, origin, size, depth, memory_budget)
+    try:
+        cells = np.empty((store.count, 3), dtype=np.int64)
+        begin = 0
+        for codes in store.iter_values():
+            cells[begin:begin + len(codes)] = morton.decode(codes)
+            begin += len(codes)
+        return cells
+    finally:
+        store.close()
+
+
+def cell_corners(cells, origin, unit):
+    """Eight corners of every cell, in the order of ``CORNER_OFFSETS``
+    :param numpy.ndarray cells: (N, 3) integer cell coordinates
+    :param origin: minimum corner of the grid
+    :param float unit: edge length of a cell
+    :return: (N, 8, 3) float array
+    """
+    origin = np.asarray(origin, dtype=np.float64)
+    return origin + (cells[:, None, :] + CORNER_OFFSETS[None]) * unit
+
+
+def fill_interior(cells, triangles, origin, unit):
+    """Cells enclosed by the surface, classified by ray parity
+
+    A ray is cast along z through the centre of every (x, y) column of the
+    grid; cells above an odd number of crossings are inside. Columns with an
+    odd total, i.e. passing through a hole of the mesh, are left empty.
+
+    :param numpy.ndarray cells: (N, 3) surface cells
+    :param numpy.ndarray triangles: (T, 3, 3) triangle corners
+    :param origin: minimum corner of the grid
+    :param float unit: edge length of a cell
+    :return: (M, 3) interior cells not in ``cells`` and (M,) index of the
+        surface cell nearest to every one of them in its z column
+    """
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+    if not len(cells):
+        return cells, np.empty(0, dtype=np.int64)
+
+    lower = cells.min(axis=0)
+    shape = tuple((cells.max(axis=0) - lower + 1).tolist())
+
+    # Triangles in local cell units, where the centre of cell k is at k + 0.5
+    local = ((np.asarray(triangles, dtype=np.float64) -
+              np.asarray(origin, dtype=np.float64)) / unit - lower)
+
+    toggles = np.zeros((shape[0], shape[1], shape[2] + 1), dtype=np.int32)
+    step = BATCH_SIZE // 16
+    for begin in range(0, len(local), step):
+        i, j, t = _column_crossings(local[begin:begin + step], shape)
+        np.add.at(toggles, (i, j, t), 1)
+
+    inside = (np.cumsum(toggles, axis=2)[:, :, :-1] & 1).astype(bool)
+    inside[(toggles.sum(axis=2) & 1).astype(bool)] = False
+
+    label = np.full(shape, -1, dtype=np.int32)
+    surface = cells - lower
+    label[surface[:, 0], surface[:, 1], surface[:, 2]] = np.arange(len(cells))
+    del toggles
+    i, j, k = np.nonzero(inside & (label < 0))
+    del inside
+
+    return (np.stack((i, j, k), axis=1) + lower,
+            _column_labels(label, i, j, k))
+
+
+def _column_crossings(local, shape):
+    """Cells of the columns crossed by each triangle and the cell index
+    above the crossing point
+    """
+    # Tiny offset so rays do not run exactly through shared edges
+    jitter = np.array((1.2345e-5, 2.3456e-5))
+
+    xy = local[:, :, :2]
+    first = np.clip(np.ceil(xy.min(axis=1) - 0.5 - jitter), 0, None)
+    last = np.minimum(np.floor(xy.max(axis=1) - 0.5 - jitter),
+                      np.array(shape[:2]) - 1)
+    first = first.astype(np.int64)
+    extent = np.maximum(last.astype(np.int64) - first + 1, 0)
+
+    counts = extent[:, 0] * extent[:, 1]
+    tri = np.repeat(np.arange(len(local)), counts)
+    k = np.arange(len(tri)) - np.repeat(np.cumsum(counts) - counts, counts)
+    i = first[tri, 0] + k // extent[tri, 1]
+    j = first[tri, 1] + k % extent[tri, 1]
+
+    # 2D barycentric coordinates of the ray in the projected triangle
+    a, b, c = local[tri, 0], local[tri, 1], local[tri, 2]
+    px = i + 0.5 + jitter[0]
+    py = j + 0.5 + jitter[1]
+    det = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - \
+        (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])
+    w1 = (px - a[:, 0]) * (c[:, 1] - a[:, 1]) - \
+        (c[:, 0] - a[:, 0]) * (py - a[:, 1])
+    w2 = (b[:, 0] - a[:, 0]) * (py - a[:, 1]) - \
+        (px - a[:, 0]) * (b[:, 1] - a[:, 1])
+    w0 = det - w1 - w2
+    sign = np.sign(det)
+    hit = (det != 0) & (w0 * sign >= 0) & (w1 * sign >= 0) & (w2 * sign >= 0)
+
+    det, w0, w1, w2 = det[hit], w0[hit], w1[hit], w2[hit]
+    a, b, c = a[hit], b[hit], c[hit]
+    z = (w0 * a[:, 2] + w1 * b[:, 2] + w2 * c[:, 2]) / det
+    t = np.clip(np.ceil(z - 0.5), 0, shape[2]).astype(np.int64)
+    return i[hit], j[hit], t
+
+
+def _column_labels(label, i, j, k):
+    """Label of the nearest surface cell below or above every interior
+    cell in its z column, which bound the run of interior cells
+    :param numpy.ndarray label: (X, Y, Z) index of the surface cells, -1
+        elsewhere
+    :param i, j, k: coordinates of the interior cells
+    :return: label of every interior cell
+    """
+    depth = label.shape[2]
+    z = np.arange(depth, dtype=np.int32)
+    surface = label >= 0
+    below = np.where(surface, z, np.int32(-1))
+    np.maximum.accumulate(below, axis=2, out=below)
+    below = below[i, j, k]
+    above = np.where(surface, z, np.int32(depth))[:, :, ::-1]
+    np.minimum.accumulate(above, axis=2, out=above)
+    above = above[:, :, ::-1][i, j, k]
+    del surface
+    nearest = np.where(
+        (below < 0) | ((above < depth) & (above - k < k - below)),
+        above, below
+    )
+    found = (nearest >= 0) & (nearest < depth)
+    result = np.full(len(i), -1, dtype=np.int64)
+    result[found] = label[i[found], j[found], nearest[found]]
+
+    # Columns without surface, from rays grazing an edge: nearest surface
+    # cell anywhere
+    missing = np.flatnonzero(~found)
+    if len(missing):
+        cells = np.argwhere(label >= 0)
+        points = np.stack((i[missing], j[missing], k[missing]), axis=1)
+        for begin in range(0, len(points), 1 << 10):
+            chunk = points[begin:begin + (1 << 10)]
+            dist = ((chunk[:, None, :] - cells[None]) ** 2).sum(axis=2)
+            nearest_cell = cells[dist.argmin(axis=1)]
+            result[missing[begin:begin + len(chunk)]] = label[
+                nearest_cell[:, 0], nearest_cell[:, 1], nearest_cell[:, 2]]
+    return result
+
+
+def _root_pairs(triangles, origin, size):
+    codes = np.zeros(len(triangles), dtype=np.uint64)
+    tri_index = np.arange(len(triangles))
+    mask = _test_pairs(codes, tri_index, triangles, origin, size)
+    return codes[mask], tri_index[mask]
+
+
+def _expand(codes, tri_index, triangles, origin, size, level):
+    """Pairs of the children of the cells at level, sorted by code"""
+    codes = morton.children(codes)
+    tri_index = np.repeat(tri_index, 8)
+    mask = _test_pairs(
+        codes, tri_index, triangles, origin, size / float(2 ** (level + 1))
+    )
+    codes, tri_index = codes[mask], tri_index[mask]
+    order = np.argsort(codes, kind="mergesort")
+    return codes[order], tri_index[order]
+
+
+def _test_pairs(codes, tri_index, triangles, origin, size):
+    half = size / 2.0
+    mask = np.empty(len(codes), dtype=bool)
+    for begin in range(0, len(codes), BATCH_SIZE):
+        end = begin + BATCH_SIZE
+        centers = origin + (morton.decode(codes[begin:end]) + 0.5) * size
+        mask[begin:end] = tri_box_overlap(
+            centers, half, triangles[tri_index[begin:end]]
+        )
+    if trace.enabled():
+        trace.count("boxes tested", len(mask))
+        trace.count("overlaps found", int(mask.sum()))
+    return mask
+
+
+def _split_point(codes):
+    """Index close to the middle of sorted codes not splitting a cell"""
+    split = np.searchsorted(codes, codes[len(codes) // 2], side="left")
+    if split == 0:
+        split = np.searchsorted(codes, codes[0], side="right")
+    return split
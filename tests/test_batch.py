@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from b2mine import batch
+from b2mine import pipeline
+
+
+def write_manifest(tmp_path, manifest):
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_load_manifest(tmp_path):
+    path = write_manifest(tmp_path, {
+        "output": "blocks",
+        "defaults": {"octree": 5},
+        "models": ["a.obj", {"path": "b.ply", "blocks": 10},
+                   {"path": "c.obj", "block_size": 0.5, "name": "room"}],
+    })
+    jobs = batch.load_manifest(path)
+    assert [job["name"] for job in jobs] == ["a", "b", "room"]
+    assert [job["octree"] for job in jobs] == [5, 5, 5]
+    assert jobs[0]["path"] == str(tmp_path / "a.obj")
+    assert jobs[2]["output"] == str(tmp_path / "blocks" / "room.b2mb")
+
+
+@pytest.mark.parametrize("entry", [
+    {"path": "a.obj", "octree": 0},
+    {"path": "a.obj", "octree": -1},
+    {"path": "a.obj", "octree": pipeline.Pipeline.MAX_OCTREE + 1},
+    {"path": "a.obj", "octree": "deep"},
+    {"path": "a.obj", "blocks": 0},
+    {"path": "a.obj", "blocks": -4},
+    {"path": "a.obj", "block_size": 0},
+    {"path": "a.obj", "block_size": -0.5},
+    {"octree": 4},
+])
+def test_load_manifest_rejects(tmp_path, entry):
+    with pytest.raises(batch.BatchError):
+        batch.load_manifest(write_manifest(tmp_path, [entry]))
+
+
+def test_load_manifest_depth_bounds(tmp_path):
+    path = write_manifest(tmp_path, [
+        {"path": "a.obj", "octree": 1},
+        {"path": "b.obj", "octree": pipeline.Pipeline.MAX_OCTREE},
+    ])
+    assert len(batch.load_manifest(path)) == 2
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine.block_def import LUT_BITS, BlockDef, Palette
+
+
+COLORS = [block.color for block in BlockDef.BLOCK_LIST]
+
+
+@pytest.fixture
+def rgb():
+    return np.random.RandomState(7).rand(20000, 3)
+
+
+@pytest.fixture
+def exact_blocks():
+    """Restore exact matching after a test opting into the lookup table"""
+    yield
+    BlockDef.use_lut(None)
+
+
+@pytest.mark.parametrize("lab", [False, True])
+def test_match_many_is_exact_by_default(rgb, lab):
+    palette = BlockDef.palette(lab)
+    assert palette.levels is None
+    index = palette.match_many(rgb)
+    assert (index == palette.nearest(rgb)).all()
+
+    block_ids, block_data = BlockDef.match_many(rgb, lab=lab)
+    assert (block_ids == BlockDef.BLOCK_IDS[index]).all()
+    assert (block_data == BlockDef.BLOCK_DATA[index]).all()
+
+
+@pytest.mark.parametrize("lab", [False, True])
+def test_lut_matches_exact_nearly_everywhere(rgb, lab):
+    exact = Palette(COLORS, lab)
+    palette = Palette(COLORS, lab, LUT_BITS)
+
+    # Colors on the quantization grid are matched exactly
+    levels = np.linspace(0.0, 1.0, palette.levels)
+    grid = levels[np.random.RandomState(3).randint(0, len(levels), (500, 3))]
+    assert (palette.match_many(grid) == exact.match_many(grid)).all()
+
+    # Others may get another block, rarely
+    differ = palette.match_many(rgb) != exact.match_many(rgb)
+    assert 0 < differ.mean() < 0.05
+
+
+def test_lut_block_nearly_as_close(rgb):
+    exact = Palette(COLORS)
+    palette = Palette(COLORS, lut_bits=LUT_BITS)
+    colors = exact.colors
+
+    got = np.linalg.norm(rgb - colors[palette.match_many(rgb)], axis=1)
+    best = np.linalg.norm(rgb - colors[exact.match_many(rgb)], axis=1)
+    assert (got >= best).all()
+    # Off by the distance to the quantized color, twice at most
+    step = 1.0 / (palette.levels - 1)
+    assert (got - best).max() <= step * 3 ** 0.5 + 1e-12
+
+
+def test_lut_stored_only_when_asked(tmp_path, rgb, exact_blocks):
+    directory = tmp_path / "luts"
+    stored = Palette(COLORS, lut_bits=LUT_BITS, directory=str(directory))
+    index = stored.match_many(rgb)
+    assert [str(p) for p in directory.iterdir()] == [stored.lut_path()]
+
+    loaded = Palette(COLORS, lut_bits=LUT_BITS, directory=str(directory))
+    assert loaded._load_lut() is not None
+    assert (loaded.match_many(rgb) == index).all()
+
+    BlockDef.use_lut(LUT_BITS, str(tmp_path / "blocks"))
+    BlockDef.match_many(rgb[:10])
+    assert len(list((tmp_path / "blocks").iterdir())) == 1
+    BlockDef.use_lut(None)
+    assert BlockDef.palette().levels is None
+
+
+def test_exact_palette_has_no_lut():
+    with pytest.raises(ValueError):
+        Palette(COLORS).build_lut()
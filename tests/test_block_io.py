@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import block_io
+from b2mine.block_map import BlockMap
+
+
+@pytest.fixture
+def block_map():
+    rng = np.random.RandomState(5)
+    n = 1000
+    return BlockMap(
+        rng.randint(-(1 << 20), 1 << 20, (n, 3)),
+        rng.randint(0, 1 << 16, n),
+        rng.randint(0, 256, n)
+    )
+
+
+def assert_same(a, b):
+    assert len(a) == len(b)
+    assert (a.positions == b.positions).all()
+    assert (a.block_ids == b.block_ids).all()
+    assert (a.block_data == b.block_data).all()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 999, 1000,
+                                        block_io.DEFAULT_CHUNK_SIZE])
+def test_round_trip(block_map, chunk_size):
+    data = block_io.dumps(block_map, chunk_size)
+    assert block_io.is_block_map(data)
+    assert_same(block_io.loads(data), block_map)
+
+    reader = block_io.BlockMapReader(data)
+    assert len(reader) == len(block_map)
+    assert reader.num_chunks == -(-len(block_map) // chunk_size)
+    assert_same(reader.read_chunk(reader.num_chunks - 1),
+                block_map[(reader.num_chunks - 1) * chunk_size:])
+    reader.close()
+
+
+def test_file_round_trip(tmp_path, block_map):
+    path = str(tmp_path / ("build" + block_io.EXTENSION))
+    block_io.dump(block_map, path, chunk_size=300)
+    assert_same(block_io.load(path), block_map)
+
+    with block_io.BlockMapReader.open(path) as reader:
+        chunks = list(reader.iter_chunks())
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    assert_same(BlockMap.concatenate(chunks), block_map)
+
+
+def test_empty():
+    data = block_io.dumps(BlockMap())
+    reader = block_io.BlockMapReader(data)
+    assert len(reader) == reader.num_chunks == 0
+    assert len(reader.read()) == 0
+
+
+def test_format_errors(block_map):
+    data = block_io.dumps(block_map, 500)
+    assert not block_io.is_block_map(b"\x80\x03pickle")
+    with pytest.raises(block_io.BlockMapFormatError):
+        block_io.loads(data[:10])
+    with pytest.raises(block_io.BlockMapFormatError):
+        block_io.loads(b"XXXX" + data[4:])
+
+    newer = bytearray(data)
+    newer[4] = block_io.FORMAT_VERSION + 1
+    with pytest.raises(block_io.BlockMapFormatError):
+        block_io.loads(bytes(newer))
+
+    # Chunk table of a map with fewer blocks than its first chunk holds
+    shorter = bytearray(data)
+    offset = block_io._HEADER.size + 12
+    shorter[offset:offset + 4] = (499).to_bytes(4, "little")
+    with pytest.raises(block_io.BlockMapFormatError):
+        block_io.BlockMapReader(bytes(shorter)).read_chunk(0)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import pickle
+
+import numpy as np
+import pytest
+
+from b2mine.block_map import BlockInfo, BlockMap, position_keys
+
+
+@pytest.fixture
+def block_map():
+    return BlockMap(
+        [(-3, 0, 7), (0, 0, 0), (5, -2, 1), (1, 9, -4)],
+        [1, 35, 35, 41],
+        [0, 14, 1, 0]
+    )
+
+
+def test_columns(block_map):
+    assert len(block_map) == 4
+    assert block_map.positions.dtype == BlockMap.POS_DTYPE
+    assert block_map.block_ids.dtype == BlockMap.ID_DTYPE
+    assert block_map.block_data.dtype == BlockMap.DATA_DTYPE
+    assert block_map.nbytes == 4 * (12 + 2 + 1)
+
+    empty = BlockMap()
+    assert len(empty) == 0 and empty.bounds() is None
+    assert (BlockMap([(0, 0, 0)], [1]).block_data == 0).all()
+    with pytest.raises(ValueError):
+        BlockMap([(0, 0, 0), (1, 0, 0)], [1], [0, 0])
+
+
+def test_blocks_round_trip(block_map):
+    blocks = list(block_map)
+    assert all(isinstance(b, BlockInfo) and b.has_block for b in blocks)
+    # No data reads as None, like the legacy block map
+    assert [b.color for b in blocks] == [None, 14, 1, None]
+    assert blocks[2].pos == (5, -2, 1)
+    assert block_map[2].to_dict() == blocks[2].to_dict()
+
+    rebuilt = BlockMap.from_blocks(blocks)
+    assert (rebuilt.positions == block_map.positions).all()
+    assert (rebuilt.block_ids == block_map.block_ids).all()
+    assert (rebuilt.block_data == block_map.block_data).all()
+
+
+def test_selection(block_map):
+    part = block_map[block_map.block_ids == 35]
+    assert isinstance(part, BlockMap)
+    assert part.positions.tolist() == [[0, 0, 0], [5, -2, 1]]
+    assert block_map[1:3].block_data.tolist() == [14, 1]
+
+    assert block_map.bounds() == ((-3, -2, -4), (5, 9, 7))
+    region = block_map.region((-3, -2, 0), (5, 10, 8))
+    assert region.positions.tolist() == [[-3, 0, 7], [0, 0, 0]]
+
+    both = BlockMap.concatenate([block_map, region])
+    assert len(both) == 6
+    assert both.block_ids.tolist() == [1, 35, 35, 41, 1, 35]
+    assert len(BlockMap.concatenate([])) == 0
+
+
+def test_find(block_map):
+    index = block_map.find_many([(5, -2, 1), (1, 9, -4), (2, 2, 2),
+                                 (-3, 0, 7)])
+    assert index.tolist() == [2, 3, -1, 0]
+    assert block_map.find((0, 0, 0)) == 1
+    assert block_map.lookup((2, 2, 2)) is None
+    assert block_map.lookup((1, 9, -4)).block_type == 41
+    assert BlockMap().find((0, 0, 0)) == -1
+
+
+def test_position_keys_sort_like_positions():
+    positions = np.random.RandomState(1).randint(-1000, 1000, (500, 3))
+    order = np.argsort(position_keys(positions), kind="stable")
+    assert (order == np.lexsort(positions.T[::-1])).all()
+
+
+def test_pickle(block_map):
+    block_map.find((0, 0, 0))
+    loaded = pickle.loads(pickle.dumps(block_map))
+    assert (loaded.positions == block_map.positions).all()
+    assert (loaded.block_data == block_map.block_data).all()
+    assert loaded.find((5, -2, 1)) == 2
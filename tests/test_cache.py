@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from b2mine import benchmark
+from b2mine import cache
+from b2mine import pipeline
+from b2mine.block_def import LUT_BITS, BlockDef
+
+
+@pytest.fixture
+def conversion_cache(tmp_path):
+    return cache.ConversionCache(str(tmp_path / "cache"))
+
+
+def entry(seed):
+    return {"values": np.random.RandomState(seed).rand(1000)}
+
+
+def test_round_trip(conversion_cache):
+    assert conversion_cache.get("missing") is None
+    conversion_cache.put("key", {"a": np.arange(5), "b": np.eye(2)})
+    arrays = conversion_cache.get("key")
+    assert sorted(arrays) == ["a", "b"]
+    assert (arrays["a"] == np.arange(5)).all()
+    stats = conversion_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    # A truncated entry is a miss
+    with open(conversion_cache.path("key"), "r+b") as f:
+        f.truncate(20)
+    assert conversion_cache.get("key") is None
+
+
+def test_least_recently_used_are_evicted(conversion_cache):
+    for i, key in enumerate(("a", "b", "c")):
+        conversion_cache.put(key, entry(i))
+        os.utime(conversion_cache.path(key), (1000 + i, 1000 + i))
+    # Reading a makes b the least recently used
+    assert conversion_cache.get("a") is not None
+
+    sizes = dict((os.path.basename(path), size)
+                 for _, size, path in conversion_cache.entries())
+    conversion_cache.max_bytes = sum(sizes.values())
+    conversion_cache.put("d", entry(3))
+    remaining = sorted(os.path.basename(path)
+                       for _, _, path in conversion_cache.entries())
+    assert remaining == ["a.npz", "c.npz", "d.npz"]
+    assert conversion_cache.evictions == 1
+
+    conversion_cache.max_bytes = 0
+    conversion_cache.evict()
+    assert conversion_cache.entries() == []
+
+
+def test_key_covers_the_conversion():
+    mesh = benchmark.sphere(segments=4)
+    key = cache.conversion_key(mesh, size=1.0, max_depth=5)
+    assert key == cache.conversion_key(mesh, max_depth=5, size=1.0)
+    assert key != cache.conversion_key(mesh, size=1.0, max_depth=6)
+    assert key != cache.conversion_key(mesh, np.zeros((2, 2, 3)), size=1.0,
+                                       max_depth=5)
+
+    moved = benchmark.sphere(segments=4)
+    moved.vertices[0, 0] += 1e-6
+    assert key != cache.conversion_key(moved, size=1.0, max_depth=5)
+
+    try:
+        BlockDef.use_lut(LUT_BITS)
+        assert key != cache.conversion_key(mesh, size=1.0, max_depth=5)
+    finally:
+        BlockDef.use_lut(None)
+
+
+def test_pipeline_reads_back_its_result(conversion_cache):
+    mesh = benchmark.torus(segments=8)
+    origin, size = pipeline.root_cell(mesh)
+    runs = []
+    for _ in range(2):
+        p = pipeline.Pipeline(mesh)
+        p.cache = conversion_cache
+        p.run(origin, size, 5)
+        runs.append(p)
+    assert [p.cache_hit for p in runs] == [False, True]
+    first, second = runs
+    assert (first.block_map.positions == second.block_map.positions).all()
+    assert (first.block_map.block_ids == second.block_map.block_ids).all()
+    assert (first.state.leaf_codes == second.state.leaf_codes).all()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import delta
+from b2mine.block_map import BlockMap
+
+
+def random_map(seed, n=400, extent=40):
+    rng = np.random.RandomState(seed)
+    positions = np.unique(rng.randint(-extent, extent, (n, 3)), axis=0)
+    rng.shuffle(positions)
+    return BlockMap(positions, rng.choice([1, 35], len(positions)),
+                    rng.randint(0, 3, len(positions)))
+
+
+def as_dict(block_map):
+    return {tuple(pos): (block_id, block_data) for pos, block_id, block_data
+            in zip(block_map.positions.tolist(), block_map.block_ids.tolist(),
+                   block_map.block_data.tolist())}
+
+
+def apply(world, block_map):
+    """World after writing block_map, air removing blocks"""
+    world = dict(world)
+    for pos, block in as_dict(block_map).items():
+        if block[0] == delta.AIR:
+            world.pop(pos, None)
+        else:
+            world[pos] = block
+    return world
+
+
+@pytest.fixture
+def maps():
+    previous = random_map(1)
+    added = random_map(2, 60)
+    added = added[previous.find_many(added.positions) < 0]
+    # Some blocks gone, some of the others recolored
+    kept = previous[50:]
+    block_data = kept.block_data.copy()
+    block_data[::7] = (block_data[::7] + 1) % 3
+    current = BlockMap.concatenate((
+        BlockMap(kept.positions, kept.block_ids, block_data), added))
+    return previous, current
+
+
+def test_diff_turns_previous_into_current(maps):
+    previous, current = maps
+    writes = delta.diff(previous, current)
+    assert apply(as_dict(previous), writes) == as_dict(current)
+    assert len(writes) < len(current)
+    assert not len(delta.diff(current, current))
+
+
+def test_tracker_over_chunks(maps):
+    previous, current = maps
+    tracker = delta.DeltaTracker(previous)
+    changes = [tracker.changes(current[begin:begin + 64])
+               for begin in range(0, len(current), 64)]
+    removals = tracker.removals()
+    writes = BlockMap.concatenate(changes + [removals])
+    assert apply(as_dict(previous), writes) == as_dict(current)
+
+    num_changes = sum(len(chunk) for chunk in changes)
+    assert tracker.num_unchanged + num_changes == len(current)
+    assert (removals.block_ids == delta.AIR).all()
+    assert set(as_dict(removals)) == set(as_dict(previous)) - \
+        set(as_dict(current))
+
+    tracker = delta.DeltaTracker()
+    assert tracker.changes(current) is current
+    assert not len(tracker.removals())
+
+
+def test_regions_cover_every_block():
+    block_map = random_map(3)
+    regions = list(delta.iter_regions(block_map, slab=16))
+    covered = np.zeros(len(block_map), dtype=int)
+    for lower, upper in regions:
+        assert all(u - l < 16 for l, u in zip(lower, upper))
+        covered += ((block_map.positions >= lower) &
+                    (block_map.positions <= upper)).all(axis=1)
+    assert (covered == 1).all()
+    assert list(delta.iter_regions(BlockMap())) == []
+
+
+def test_find_mismatches():
+    block_map = random_map(4)
+    world = as_dict(block_map)
+    wrong = list(world)[::9]
+    for i, pos in enumerate(wrong):
+        block_id, block_data = world[pos]
+        # The same block with other data, air, or another block
+        world[pos] = ((block_id, (block_data + 1) % 3), (0, 0),
+                      (41, 0))[i % 3]
+
+    def read_region(lower, upper):
+        x, y, z = np.meshgrid(*[np.arange(l, u + 1)
+                                for l, u in zip(lower, upper)],
+                              indexing="ij")
+        # y major, then x, then z, like world.getBlocks
+        order = np.stack((x, y, z), axis=-1).transpose(1, 0, 2, 3)
+        return ",".join(str(world.get(tuple(pos), (0, 0))[0])
+                        for pos in order.reshape(-1, 3).tolist())
+
+    def read_data(positions):
+        return [world[tuple(pos)][1] for pos in positions.tolist()]
+
+    repair = delta.find_mismatches(block_map, read_region, read_data, slab=16)
+    assert sorted(as_dict(repair)) == sorted(wrong)
+
+    ids_only = delta.find_mismatches(block_map, read_region, slab=16)
+    assert sorted(as_dict(ids_only)) == sorted(wrong[1::3] + wrong[2::3])
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import benchmark
+from b2mine import incremental
+from b2mine import pipeline
+from b2mine.mesh_data import MeshData
+
+
+DEPTH = 7
+
+
+def edited(mesh, vertices, offset):
+    """Copy of mesh with some vertices moved"""
+    moved = mesh.vertices.copy()
+    moved[vertices] += offset
+    return MeshData(moved, mesh.tri_vertex, mesh.tri_loop, mesh.loop_colors,
+                    mesh.loop_uvs)
+
+
+def run(mesh, origin, size, previous=None, solid=False):
+    p = pipeline.Pipeline(mesh)
+    block_map = p.run(origin, size, DEPTH, solid=solid, previous=previous)
+    return p, block_map
+
+
+def assert_same(a, b):
+    assert (a.state.leaf_codes == b.state.leaf_codes).all()
+    assert (a.state.leaf_rgb == b.state.leaf_rgb).all()
+    assert (a.state.nodes == b.state.nodes).all()
+    assert (a.state.hashes == b.state.hashes).all()
+    assert (a.block_map.positions == b.block_map.positions).all()
+    assert (a.block_map.block_ids == b.block_map.block_ids).all()
+    assert (a.block_map.block_data == b.block_map.block_data).all()
+
+
+@pytest.mark.parametrize("solid", [False, True])
+def test_update_equals_full_rebuild(solid):
+    mesh = benchmark.sphere(segments=12)
+    origin, size = pipeline.root_cell(mesh)
+    first, _ = run(mesh, origin, size, solid=solid)
+
+    # Push a few vertices in and nudge another, within the root cell
+    mesh = edited(mesh, [30, 31, 43], (0.0, 0.0, -0.2))
+    mesh = edited(mesh, [100], (0.05, 0.05, 0.0))
+    again, _ = run(mesh, origin, size, previous=first.state, solid=solid)
+    full, _ = run(mesh, origin, size, solid=solid)
+    assert_same(again, full)
+    assert not np.array_equal(again.state.leaf_codes, first.state.leaf_codes)
+
+
+def test_only_changed_nodes_are_voxelized():
+    mesh = benchmark.sphere(segments=12)
+    origin, size = pipeline.root_cell(mesh)
+    first, _ = run(mesh, origin, size)
+    state = first.state
+
+    asked = []
+
+    def new_leaves(changed):
+        asked.append(changed)
+        return np.empty(0, dtype=np.uint64), np.empty((0, 3))
+
+    codes, rgb = incremental.update(state, state.nodes, state.hashes,
+                                    new_leaves)
+    assert len(asked[0]) == 0
+    assert (codes == state.leaf_codes).all() and (rgb == state.leaf_rgb).all()
+
+    # One node dropped, one whose triangles changed
+    hashes = state.hashes.copy()
+    hashes[5] += np.uint64(1)
+    keep = np.arange(len(state.nodes)) != 9
+    codes, _ = incremental.update(state, state.nodes[keep], hashes[keep],
+                                  new_leaves)
+    assert asked[1].tolist() == sorted(state.nodes[[5, 9]].tolist())
+    parents = incremental.leaf_parents(state.leaf_codes, state.depth,
+                                       state.level)
+    assert (codes == state.leaf_codes[~np.isin(parents, asked[1])]).all()
+
+
+def test_state_round_trip():
+    mesh = benchmark.sphere(segments=8)
+    origin, size = pipeline.root_cell(mesh)
+    state = run(mesh, origin, size)[0].state
+    loaded = incremental.IncrementalState.loads(state.dumps())
+    assert loaded.compatible(origin, size, state.depth, state.pixels)
+    assert not loaded.compatible(origin, size, state.depth + 1)
+    assert (loaded.leaf_codes == state.leaf_codes).all()
+    assert (loaded.hashes == state.hashes).all()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import merge
+from b2mine.block_map import BlockMap
+
+
+def expand(cuboids):
+    """Block of every cell of every cuboid, a cell given twice included
+    :return: list of (x, y, z, block id, block data)
+    """
+    cells = []
+    for lower, upper, block_id, block_data in cuboids:
+        x, y, z = np.meshgrid(*[np.arange(a, b + 1)
+                                for a, b in zip(lower, upper)])
+        for pos in zip(x.ravel(), y.ravel(), z.ravel()):
+            cells.append(tuple(int(v) for v in pos) + (block_id, block_data))
+    return cells
+
+
+def as_blocks(block_map):
+    return [tuple(pos) + (block_id, block_data) for pos, block_id, block_data
+            in zip(block_map.positions.tolist(), block_map.block_ids.tolist(),
+                   block_map.block_data.tolist())]
+
+
+def assert_union(block_map, cuboids):
+    cells = expand(cuboids)
+    assert len(cells) == len(set(cells)), "overlapping cuboids"
+    assert sorted(cells) == sorted(as_blocks(block_map))
+    assert cuboids.volumes.sum() == len(block_map)
+
+
+def test_solid_box_is_one_cuboid():
+    x, y, z = np.meshgrid(np.arange(4), np.arange(3), np.arange(5))
+    positions = np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1)
+    n = len(positions)
+    block_map = BlockMap(positions, np.full(n, 35), np.full(n, 4))
+    cuboids = merge.merge_cuboids(block_map)
+    assert list(cuboids) == [([0, 0, 0], [3, 2, 4], 35, 4)]
+
+
+@pytest.mark.parametrize("tile_bits", [2, merge.TILE_BITS])
+def test_union_is_the_block_set(tile_bits):
+    rng = np.random.RandomState(11)
+    # Dense enough for merges, spread over tiles and negative positions
+    grid = rng.rand(24, 12, 24) < 0.6
+    positions = np.argwhere(grid) - (10, 3, 13)
+    kinds = rng.randint(0, 3, len(positions))
+    block_map = BlockMap(positions, np.where(kinds, 35, 1),
+                         np.where(kinds == 2, 14, 0))
+
+    cuboids = merge.merge_cuboids(block_map, tile_bits)
+    assert len(cuboids) < len(block_map)
+    assert_union(block_map, cuboids)
+
+    # Nothing crosses a tile border
+    assert ((cuboids.lower >> tile_bits) ==
+            (cuboids.upper >> tile_bits)).all()
+
+
+def test_take_and_empty():
+    block_map = BlockMap([(0, 0, 0), (1, 0, 0), (5, 5, 5)], [1, 1, 2])
+    cuboids = merge.merge_cuboids(block_map)
+    assert_union(block_map, cuboids)
+    single = cuboids.take(cuboids.volumes == 1)
+    assert list(single) == [([5, 5, 5], [5, 5, 5], 2, 0)]
+    assert len(merge.merge_cuboids(BlockMap())) == 0
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import numpy as np
+import pytest
+
+from b2mine import delta
+from b2mine import merge
+from b2mine import transfer
+from b2mine.block_map import BlockMap
+from b2mine.mock_server import MockRaspberryJuice
+
+
+@pytest.fixture
+def server():
+    with MockRaspberryJuice() as server:
+        yield server
+
+
+class Client(object):
+    """Line protocol over a socket, as spoken by mcpi"""
+
+    def __init__(self, address, port):
+        self.socket = socket.create_connection((address, port), timeout=5)
+        self.reader = self.socket.makefile("r")
+
+    def send(self, line):
+        self.socket.sendall((line + "\n").encode("ascii"))
+
+    def send_receive(self, line):
+        self.send(line)
+        return self.reader.readline().strip()
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+@pytest.fixture
+def client(server):
+    client = Client(server.address, server.port)
+    yield client
+    client.close()
+
+
+def test_set_block_round_trip(client):
+    client.send("world.setBlock(1,2,3,35,4)")
+    assert client.send_receive("world.getBlockWithData(1,2,3)") == "35,4"
+    assert client.send_receive("world.getBlock(1,2,3)") == "35"
+    assert client.send_receive("world.getBlock(0,0,0)") == "0"
+
+
+def test_set_blocks_get_blocks_round_trip(client, server):
+    client.send("world.setBlocks(2,0,-1,0,1,1,159,3)")
+    reply = client.send_receive("world.getBlocks(-1,0,-1,2,1,1)")
+
+    blocks = delta.parse_get_blocks(reply, (-1, 0, -1), (2, 1, 1))
+    assert blocks.shape == (4, 2, 3)
+    assert (blocks[1:] == 159).all()
+    assert (blocks[0] == 0).all()
+    assert len(server.blocks) == 3 * 2 * 3
+    assert server.get_block(0, 1, 1) == (159, 3)
+
+
+def test_player_position(server):
+    server.player_pos = (10, 64, -3)
+    client = Client(server.address, server.port)
+    try:
+        assert client.send_receive("player.getTilePos()") == "10,64,-3"
+    finally:
+        client.close()
+
+
+def test_async_sender_writes_every_command(server):
+    commands = [
+        "world.setBlock({},0,0,1)\n".format(x) for x in range(100)
+    ] + ["world.setBlocks(0,1,0,3,1,3,35,14)\n"]
+    sender = transfer.AsyncSender(server.address, server.port, connections=3)
+    stats = sender.send(commands)
+
+    assert stats.num_commands == len(commands)
+    assert server.num_connections == 3
+    assert all(server.get_block(x, 0, 0) == (1, 0) for x in range(100))
+    assert server.get_block(3, 1, 3) == (35, 14)
+    assert len(server.blocks) == 100 + 16
+
+
+def test_chunk_switches(server):
+    server.execute("world.setBlock(0,0,0,1)", session={})
+    session = {}
+    for x in (0, 1, 16, 17, 0):
+        server.execute("world.setBlock({},0,0,1)".format(x), session)
+    assert server.chunk_switches == 2
+    assert server.chunk_visits == 1 + 3
+
+    server.reset()
+    assert server.chunk_switches == 0
+    assert server.chunk_visits == 0
+    assert not server.blocks
+
+
+def _single_blocks(block_map):
+    """One cuboid per block, so every column is written to"""
+    return merge.CuboidList(block_map.positions, block_map.positions,
+                            block_map.block_ids, block_map.block_data)
+
+
+def test_column_slices_visit_every_column_once(server):
+    x, y, z = np.meshgrid(np.arange(-16, 48), np.arange(3), np.arange(40),
+                          indexing="ij")
+    positions = np.stack((x, y, z), -1).reshape(-1, 3)
+    block_map = BlockMap(positions, np.full(len(positions), 35),
+                         positions[:, 0] % 3)
+    slices = list(transfer.column_slices(block_map, (0, 0, 0), size=1000))
+    assert sum(len(s) for s in slices) == len(block_map)
+
+    columns = [set(map(tuple, s.positions[:, [0, 2]] >> 4)) for s in slices]
+    assert len(set.union(*columns)) == sum(len(c) for c in columns) == 4 * 3
+
+    sender = transfer.AsyncSender(server.address, server.port, connections=3)
+    stats = sender.send_slices(
+        (transfer.chunk_commands(_single_blocks(s), (0, 0, 0))[0], len(s))
+        for s in slices
+    )
+    assert stats.num_blocks == len(block_map)
+    assert server.num_connections == 3
+    assert server.chunk_visits == 4 * 3
+    assert server.get_block(-16, 2, 39) == (35, 2)
+    assert len(server.blocks) == len(block_map)
+
+
+def test_verify_repairs_block_data(server):
+    block_map = BlockMap([(0, 0, 0), (1, 0, 0), (2, 0, 0), (2, 1, 0)],
+                         [35, 35, 1, 159], [1, 0, 0, 3])
+    origin = (5, 64, -3)
+    sender = transfer.AsyncSender(server.address, server.port)
+    commands, _ = transfer.chunk_commands(_single_blocks(block_map), origin)
+    sender.send(commands)
+
+    # Same ids, other colours, and one block of another id
+    server.blocks[(5, 64, -3)] = (35, 4)
+    server.blocks[(6, 64, -3)] = (35, 14)
+    server.blocks[(7, 64, -3)] = (4, 0)
+
+    def read_region(lower, upper):
+        corners = [o + v for o, v in zip(origin * 2, lower + upper)]
+        return sender.query(
+            ["world.getBlocks({},{},{},{},{},{})\n".format(*corners)])[0]
+
+    def read_data(positions):
+        return delta.parse_block_data(
+            sender.query(delta.block_data_queries(positions, origin)))
+
+    ids_only = delta.find_mismatches(block_map, read_region)
+    assert ids_only.positions.tolist() == [[2, 0, 0]]
+
+    repair = delta.find_mismatches(block_map, read_region, read_data)
+    assert sorted(repair.positions.tolist()) == \
+        [[0, 0, 0], [1, 0, 0], [2, 0, 0]]
+    commands, _ = transfer.chunk_commands(_single_blocks(repair), origin)
+    sender.send(commands)
+    assert server.get_block(5, 64, -3) == (35, 1)
+    assert server.get_block(6, 64, -3) == (35, 0)
+    assert server.get_block(7, 64, -3) == (1, 0)
+    assert not len(delta.find_mismatches(block_map, read_region, read_data))
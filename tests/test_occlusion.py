@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+import numpy as np
+import pytest
+
+from b2mine import occlusion
+from b2mine.block_map import BlockMap
+
+
+def cube(n, offset=(0, 0, 0)):
+    positions = np.indices((n, n, n)).reshape(3, -1).T + offset
+    return BlockMap(positions, np.full(len(positions), 35),
+                    np.arange(len(positions)) % 16)
+
+
+def brute_force_hidden(positions, thickness):
+    """Blocks whose every position up to thickness steps away is taken"""
+    taken = set(map(tuple, positions.tolist()))
+    steps = [d for d in itertools.product(range(-thickness, thickness + 1),
+                                          repeat=3)
+             if sum(map(abs, d)) <= thickness]
+    return np.array([all((x + dx, y + dy, z + dz) in taken
+                         for dx, dy, dz in steps)
+                     for x, y, z in positions.tolist()])
+
+
+@pytest.mark.parametrize("thickness, hidden", [(1, 4 ** 3), (2, 2 ** 3),
+                                               (3, 0)])
+def test_solid_cube(thickness, hidden):
+    offset = (-3, 10, -50)
+    block_map = cube(6, offset)
+    culled, num_hidden = occlusion.cull(block_map, thickness)
+    assert num_hidden == hidden
+    assert len(culled) == len(block_map) - hidden
+    local = block_map.positions - offset
+    inner = ((local >= thickness) & (local < 6 - thickness)).all(axis=1)
+    assert inner.sum() == hidden
+    assert (occlusion.hidden_mask(block_map.positions, thickness) ==
+            inner).all()
+
+
+@pytest.mark.parametrize("thickness", [1, 2])
+def test_hidden_matches_brute_force(thickness):
+    grid = np.random.RandomState(2).rand(12, 12, 12) < 0.9
+    positions = np.argwhere(grid) - 6
+    np.random.RandomState(3).shuffle(positions)
+    mask = occlusion.hidden_mask(positions, thickness)
+    assert mask.any()
+    assert (mask == brute_force_hidden(positions, thickness)).all()
+
+
+def test_fill():
+    block_map = cube(4)
+    hidden = occlusion.hidden_mask(block_map.positions)
+    filled, num_hidden = occlusion.cull(block_map, fill=occlusion.STONE)
+    assert num_hidden == 8 and filled is not block_map
+    assert (filled.positions == block_map.positions).all()
+    assert (filled.block_ids[hidden] == occlusion.STONE).all()
+    assert (filled.block_data[hidden] == 0).all()
+    assert (filled.block_ids[~hidden] == 35).all()
+    assert (block_map.block_ids == 35).all()
+
+    same, num_hidden = occlusion.cull(block_map, fill=occlusion.STONE,
+                                      in_place=True)
+    assert same is block_map and num_hidden == 8
+    assert (block_map.block_ids == filled.block_ids).all()
+    assert (block_map.block_data == filled.block_data).all()
+
+    shell = block_map[~hidden]
+    assert occlusion.cull(shell) == (shell, 0)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import benchmark
+from b2mine import pipeline
+from b2mine import voxelizer
+from b2mine.block_map import position_keys
+from b2mine.pyramid import Pyramid
+
+
+DEPTH = 6
+
+
+@pytest.fixture(scope="module")
+def run():
+    mesh = benchmark.torus(segments=12)
+    origin, size = pipeline.root_cell(mesh)
+    p = pipeline.Pipeline(mesh)
+    p.run(origin, size, DEPTH, pyramid=True)
+    return p, mesh, origin, size
+
+
+def sorted_blocks(block_map):
+    order = np.argsort(position_keys(block_map.positions))
+    return (block_map.positions[order], block_map.block_ids[order],
+            block_map.block_data[order])
+
+
+def test_finest_level_is_the_run(run):
+    p, _, _, _ = run
+    pyramid = p.pyramid
+    assert pyramid.max_depth == DEPTH
+    for a, b in zip(sorted_blocks(pyramid.block_map(DEPTH)),
+                    sorted_blocks(p.block_map)):
+        assert (a == b).all()
+
+
+def test_levels_are_the_cells_of_coarser_runs(run):
+    p, mesh, origin, size = run
+    pyramid = p.pyramid
+    cells, rgb = pyramid.cells(1)
+    assert cells.tolist() == [[0, 0, 0]]
+    assert np.allclose(rgb[0], p.rgb.mean(axis=0))
+
+    for depth in range(2, DEPTH):
+        cells, rgb = pyramid.cells(depth)
+        expected = voxelizer.leaf_cells(mesh.triangles, origin, size,
+                                        depth - 1)
+        assert (cells == expected).all()
+
+        # Every color is the mean of the leaves below
+        parents = p.cells >> (DEPTH - depth)
+        index = np.unique(position_keys(parents), return_inverse=True)[1]
+        mean = np.stack([np.bincount(index.reshape(-1), p.rgb[:, c]) /
+                         np.bincount(index.reshape(-1)) for c in range(3)],
+                        axis=1)
+        order = np.argsort(position_keys(cells))
+        assert np.allclose(rgb[order], mean, atol=1e-6)
+
+
+def test_expanded_block_map(run):
+    pyramid = run[0].pyramid
+    coarse = pyramid.block_map(3)
+    expanded = pyramid.block_map(3, expand_to=5)
+    assert len(expanded) == 64 * len(coarse)
+    # Every coarse block fills the cube of blocks below it
+    parents = expanded.positions // 2 >> 2
+    index = coarse.find_many(parents * 2)
+    assert (index >= 0).all()
+    assert (coarse.block_ids[index] == expanded.block_ids).all()
+    assert (coarse.block_data[index] == expanded.block_data).all()
+
+
+def test_round_trip_and_depth_check(run):
+    pyramid = run[0].pyramid
+    loaded = Pyramid.loads(pyramid.dumps())
+    assert (loaded.codes == pyramid.codes).all()
+    assert (loaded.offsets == pyramid.offsets).all()
+    assert (loaded.block_ids == pyramid.block_ids).all()
+    for depth in (0, DEPTH + 1):
+        with pytest.raises(ValueError):
+            pyramid.block_map(depth)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from b2mine import schematic
+from b2mine.block_map import BlockMap
+
+
+def read_nbt(path):
+    """Named root tag of a gzip compressed NBT file
+    :return: name and value, compounds as dicts, lists as lists, byte
+        arrays as bytes
+    """
+    with gzip.open(str(path), "rb") as f:
+        stream = io.BytesIO(f.read())
+    tag, = struct.unpack(">b", stream.read(1))
+    assert tag == schematic.TAG_COMPOUND
+    name = _read_string(stream)
+    value = _read_payload(stream, tag)
+    assert not stream.read(), "data after the root tag"
+    return name, value
+
+
+def _read_string(stream):
+    length, = struct.unpack(">H", stream.read(2))
+    return stream.read(length).decode("utf-8")
+
+
+def _read_payload(stream, tag):
+    if tag == schematic.TAG_SHORT:
+        return struct.unpack(">h", stream.read(2))[0]
+    if tag == schematic.TAG_INT:
+        return struct.unpack(">i", stream.read(4))[0]
+    if tag == schematic.TAG_BYTE_ARRAY:
+        length, = struct.unpack(">i", stream.read(4))
+        data = stream.read(length)
+        assert len(data) == length
+        return data
+    if tag == schematic.TAG_STRING:
+        return _read_string(stream)
+    if tag == schematic.TAG_INT_ARRAY:
+        length, = struct.unpack(">i", stream.read(4))
+        return list(struct.unpack(">{}i".format(length),
+                                  stream.read(4 * length)))
+    if tag == schematic.TAG_LIST:
+        item, length = struct.unpack(">bi", stream.read(5))
+        return [_read_payload(stream, item) for _ in range(length)]
+    if tag == schematic.TAG_COMPOUND:
+        value = {}
+        while True:
+            item, = struct.unpack(">b", stream.read(1))
+            if item == schematic.TAG_END:
+                return value
+            name = _read_string(stream)
+            assert name not in value
+            value[name] = _read_payload(stream, item)
+    raise AssertionError("Unexpected tag {}".format(tag))
+
+
+def decode_varints(data):
+    values, value, shift = [], 0, 0
+    for byte in bytearray(data):
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value)
+            value, shift = 0, 0
+    assert not shift, "truncated varint"
+    return np.array(values, dtype=np.int64)
+
+
+@pytest.fixture
+def block_map():
+    # World offsets from the player, below and behind included
+    return BlockMap(
+        [(-2, 0, 3), (1, 0, 3), (-2, 4, -1), (0, 2, 0), (1, 4, 3)],
+        [35, 35, 1, 159, 41],
+        [1, 14, 0, 3, 0]
+    )
+
+
+def test_block_state():
+    assert schematic.block_state(35, 1) == "minecraft:orange_wool"
+    assert schematic.block_state(1) == "minecraft:stone"
+    assert schematic.block_state(0) == schematic.AIR
+    with pytest.raises(ValueError):
+        schematic.block_state(35, 16)
+    with pytest.raises(ValueError):
+        schematic.block_state(4000)
+
+
+def test_encode_varints():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2 ** 32 - 1])
+    data = schematic.encode_varints(values)
+    assert len(data) == schematic.varint_lengths(values).sum()
+    assert data[3:5] == b"\x80\x01"
+    assert (decode_varints(data) == values).all()
+
+
+def test_sponge_schematic(tmp_path, block_map):
+    path = tmp_path / "build.schem"
+    size = schematic.export(block_map, str(path), data_version=1234)
+    assert size == (4, 5, 5)
+    assert not (tmp_path / "build.schem.part").exists()
+
+    name, root = read_nbt(path)
+    assert name == "Schematic"
+    assert root["Version"] == schematic.SPONGE_VERSION
+    assert root["DataVersion"] == 1234
+    assert (root["Width"], root["Height"], root["Length"]) == size
+    assert root["Offset"] == [0, 0, 0]
+    metadata = root["Metadata"]
+    assert (metadata["WEOffsetX"], metadata["WEOffsetY"],
+            metadata["WEOffsetZ"]) == (-2, 0, -1)
+
+    palette = root["Palette"]
+    assert root["PaletteMax"] == len(palette) == 5 + 1
+    assert palette[schematic.AIR] == 0
+    assert sorted(palette.values()) == list(range(len(palette)))
+    names = {index: name for name, index in palette.items()}
+
+    blocks = decode_varints(root["BlockData"])
+    assert len(blocks) == 4 * 5 * 5
+    expected = {
+        (0, 0, 4): "minecraft:orange_wool",
+        (3, 0, 4): "minecraft:red_wool",
+        (0, 4, 0): "minecraft:stone",
+        (2, 2, 1): "minecraft:light_blue_terracotta",
+        (3, 4, 4): "minecraft:gold_block",
+    }
+    width, height, length = size
+    for y in range(height):
+        for z in range(length):
+            for x in range(width):
+                index = blocks[x + z * width + y * width * length]
+                assert names[index] == expected.get((x, y, z), schematic.AIR)
+
+
+def test_sponge_palette_beyond_one_byte(tmp_path, monkeypatch):
+    # More kinds than a single byte varint holds
+    for i in range(200):
+        monkeypatch.setitem(
+            schematic.BLOCK_STATES, (1000 + i, 0), "test:block_{}".format(i))
+    positions = np.stack(
+        (np.arange(200) % 20, np.zeros(200), np.arange(200) // 20), 1)
+    block_map = BlockMap(positions, 1000 + np.arange(200), None)
+
+    path = tmp_path / "wide.schem"
+    schematic.export(block_map, str(path))
+    _, root = read_nbt(path)
+
+    palette = root["Palette"]
+    # Air comes first, even when no block of the box is left empty
+    assert len(palette) == 200 + 1
+    assert palette[schematic.AIR] == 0
+    blocks = decode_varints(root["BlockData"])
+    assert len(blocks) == 20 * 1 * 10
+    assert len(root["BlockData"]) > len(blocks)
+    names = {index: name for name, index in palette.items()}
+    for i, (x, _, z) in enumerate(positions.astype(int).tolist()):
+        assert names[blocks[x + z * 20]] == "test:block_{}".format(i)
+
+
+def test_structure(tmp_path, block_map):
+    path = tmp_path / "build.nbt"
+    size = schematic.export(block_map, str(path))
+    assert size == (4, 5, 5)
+
+    name, root = read_nbt(path)
+    assert name == ""
+    assert root["DataVersion"] == schematic.DATA_VERSION
+    assert root["size"] == [4, 5, 5]
+    assert root["entities"] == []
+    names = [state["Name"] for state in root["palette"]]
+    assert schematic.AIR not in names
+    assert len(names) == len(set(names)) == 5
+
+    blocks = root["blocks"]
+    assert len(blocks) == len(block_map)
+    lower = block_map.positions.min(axis=0)
+    for entry, block in zip(blocks, block_map):
+        assert entry["pos"] == (np.array(block.pos) - lower).tolist()
+        assert names[entry["state"]] == schematic.block_state(
+            block.block_type, block.color or 0)
+
+
+def test_empty_block_map(tmp_path):
+    path = tmp_path / "empty.schem"
+    assert schematic.export(BlockMap(), str(path)) == (0, 0, 0)
+    _, root = read_nbt(path)
+    assert root["Palette"] == {schematic.AIR: 0}
+    assert root["BlockData"] == b""
+
+    path = tmp_path / "empty.nbt"
+    assert schematic.export(BlockMap(), str(path)) == (0, 0, 0)
+    _, root = read_nbt(path)
+    assert root["palette"] == [] and root["blocks"] == []
+
+
+def test_export_errors(tmp_path, block_map):
+    with pytest.raises(ValueError):
+        schematic.export(block_map, str(tmp_path / "build.txt"))
+
+    unknown = BlockMap([(0, 0, 0)], [4000], None)
+    path = tmp_path / "unknown.schem"
+    with pytest.raises(ValueError):
+        schematic.export(unknown, str(path))
+    assert not path.exists()
+    assert not (tmp_path / "unknown.schem.part").exists()
+
+
+def test_export_keeps_the_error_of_open(tmp_path, block_map):
+    path = tmp_path / "missing" / "build.schem"
+    with pytest.raises(FileNotFoundError) as error:
+        schematic.export(block_map, str(path))
+    assert error.value.filename == str(path) + ".part"
+    assert error.value.__context__ is None
+
+
+def test_structure_size_limit(tmp_path):
+    edge = schematic.MAX_STRUCTURE_EDGE
+    path = tmp_path / "largest.nbt"
+    assert schematic.export(BlockMap([(0, 0, 0), (edge - 1, 5, edge - 1)],
+                                     [1, 1]), str(path)) == (edge, 6, edge)
+
+    path = tmp_path / "large.nbt"
+    with pytest.raises(ValueError):
+        schematic.export(BlockMap([(0, 0, 0), (0, edge, 0)], [1, 1]),
+                         str(path))
+    assert not path.exists()
+    assert not (tmp_path / "large.nbt.part").exists()
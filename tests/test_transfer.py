@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import transfer
+from b2mine.block_map import BlockMap, position_keys
+from b2mine.merge import CuboidList
+
+
+@pytest.fixture
+def block_map():
+    rng = np.random.RandomState(9)
+    cells = np.unique(rng.randint(-40, 40, (3000, 3)), axis=0)
+    rng.shuffle(cells)
+    # Grid positions are cells times two, see Pipeline
+    return BlockMap(cells * 2, rng.choice([1, 35], len(cells)),
+                    rng.randint(0, 16, len(cells)))
+
+
+def test_world_positions():
+    transform = transfer.WorldTransform(anchor=(100, 64, -7))
+    positions = transform.positions([(0, 0, 0), (3, 4, 5), (-1, -2, -3),
+                                     (-4, 6, 2)])
+    # x stays, z up becomes y up, y becomes minus z, negatives round down
+    assert positions.tolist() == [[100, 64, -7], [101, 66, -9],
+                                  [99, 62, -6], [98, 65, -10]]
+    assert positions.dtype == np.int64
+
+
+def test_every_cell_gets_its_own_block(block_map):
+    world = transfer.to_world(block_map)
+    assert len(np.unique(position_keys(world.positions))) == len(block_map)
+    assert (world.block_ids == block_map.block_ids).all()
+    assert (world.block_data == block_map.block_data).all()
+
+
+def test_chunks_transform_like_the_whole_map(block_map):
+    transform = transfer.WorldTransform(anchor=(5, 6, 7))
+    whole = transform.apply(block_map)
+    chunks = (block_map[begin:begin + 700]
+              for begin in range(0, len(block_map), 700))
+    joined = transform.apply_chunks(chunks, len(block_map))
+    assert (joined.positions == whole.positions).all()
+    assert (joined.block_ids == whole.block_ids).all()
+    assert (joined.block_data == whole.block_data).all()
+
+
+def test_cuboid_commands():
+    cuboids = CuboidList([(0, 0, 0), (-2, 1, 3)], [(0, 0, 0), (1, 1, 4)],
+                         [1, 35], [0, 14])
+    assert transfer.cuboid_commands(cuboids, (10.5, 64, -0.5)) == [
+        "world.setBlock(10,64,-1,1)\n",
+        "world.setBlocks(8,65,2,11,65,3,35,14)\n",
+    ]
+
+
+def test_column_order(block_map):
+    origin = (3, 0, -9)
+    order, keys = transfer.column_order(block_map.positions, origin)
+    assert sorted(order.tolist()) == list(range(len(block_map)))
+
+    positions = block_map.positions[order].astype(np.int64) + origin
+    columns = positions[:, [0, 2]] >> transfer.CHUNK_BITS
+    # Every column comes once, its blocks bottom-up
+    starts = np.flatnonzero(np.diff(keys)) + 1
+    assert len(starts) + 1 == len(np.unique(columns, axis=0))
+    for column in np.split(positions, starts):
+        assert len(np.unique(column[:, [0, 2]] >> transfer.CHUNK_BITS,
+                             axis=0)) == 1
+        assert (np.diff(column[:, 1]) >= 0).all()
+
+
+@pytest.mark.parametrize("size", [1, 250, 4000])
+def test_column_slices(block_map, size):
+    origin = (0, 0, 0)
+    slices = list(transfer.column_slices(block_map, origin, size))
+    joined = BlockMap.concatenate(slices)
+    assert sorted(position_keys(joined.positions).tolist()) == \
+        sorted(position_keys(block_map.positions).tolist())
+
+    # No column is cut between two slices
+    columns = [set(map(tuple, (s.positions[:, [0, 2]] >>
+                               transfer.CHUNK_BITS).tolist()))
+               for s in slices]
+    assert sum(len(c) for c in columns) == len(set().union(*columns))
+    if size >= len(block_map):
+        assert len(slices) == 1
+
+
+def test_shard_bounds():
+    assert transfer.shard_bounds(10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert transfer.shard_bounds(0, 3) == []
+    groups = np.array([0, 0, 0, 1, 1, 2, 2, 2, 2, 3])
+    # Split points move forward to the next group
+    assert transfer.shard_bounds(10, 3, groups) == [(0, 5), (5, 9), (9, 10)]
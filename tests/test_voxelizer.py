@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from b2mine import benchmark
+from b2mine import morton
+from b2mine import pipeline
+from b2mine import voxelizer
+
+
+DEPTH = 4
+
+
+@pytest.fixture(scope="module")
+def torus():
+    mesh = benchmark.torus(segments=6)
+    origin, size = pipeline.root_cell(mesh)
+    return mesh.triangles, origin, size
+
+
+def brute_force_cells(triangles, origin, size, depth):
+    """Every cell of the grid tested against every triangle"""
+    n = 1 << depth
+    unit = size / n
+    grid = np.stack(np.meshgrid(np.arange(n), np.arange(n), np.arange(n),
+                                indexing="ij"), axis=-1).reshape(-1, 3)
+    centers = np.asarray(origin) + (grid + 0.5) * unit
+    hit = np.zeros(len(grid), dtype=bool)
+    for tri in triangles:
+        tris = np.broadcast_to(tri, (len(grid), 3, 3))
+        hit |= voxelizer.tri_box_overlap(centers, unit / 2.0, tris)
+    return grid[hit]
+
+
+def as_set(cells):
+    return set(map(tuple, np.asarray(cells).tolist()))
+
+
+def test_tri_box_overlap():
+    tri = np.array([[(-1.0, -1.0, 0.0), (1.0, -1.0, 0.0), (0.0, 1.0, 0.0)]])
+    centers = np.array([
+        (0.0, 0.0, 0.0),    # through the middle
+        (0.0, 0.0, 0.5),    # touching the plane
+        (0.0, 0.0, 0.51),   # above it
+        (1.2, 0.9, 0.0),    # beside the slanted edge
+        (1.5, -1.5, 0.0),   # touching a corner
+    ])
+    tris = np.repeat(tri, len(centers), axis=0)
+    assert voxelizer.tri_box_overlap(centers, 0.5, tris).tolist() == \
+        [True, True, False, False, True]
+
+
+def test_leaf_cells_match_brute_force(torus):
+    triangles, origin, size = torus
+    cells = voxelizer.leaf_cells(triangles, origin, size, DEPTH)
+    codes = morton.encode(cells)
+    assert (np.diff(codes.astype(np.int64)) > 0).all()
+    assert as_set(cells) == as_set(
+        brute_force_cells(triangles, origin, size, DEPTH))
+
+
+def test_fill_interior_of_sphere():
+    mesh = benchmark.sphere(segments=16)
+    origin, size = pipeline.root_cell(mesh)
+    depth = 5
+    unit = size / (1 << depth)
+    surface = voxelizer.leaf_cells(mesh.triangles, origin, size, depth)
+    interior, nearest = voxelizer.fill_interior(
+        surface, mesh.triangles, origin, unit)
+
+    assert not as_set(interior) & as_set(surface)
+    # The nearest surface cell is in the same column
+    assert (surface[nearest][:, :2] == interior[:, :2]).all()
+
+    # Every cell well inside the sphere is filled, none outside it is
+    radius = np.linalg.norm(np.asarray(origin) + (interior + 0.5) * unit,
+                            axis=1)
+    assert radius.max() < 1.0
+    n = 1 << depth
+    grid = np.stack(np.meshgrid(np.arange(n), np.arange(n), np.arange(n),
+                                indexing="ij"), axis=-1).reshape(-1, 3)
+    radius = np.linalg.norm(np.asarray(origin) + (grid + 0.5) * unit, axis=1)
+    assert as_set(grid[radius < 1.0 - unit]) <= \
+        as_set(interior) | as_set(surface)
+
+
+def test_fill_interior_of_open_surface():
+    mesh = benchmark.terrain(segments=16)
+    origin, size = pipeline.root_cell(mesh)
+    unit = size / (1 << DEPTH)
+    surface = voxelizer.leaf_cells(mesh.triangles, origin, size, DEPTH)
+    interior, nearest = voxelizer.fill_interior(
+        surface, mesh.triangles, origin, unit)
+    assert len(interior) == len(nearest) == 0
+
+
+def test_leaf_store_spills_in_order():
+    store = voxelizer.LeafStore(memory_budget=64)
+    for begin in range(0, 100, 7):
+        store.append(np.arange(begin, min(begin + 7, 100)))
+    assert store.spilled and store.count == 100
+    values = np.concatenate(list(store.iter_values(count=9)))
+    assert values.tolist() == list(range(100))
+    store.close()
+
+
+def test_small_budget_gives_identical_leaves(torus):
+    triangles, origin, size = torus
+    depth = 6
+    unbounded = voxelizer.leaf_cells(triangles, origin, size, depth,
+                                     memory_budget=1 << 62)
+    bounded = voxelizer.leaf_cells(triangles, origin, size, depth,
+                                   memory_budget=4096)
+    assert len(bounded) > 4096 // 8
+    assert (bounded == unbounded).all()
+
+    # The frontier is split into several chunks, each in Morton order
+    chunks = list(voxelizer.iter_leaf_codes(triangles, origin, size, depth,
+                                            memory_budget=4096))
+    assert len(chunks) > 1
+    codes = np.concatenate(chunks)
+    assert (np.diff(codes.astype(np.int64)) > 0).all()